@@ -0,0 +1,59 @@
+"""Compares locking the same few files in a loop with and without the idle fd
+cache.
+
+A single thread repeatedly locks and unlocks one of ``--files`` files with
+:func:`dreadlocks.path_lock`. Without the cache, each lock opens and closes the
+file. We report the throughput in locks per second.
+
+Usage::
+
+    python benchmarks/idle_fd_cache.py [--files 1000] [--seconds 2]
+"""
+
+from argparse import ArgumentParser
+from itertools import cycle
+from os.path import join
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from dreadlocks import path_lock, set_idle_fd_cache
+
+
+def run(files: int, seconds: float) -> float:
+    with TemporaryDirectory() as directory:
+        paths = [join(directory, str(i)) for i in range(files)]
+        for path in paths:
+            Path(path).touch()
+
+        count = 0
+        end = perf_counter() + seconds
+        for path in cycle(paths):
+            with path_lock(path):
+                count += 1
+            if not count % 256 and perf_counter() >= end:
+                break
+
+        set_idle_fd_cache(0)
+
+    return count / seconds
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, nargs="+", default=[1, 100, 1000])
+    parser.add_argument("--seconds", type=float, default=2)
+    args = parser.parse_args()
+
+    columns = ("files", "no cache", "cache")
+    print(" | ".join(f"{column:>15}" for column in columns))
+    for files in args.files:
+        set_idle_fd_cache(0)
+        uncached = run(files, args.seconds)
+        set_idle_fd_cache()
+        cached = run(files, args.seconds)
+        print(f"{files:>15} | {uncached:>15.0f} | {cached:>15.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Compares pool throughput on disjoint keys for various numbers of shards.
+
+Each thread repeatedly refs and unrefs its own key of a file descriptor pool,
+opening and closing the file each time, as :func:`dreadlocks.path_lock` does
+when nobody else holds the path. We report the throughput in refs per second
+for a pool guarded by a single mutex held during I/O (as the pools used to
+be), and for sharded pools doing I/O outside of the shard lock. A simulated
+filesystem latency can be added to open and close with ``--latency``.
+
+Under the GIL, the gain of sharding comes from I/O and latency no longer being
+serialized on the pool mutex, which a slow filesystem makes most visible.
+
+Usage::
+
+    python benchmarks/pool_shards.py [--threads 1 2 4 8 16] [--latency 0.0001]
+"""
+
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from os import O_CREAT, O_RDWR, close, open as _open
+from os.path import join
+from tempfile import TemporaryDirectory
+from threading import Barrier, Event, Lock, Thread
+from time import sleep
+from typing import Callable, Iterator
+
+from dreadlocks.pool import ThreadSafeKeyedRefPool
+
+
+class GlobalMutexPool:
+    """The pool as it was before sharding, for reference"""
+
+    def __init__(self, factory: Callable[[str], int], destructor: Callable[[int], None]):
+        self._lock = Lock()
+        self._refs: dict[str, tuple[int, int]] = {}
+        self._factory = factory
+        self._destructor = destructor
+
+    @contextmanager
+    def __call__(self, key: str) -> Iterator[int]:
+        with self._lock:
+            obj, refcount = self._refs.get(key) or (self._factory(key), 0)
+            self._refs[key] = (obj, refcount + 1)
+        try:
+            yield obj
+        finally:
+            with self._lock:
+                obj, refcount = self._refs.pop(key)
+                if refcount > 1:
+                    self._refs[key] = (obj, refcount - 1)
+                else:
+                    self._destructor(obj)
+
+
+def run(shards: int, threads: int, seconds: float, latency: float) -> float:
+    def factory(path: str) -> int:
+        if latency:
+            sleep(latency)
+        return _open(path, O_RDWR | O_CREAT)
+
+    def destructor(fd: int):
+        if latency:
+            sleep(latency)
+        close(fd)
+
+    pool = (
+        GlobalMutexPool(factory, destructor)
+        if shards == 0
+        else ThreadSafeKeyedRefPool(factory, destructor, shards=shards)
+    )
+    counts = [0] * threads
+    start = Barrier(threads + 1)
+    stop = Event()
+
+    with TemporaryDirectory() as directory:
+
+        def worker(i: int):
+            path = join(directory, str(i))
+            start.wait()
+            while not stop.is_set():
+                with pool(path):
+                    counts[i] += 1
+
+        workers = [Thread(target=worker, args=(i,)) for i in range(threads)]
+        for thread in workers:
+            thread.start()
+        start.wait()
+        sleep(seconds)
+        stop.set()
+        for thread in workers:
+            thread.join()
+
+    return sum(counts) / seconds
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 64])
+    parser.add_argument("--seconds", type=float, default=2)
+    parser.add_argument("--latency", type=float, default=0)
+    args = parser.parse_args()
+
+    columns = ("global mutex", *(f"{shards} shard(s)" for shards in args.shards))
+    print(" | ".join(f"{column:>15}" for column in ("threads", *columns)))
+    for threads in args.threads:
+        results = [
+            run(shards, threads, args.seconds, args.latency)
+            for shards in (0, *args.shards)
+        ]
+        print(
+            " | ".join(
+                (f"{threads:>15}", *(f"{result:>15.0f}" for result in results))
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
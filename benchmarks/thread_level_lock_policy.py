@@ -0,0 +1,99 @@
+"""Compares thread-level lock policies under contention.
+
+Each thread repeatedly acquires a single :class:`ShareableThreadLock`, either
+shared or exclusively, holds it for a short while, and releases it. We report
+the throughput in acquisitions per second, and the median and worst-case time
+spent waiting for the lock, for readers and writers separately.
+
+Usage::
+
+    python benchmarks/thread_level_lock_policy.py [--threads 64] [--seconds 3]
+"""
+
+from argparse import ArgumentParser
+from random import Random
+from statistics import median
+from threading import Barrier, Event, Thread
+from time import perf_counter, sleep
+
+from dreadlocks.thread import Policy, ShareableThreadLock, policies
+
+
+def spin(seconds: float):
+    end = perf_counter() + seconds
+    while perf_counter() < end:
+        pass
+
+
+def run(policy: Policy, threads: int, seconds: float, writes: float, hold: float):
+    lock = ShareableThreadLock(policy)
+    waits: dict[bool, list[float]] = {True: [], False: []}
+    start = Barrier(threads + 1)
+    stop = Event()
+
+    def worker(seed: int):
+        random = Random(seed)
+        local: dict[bool, list[float]] = {True: [], False: []}
+        start.wait()
+        while not stop.is_set():
+            shared = random.random() >= writes
+            before = perf_counter()
+            lock.acquire(shared=shared)
+            local[shared].append(perf_counter() - before)
+            spin(hold)
+            lock.release(shared=shared)
+        for shared in (True, False):
+            waits[shared].extend(local[shared])
+
+    workers = [Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    start.wait()
+    sleep(seconds)
+    stop.set()
+    for thread in workers:
+        thread.join()
+
+    total = len(waits[True]) + len(waits[False])
+    return {
+        "policy": policy,
+        "throughput": total / seconds,
+        **{
+            f"{kind}_{stat}_ms": (fn(waits[shared]) * 1000 if waits[shared] else 0)
+            for kind, shared in (("read", True), ("write", False))
+            for stat, fn in (("median", median), ("max", max))
+        },
+    }
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--writes", type=float, default=0.1)
+    parser.add_argument("--hold", type=float, default=20e-6)
+    args = parser.parse_args()
+
+    columns = (
+        "policy",
+        "throughput",
+        "read_median_ms",
+        "read_max_ms",
+        "write_median_ms",
+        "write_max_ms",
+    )
+    print(" | ".join(f"{column:>15}" for column in columns))
+    for policy in policies:
+        result = run(policy, args.threads, args.seconds, args.writes, args.hold)
+        print(
+            " | ".join(
+                f"{result[column]:>15}"
+                if isinstance(result[column], str)
+                else f"{result[column]:>15.2f}"
+                for column in columns
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,14 @@
-"""The :mod:`dreadlocks` module exposes three context manager functions:
+"""The :mod:`dreadlocks` module exposes the context manager functions
 :func:`path_lock<dreadlocks.path_lock>`,
+:func:`path_lock_many<dreadlocks.path_lock_many>`,
 :func:`process_level_path_lock<dreadlocks.process_level_path_lock>`, and
-:func:`thread_level_path_lock<dreadlocks.thread_level_path_lock>`.
+:func:`thread_level_path_lock<dreadlocks.thread_level_path_lock>`, their
+asynchronous counterparts for asyncio tasks
+:func:`apath_lock<dreadlocks.apath_lock>`,
+:func:`aprocess_level_path_lock<dreadlocks.aprocess_level_path_lock>`, and
+:func:`athread_level_path_lock<dreadlocks.athread_level_path_lock>`, as well as
+the :func:`deadline<dreadlocks.deadline>` context manager to bound the time
+spent acquiring locks.
 
 Exception classes are part of the public API.
 Other exported functions are implementation details subject to change.
@@ -11,6 +18,8 @@ Caveats:
     subset of paths that could be locked simultaneously by the same thread and
     call :func:`dreadlocks.path_lock` multiple times respecting this total
     order. For instance via resolved absolute path lexicographical order.
+    :func:`dreadlocks.path_lock_many` does exactly that for a set of paths
+    that are locked together, using normalized path lexicographical order.
 
     The Linux implementation relies on :code:`fcntl`/:code:`lockf` which is
     infamous for being hard to work with: if you close any file descriptor for
@@ -25,7 +34,13 @@ Caveats:
     the :code:`closefd` flag as in :code:`open(fd, closefd=False)`. This makes
     writing to the lock file, or reading several times from the lock file, a
     bit challenging but not impossible (using :code:`fp.seek` and
-    :code:`fp.truncate`).
+    :code:`fp.truncate`). :class:`dreadlocks.LockedFile` reads and writes
+    through the fd at given offsets instead.
+
+    On Linux 3.15+, open file description locks are used instead by default,
+    see :func:`dreadlocks.set_process_level_lock_backend`. They are not
+    released when closing another fd of the same file, and each thread or
+    task holding a lock through :func:`dreadlocks.path_lock` gets its own fd.
 
     Another solution would be to use flock but since that can sometimes
     fallback to the :code:`fcntl`/:code:`lockf` implementation, we prefer to
@@ -68,26 +83,91 @@ Caveats:
     2^31-1 which might not be enough for files larger than 2GB. Again, we do
     not currently need this "functionality".
 
-    It is currently not possible to specify a timeout for acquiring a lock. The
-    only options currently are immediate failure or forever blocking.
+    Blocking acquisitions accept a timeout, and :func:`dreadlocks.deadline`
+    scopes bound all nested acquisitions. At the process level, neither
+    :code:`fcntl` nor :code:`msvcrt` can wait with a timeout, so a contended
+    timed acquisition waits for the kernel in a background thread. That kernel
+    request cannot be cancelled: on timeout, the process-level lock for that
+    file stays busy until the request resolves, at which point it is undone.
 """
 
-from .path_lock import path_lock
-from .process_level_path_lock import process_level_path_lock
-from .thread_level_path_lock import thread_level_path_lock
+from .path_lock import apath_lock, path_lock
+from .path_lock_many import path_lock_many
+from .claim import claim_any
+from .path_lock_handle import PathLock
+from .key_lock_namespace import KeyLockNamespace
+from .hierarchy import LockHierarchy
+from .held_path_lock import HeldPathLock, held_path_lock
+from .locked_file import LockedFile
+from .generation import GenerationLock, ReadCache, ageneration_lock, generation_lock
+from .watch import await_for_change, wait_for_change
+from .mapped_path_lock import MappedFile, amapped_path_lock, mapped_path_lock
+from .process_level_path_lock import aprocess_level_path_lock, process_level_path_lock
+from .thread_level_path_lock import athread_level_path_lock, thread_level_path_lock
+from .deadline import deadline
+from .policy import set_thread_level_lock_policy
+from .backend import set_process_level_lock_backend
+from .broker import Broker, set_broker_address
+from .globals import set_idle_fd_cache, set_pool_shards
+from .hooks import LockHooks, set_lock_hooks
+from .deadlock import set_deadlock_detection
+from .metrics import Metrics
 from .errors import (
     AcquiringLockWouldBlockError,
     AcquiringProcessLevelLockWouldBlockError,
     AcquiringThreadLevelLockWouldBlockError,
+    AcquiringLockTimedOutError,
+    AcquiringProcessLevelLockTimedOutError,
+    AcquiringThreadLevelLockTimedOutError,
+    DeadlockError,
     RecursiveDeadlockError,
+    LockOrderInversionError,
+    WaitForCycleError,
 )
 
 __all__ = [
     "path_lock",
+    "path_lock_many",
+    "claim_any",
+    "PathLock",
+    "KeyLockNamespace",
+    "LockHierarchy",
+    "held_path_lock",
+    "HeldPathLock",
+    "LockedFile",
+    "generation_lock",
+    "ageneration_lock",
+    "GenerationLock",
+    "ReadCache",
+    "wait_for_change",
+    "await_for_change",
+    "mapped_path_lock",
+    "amapped_path_lock",
+    "MappedFile",
     "process_level_path_lock",
     "thread_level_path_lock",
+    "apath_lock",
+    "aprocess_level_path_lock",
+    "athread_level_path_lock",
+    "deadline",
+    "set_thread_level_lock_policy",
+    "set_process_level_lock_backend",
+    "Broker",
+    "set_broker_address",
+    "set_pool_shards",
+    "set_idle_fd_cache",
+    "set_lock_hooks",
+    "LockHooks",
+    "Metrics",
+    "set_deadlock_detection",
     "AcquiringLockWouldBlockError",
     "AcquiringProcessLevelLockWouldBlockError",
     "AcquiringThreadLevelLockWouldBlockError",
+    "AcquiringLockTimedOutError",
+    "AcquiringProcessLevelLockTimedOutError",
+    "AcquiringThreadLevelLockTimedOutError",
+    "DeadlockError",
     "RecursiveDeadlockError",
+    "LockOrderInversionError",
+    "WaitForCycleError",
 ]
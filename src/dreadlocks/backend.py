@@ -0,0 +1,60 @@
+from typing import Literal, Optional
+
+from .platform import has_ofd_locks, is_windows
+
+Backend = Literal["lockf", "ofd", "broker"]
+"""How locks are implemented at the process-level:
+
+- :code:`"lockf"`: :code:`fcntl.lockf` on UNIX, :code:`msvcrt.locking` on
+  Windows. Locks are owned by the process, so that a single file descriptor is
+  shared by all threads of the process and the thread-level lock keeps track
+  of which threads hold it,
+- :code:`"ofd"`: open file description locks (Linux 3.15+). Locks are owned by
+  an open file description: :func:`dreadlocks.path_lock` opens one per thread
+  or task holding the lock, and the kernel arbitrates between them in a single
+  call, without process-level bookkeeping,
+- :code:`"broker"`: a lock broker process grants locks to each thread or task
+  over a UNIX domain socket, first come, first served, and releases those of
+  processes that disconnect. See :class:`dreadlocks.broker.Broker`. Brokers
+  only exclude their own clients, not kernel locks.
+
+There is no shared-memory backend: without atomic operations on shared memory
+in Python, it would not save the single kernel call an uncontended lock costs,
+see the usage documentation.
+"""
+
+backends: tuple[Backend, ...] = ("lockf", "ofd", "broker")
+
+_backend: Optional[Backend] = None
+
+
+def set_process_level_lock_backend(backend: Optional[Backend]) -> None:
+    """Sets how locks are implemented at the process-level.
+
+    See :data:`dreadlocks.backend.Backend`. The backend applies to locks
+    acquired afterwards. It is meant to be set once at startup, before any
+    path is locked.
+
+    Parameters
+    ----------
+    backend
+        One of :code:`"lockf"`, :code:`"ofd"`, or :code:`"broker"`. If None,
+        :code:`"ofd"` is picked if the kernel supports it (the default),
+        otherwise :code:`"lockf"`. With :code:`"broker"`, see
+        :func:`dreadlocks.broker.set_broker_address`.
+    """
+    global _backend
+    if backend is not None and backend not in backends:
+        raise ValueError(f"Unknown backend {backend!r}.")
+    if backend == "ofd" and not has_ofd_locks():
+        raise ValueError("Open file description locks are not supported.")
+    if backend == "broker" and is_windows:
+        raise ValueError("Lock brokers require UNIX domain sockets.")
+    _backend = backend
+
+
+def process_level_lock_backend() -> Backend:
+    global _backend
+    if _backend is None:
+        _backend = "ofd" if has_ofd_locks() else "lockf"
+    return _backend
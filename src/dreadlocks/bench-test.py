@@ -0,0 +1,32 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from dreadlocks.bench import compare, main, run, scenarios
+from dreadlocks.platform import is_windows
+
+
+@pytest.mark.parametrize("target", ["path_lock", "PathLock", "apath_lock"])
+def test_run(tmp_path: Path, target: str):
+    result = run(target, scenarios["contention"][-1], str(tmp_path), seconds=0.05)
+    assert result["target"] == target
+    assert (result["processes"], result["threads"]) == (2, 2)
+    assert result["operations"] > 0
+    assert 0 < result["latency_us"]["median"] <= result["latency_us"]["max"]
+
+
+def test_unknown_target(tmp_path: Path):
+    with pytest.raises(ValueError):
+        run("flock", scenarios["latency"][0], str(tmp_path))
+
+
+@pytest.mark.skipif(is_windows, reason="The lockf baseline is UNIX only.")
+def test_main(tmp_path: Path):
+    output = str(tmp_path / "results.json")
+    argv = ["--scenarios", "latency", "--targets", "path_lock", "lockf"]
+    main([*argv, "--seconds", "0.05", "--directory", str(tmp_path), "--output", output])
+    with open(output) as fp:
+        results = json.load(fp)["results"]
+    assert [result["target"] for result in results] == ["path_lock", "lockf"] * 2
+    assert len(compare(results, results)) == 4
@@ -0,0 +1,409 @@
+"""Reproducible benchmark scenarios to catch performance regressions.
+
+Each scenario runs workers, made of processes of threads (or asyncio tasks for
+asynchronous entry points), that repeatedly lock and unlock one of a number of
+paths, either shared or exclusively at random with a fixed seed, for a fixed
+duration. We report the throughput in locks per second and the latency of
+acquisitions in microseconds, as JSON so that runs can be compared.
+
+The :code:`"lockf"` target opens a path, locks it with :code:`fcntl.lockf`,
+unlocks it, and closes it, which shows the overhead of the wrapper layers. It
+does not exclude threads of the same process, and closing the file drops the
+locks of other threads of the process, so it is only a baseline for the cost
+of kernel locks, not a correct lock.
+
+Usage::
+
+    python -m dreadlocks.bench [--scenarios latency keys] [--targets path_lock
+    lockf] [--seconds 1] [--output results.json] [--compare baseline.json]
+"""
+
+import json
+import os
+import platform
+import sys
+from argparse import ArgumentParser
+from asyncio import gather, run as async_run, sleep as async_sleep
+from contextlib import (
+    AbstractAsyncContextManager,
+    AbstractContextManager,
+    contextmanager,
+)
+from multiprocessing import get_context
+from os.path import join
+from pathlib import Path
+from random import Random
+from tempfile import TemporaryDirectory
+from threading import Barrier, Thread
+from time import perf_counter, perf_counter_ns
+from typing import Any, Callable, Generator, Optional, TypedDict
+
+from .backend import (
+    Backend,
+    process_level_lock_backend,
+    set_process_level_lock_backend,
+)
+from .globals import set_idle_fd_cache
+from .path_lock import apath_lock, path_lock
+from .path_lock_handle import PathLock
+from .platform import is_windows
+from .process_level_path_lock import aprocess_level_path_lock, process_level_path_lock
+from .thread_level_path_lock import athread_level_path_lock, thread_level_path_lock
+
+
+@contextmanager
+def lockf(path: str, shared: bool = False) -> Generator[int, None, None]:
+    """Baseline locking a path with :code:`fcntl.lockf` directly"""
+    import fcntl
+
+    fd = os.open(path, os.O_RDWR)
+    try:
+        fcntl.lockf(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield fd
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+_handles: dict[tuple[str, bool], PathLock] = {}
+
+
+def _handle(path: str, shared: bool) -> PathLock:
+    """A handle per path and mode, reused by all threads of the process"""
+    handle = _handles.get((path, shared))
+    if handle is None:
+        handle = _handles[path, shared] = PathLock(path, shared=shared)
+    return handle
+
+
+_locks: dict[str, Callable[[str, bool], AbstractContextManager[Any]]] = {
+    "path_lock": lambda path, shared: path_lock(path, shared=shared),
+    "process_level_path_lock": lambda path, shared: process_level_path_lock(
+        path, shared=shared
+    ),
+    "thread_level_path_lock": lambda path, shared: thread_level_path_lock(
+        path, shared=shared
+    ),
+    "PathLock": _handle,
+    "lockf": lockf,
+}
+
+_alocks: dict[str, Callable[[str, bool], AbstractAsyncContextManager[Any]]] = {
+    "apath_lock": lambda path, shared: apath_lock(path, shared=shared),
+    "aprocess_level_path_lock": lambda path, shared: aprocess_level_path_lock(
+        path, shared=shared
+    ),
+    "athread_level_path_lock": lambda path, shared: athread_level_path_lock(
+        path, shared=shared
+    ),
+}
+
+targets = (*_locks, *_alocks)
+
+
+class Scenario(TypedDict):
+    scenario: str
+    processes: int
+    threads: int
+    keys: int
+    shared: float
+    idle_cache: bool
+
+
+class Latency(TypedDict):
+    median: float
+    p99: float
+    max: float
+
+
+class Result(Scenario):
+    target: str
+    operations: int
+    seconds: float
+    throughput: float
+    latency_us: Latency
+
+
+def _scenario(
+    scenario: str,
+    processes: int = 1,
+    threads: int = 1,
+    keys: int = 1,
+    shared: float = 0,
+    idle_cache: bool = False,
+) -> Scenario:
+    return Scenario(
+        scenario=scenario,
+        processes=processes,
+        threads=threads,
+        keys=keys,
+        shared=shared,
+        idle_cache=idle_cache,
+    )
+
+
+scenarios: dict[str, list[Scenario]] = {
+    # NOTE: Uncontended acquire/release of a single path by a single thread.
+    "latency": [_scenario("latency", shared=shared) for shared in (0, 1)],
+    # NOTE: Threads, processes, and a mix of both, on a single hot path.
+    "contention": [
+        _scenario("contention", processes, threads, shared=shared)
+        for processes, threads in ((1, 4), (4, 1), (2, 2))
+        for shared in (0.9, 0.1)
+    ],
+    # NOTE: A hot path versus many paths, exclusively.
+    "keys": [_scenario("keys", threads=4, keys=keys) for keys in (1, 64)],
+    # NOTE: Cycling through more paths than are ever locked at once, so that
+    # each acquisition opens and closes a file, unless cached.
+    "fd_churn": [
+        _scenario("fd_churn", keys=256, idle_cache=idle_cache)
+        for idle_cache in (False, True)
+    ],
+}
+
+
+def _thread(
+    lock: Callable[[str, bool], AbstractContextManager[Any]],
+    paths: list[str],
+    shared: float,
+    seconds: float,
+    rng: Random,
+    is_ready: Barrier,
+    latencies: list[int],
+):
+    is_ready.wait()
+    end = perf_counter() + seconds
+    while perf_counter() < end:
+        path = paths[rng.randrange(len(paths))]
+        started = perf_counter_ns()
+        with lock(path, rng.random() < shared):
+            latencies.append(perf_counter_ns() - started)
+
+
+async def _task(
+    lock: Callable[[str, bool], AbstractAsyncContextManager[Any]],
+    paths: list[str],
+    shared: float,
+    end: float,
+    rng: Random,
+    latencies: list[int],
+):
+    while perf_counter() < end:
+        path = paths[rng.randrange(len(paths))]
+        started = perf_counter_ns()
+        async with lock(path, rng.random() < shared):
+            latencies.append(perf_counter_ns() - started)
+        # NOTE: Uncontended acquisitions never yield to other tasks.
+        await async_sleep(0)
+
+
+def _work(
+    target: str,
+    scenario: Scenario,
+    paths: list[str],
+    seconds: float,
+    seed: int,
+    backend: Backend,
+    is_ready: Any = None,
+) -> list[int]:
+    """Runs the threads or tasks of a process, returns acquisition latencies
+    in nanoseconds"""
+    set_process_level_lock_backend(backend)
+    set_idle_fd_cache(None if scenario["idle_cache"] else 0)
+    threads = scenario["threads"]
+    shared = scenario["shared"]
+    rngs = [Random(seed * 1000 + i) for i in range(threads)]
+    latencies: list[list[int]] = [[] for _ in range(threads)]
+    try:
+        if is_ready is not None:
+            # NOTE: Processes start together, once spawned.
+            is_ready.wait()
+
+        if target in _alocks:
+            alock = _alocks[target]
+
+            async def tasks():
+                end = perf_counter() + seconds
+                await gather(
+                    *(
+                        _task(alock, paths, shared, end, rng, samples)
+                        for rng, samples in zip(rngs, latencies)
+                    )
+                )
+
+            async_run(tasks())
+        else:
+            lock = _locks[target]
+            are_ready = Barrier(threads)
+            workers = [
+                Thread(
+                    target=_thread,
+                    args=(lock, paths, shared, seconds, rng, are_ready, samples),
+                )
+                for rng, samples in zip(rngs, latencies)
+            ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+    finally:
+        for handle in _handles.values():
+            handle.close()
+        _handles.clear()
+        set_idle_fd_cache(0)
+    return [latency for samples in latencies for latency in samples]
+
+
+def _latency(samples: list[int]) -> Latency:
+    samples.sort()
+    if not samples:
+        return Latency(median=0, p99=0, max=0)
+
+    def at(q: float) -> float:
+        return samples[min(int(q * len(samples)), len(samples) - 1)] / 1000
+
+    return Latency(median=at(0.5), p99=at(0.99), max=samples[-1] / 1000)
+
+
+def run(
+    target: str,
+    scenario: Scenario,
+    directory: str,
+    seconds: float = 1,
+    seed: int = 0,
+) -> Result:
+    """Runs a scenario against a target.
+
+    Parameters
+    ----------
+    target
+        One of :data:`targets`.
+    scenario
+        One of the scenarios of :data:`scenarios`.
+    directory
+        Where to create the lock files, whose file system matters.
+    seconds
+        How long each worker locks and unlocks paths.
+    seed
+        Seeds the choice of paths and modes of each worker.
+    """
+    if target not in targets:
+        raise ValueError(f"Unknown target {target!r}, expected one of {targets}.")
+    paths = [join(directory, f"{i}.lock") for i in range(scenario["keys"])]
+    for path in paths:
+        Path(path).touch()
+
+    backend = process_level_lock_backend()
+    processes = scenario["processes"]
+    if processes == 1:
+        samples = _work(target, scenario, paths, seconds, seed, backend)
+    else:
+        mp = get_context(method="spawn")
+        with mp.Manager() as manager, mp.Pool(processes) as pool:
+            is_ready = manager.Barrier(processes)
+            results = [
+                pool.apply_async(
+                    _work,
+                    (target, scenario, paths, seconds, seed + i, backend, is_ready),
+                )
+                for i in range(processes)
+            ]
+            samples = [latency for result in results for latency in result.get()]
+
+    return Result(
+        **scenario,
+        target=target,
+        operations=len(samples),
+        seconds=seconds,
+        throughput=len(samples) / seconds,
+        latency_us=_latency(samples),
+    )
+
+
+def _key(result: Result) -> tuple[Any, ...]:
+    fields: dict[str, Any] = dict(result)
+    return tuple(fields[key] for key in (*Scenario.__annotations__, "target"))
+
+
+def compare(baseline: list[Result], results: list[Result]) -> list[str]:
+    """Lines comparing the throughput and median latency of results with a
+    baseline run of the same scenarios"""
+    before = {_key(result): result for result in baseline}
+    lines: list[str] = []
+    for result in results:
+        old = before.get(_key(result))
+        if old is None or not old["throughput"] or not old["latency_us"]["median"]:
+            continue
+        lines.append(
+            " ".join(
+                (
+                    f"{result['scenario']:<12}",
+                    f"{result['target']:<26}",
+                    f"{result['processes']}x{result['threads']}",
+                    f"keys={result['keys']:<4}",
+                    f"shared={result['shared']:<4}",
+                    f"idle_cache={result['idle_cache']!s:<6}",
+                    f"throughput {result['throughput'] / old['throughput']:>6.2f}x",
+                    f"median {result['latency_us']['median'] / old['latency_us']['median']:>6.2f}x",
+                )
+            )
+        )
+    return lines
+
+
+def main(argv: Optional[list[str]] = None):
+    assert __doc__ is not None
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=tuple(scenarios), default=tuple(scenarios)
+    )
+    parser.add_argument(
+        "--targets",
+        nargs="+",
+        choices=targets,
+        default=tuple(
+            target for target in targets if target != "lockf" or not is_windows
+        ),
+    )
+    parser.add_argument("--seconds", type=float, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--directory", help="where to create lock files")
+    parser.add_argument("--output", help="write JSON results there")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    args = parser.parse_args(argv)
+
+    results: list[Result] = []
+    with TemporaryDirectory(dir=args.directory) as directory:
+        for name in args.scenarios:
+            for scenario in scenarios[name]:
+                for target in args.targets:
+                    results.append(
+                        run(target, scenario, directory, args.seconds, args.seed)
+                    )
+                    print(json.dumps(results[-1]), file=sys.stderr)
+
+    report = {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "backend": process_level_lock_backend(),
+        "results": results,
+    }
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)["results"]
+        for line in compare(baseline, results):
+            print(line, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+import asyncio
+import os
+import socket
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from threading import Thread
+from time import monotonic, sleep
+from typing import Any, Callable, Iterator
+
+import pytest
+
+from dreadlocks import (
+    AcquiringLockWouldBlockError,
+    AcquiringProcessLevelLockTimedOutError,
+    Broker,
+    apath_lock,
+    held_path_lock,
+    path_lock,
+    path_lock_many,
+    process_level_path_lock,
+    set_broker_address,
+    set_process_level_lock_backend,
+)
+from dreadlocks.broker import BrokerClient, broker_client, default_address
+from dreadlocks.platform import is_windows
+
+pytestmark = pytest.mark.skipif(
+    is_windows, reason="Lock brokers require UNIX domain sockets."
+)
+
+mp = get_context(method="spawn")
+
+
+def use_broker(address: str):
+    set_broker_address(address)
+    set_process_level_lock_backend("broker")
+
+
+@pytest.fixture
+def address(tmp_path: Path) -> Iterator[str]:
+    broker = Broker(str(tmp_path / "broker.sock"))
+    broker.start()
+    use_broker(broker.address)
+    try:
+        yield broker.address
+    finally:
+        set_process_level_lock_backend(None)
+        set_broker_address(None)
+        broker.close()
+
+
+def can_lock(path: str, shared: bool = False) -> bool:
+    try:
+        with path_lock(path, shared=shared, blocking=False):
+            return True
+    except AcquiringLockWouldBlockError:
+        return False
+
+
+def times_out(path: str) -> bool:
+    try:
+        with path_lock_many([path], timeout=0.05):
+            return False
+    except AcquiringProcessLevelLockTimedOutError:
+        return True
+
+
+def until(predicate: Callable[[], Any]):
+    started = monotonic()
+    while not predicate():
+        assert monotonic() - started < 10
+        sleep(0.001)
+
+
+def test_excludes_threads_and_processes(address: str, tmp_path: Path):
+    path = str(tmp_path / "lock")
+    Path(path).touch()
+    with (
+        ThreadPoolExecutor(1) as threads,
+        ProcessPoolExecutor(
+            1, mp_context=mp, initializer=use_broker, initargs=(address,)
+        ) as processes,
+    ):
+        with path_lock(path, shared=True):
+            assert threads.submit(can_lock, path, True).result()
+            assert processes.submit(can_lock, path, True).result()
+            assert not threads.submit(can_lock, path).result()
+            assert not processes.submit(can_lock, path).result()
+        assert threads.submit(can_lock, path).result()
+        assert processes.submit(can_lock, path).result()
+
+
+def test_first_come_first_served(address: str):
+    client = BrokerClient(address)
+    granted: list[str] = []
+
+    def acquire(owner: str, shared: bool):
+        client.acquire([("key", shared, 0, 10)], owner)
+        granted.append(owner)
+
+    def queued() -> int:
+        return sum(len(key["queued"]) for key in client.status())
+
+    try:
+        client.acquire([("key", False, 0, 10)], "a")
+        # NOTE: Disjoint regions do not conflict.
+        client.acquire([("key", False, 10, 20)], "b", blocking=False)
+        waiters = [
+            Thread(target=acquire, args=args) for args in (("c", False), ("d", True))
+        ]
+        for n, waiter in enumerate(waiters, 1):
+            waiter.start()
+            until(lambda: queued() == n)
+        # NOTE: Shared requests do not overtake the exclusive one queued first.
+        with pytest.raises(AcquiringLockWouldBlockError):
+            client.acquire([("key", True, 0, 10)], "e", blocking=False)
+        # NOTE: Owners never conflict with themselves.
+        client.acquire([("key", True, 0, 10)], "a", blocking=False)
+        client.release([("key", True, 0, 10), ("key", False, 0, 10)], "a")
+        waiters[0].join()
+        assert granted == ["c"]
+        client.release([("key", False, 0, 10)], "c")
+        waiters[1].join()
+        assert granted == ["c", "d"]
+    finally:
+        client.close()
+
+
+def test_disconnecting_releases(address: str):
+    first = BrokerClient(address)
+    second = BrokerClient(address)
+    try:
+        first.acquire([("a", False, 0, 10), ("b", True, 0, 10)], "owner")
+        with pytest.raises(AcquiringLockWouldBlockError):
+            second.acquire([("b", False, 0, 10)], "owner", blocking=False)
+        first.close()
+        second.acquire(
+            [("a", False, 0, 10), ("b", False, 0, 10)], "owner", True, monotonic() + 10
+        )
+    finally:
+        second.close()
+
+
+def test_timeout(address: str, tmp_path: Path):
+    path = str(tmp_path / "lock")
+    Path(path).touch()
+    with ProcessPoolExecutor(
+        1, mp_context=mp, initializer=use_broker, initargs=(address,)
+    ) as processes:
+        with path_lock(path):
+            assert processes.submit(times_out, path).result()
+        # NOTE: The abandoned request was cancelled, or released once granted.
+        until(lambda: not broker_client().status())
+        assert processes.submit(can_lock, path).result()
+
+
+def test_batches_and_status(address: str, tmp_path: Path):
+    paths = [str(tmp_path / name) for name in ("b", "a", "b")]
+    for path in paths:
+        Path(path).touch()
+    with path_lock_many(paths, shared=True) as fds:
+        assert set(fds) == set(paths)
+        status = broker_client().status()
+        assert sorted(key["path"] for key in status) == sorted(set(paths))
+        assert all(
+            len(key["holds"]) == 1 and key["holds"][0]["shared"] for key in status
+        )
+    assert not broker_client().status()
+
+
+def test_upgrades(address: str, tmp_path: Path):
+    path = str(tmp_path / "lock")
+    Path(path).touch()
+    with ThreadPoolExecutor(1) as threads:
+        with held_path_lock(path) as lock:
+            assert threads.submit(can_lock, path, True).result()
+            lock.upgrade()
+            assert not threads.submit(can_lock, path, True).result()
+            lock.downgrade()
+            assert threads.submit(can_lock, path, True).result()
+
+
+def test_tasks(address: str, tmp_path: Path):
+    path = str(tmp_path / "lock")
+    Path(path).touch()
+    held: list[int] = []
+
+    async def hold(n: int):
+        async with apath_lock(path):
+            held.append(n)
+            await asyncio.sleep(0.01)
+            held.append(n)
+
+    async def main():
+        await asyncio.gather(*map(hold, range(3)))
+
+    asyncio.run(main())
+    assert held[::2] == held[1::2]
+
+
+def test_process_level_path_lock_is_not_supported(address: str, tmp_path: Path):
+    with pytest.raises(NotImplementedError):
+        process_level_path_lock(str(tmp_path / "lock"))
+
+
+def test_default_address_is_private(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    monkeypatch.delenv("DREADLOCKS_BROKER", raising=False)
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    assert default_address() == str(tmp_path / "dreadlocks.sock")
+    monkeypatch.delenv("XDG_RUNTIME_DIR")
+    monkeypatch.setenv("TMPDIR", str(tmp_path))
+    monkeypatch.setattr("tempfile.tempdir", None)
+    directory = tmp_path / f"dreadlocks-{os.getuid()}"
+    assert default_address() == str(directory / "dreadlocks.sock")
+    assert directory.stat().st_mode & 0o777 == 0o700
+    directory.chmod(0o755)
+    with pytest.raises(PermissionError):
+        default_address()
+
+
+def test_refuses_brokers_of_other_users(address: str, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(os, "getuid", lambda: os.geteuid() + 1)
+    with pytest.raises(PermissionError):
+        BrokerClient(address)
+
+
+def test_drops_clients_sending_endless_lines(address: str):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(10)
+        client.connect(address)
+        try:
+            client.sendall(b"x" * (4 << 20))
+        except OSError:
+            # NOTE: The broker closed the connection before reading it all.
+            pass
+        try:
+            assert not client.recv(1)
+        except ConnectionResetError:
+            pass
+
+
+def test_holders_learn_about_lost_connections(tmp_path: Path):
+    path = str(tmp_path / "lock")
+    other = str(tmp_path / "other")
+    Path(path).touch()
+    Path(other).touch()
+    address = str(tmp_path / "broker.sock")
+    broker = Broker(address)
+    broker.start()
+    use_broker(address)
+    try:
+        with pytest.raises(ConnectionError):
+            with path_lock(path):
+                client = broker_client()
+                broker.close()
+                until(lambda: client.closed)
+                broker = Broker(address)
+                broker.start()
+                # NOTE: Other owners lock through a new connection.
+                with ThreadPoolExecutor(1) as threads:
+                    assert threads.submit(can_lock, other).result()
+                with pytest.raises(ConnectionError):
+                    with path_lock(other):
+                        pass
+        with path_lock(path):
+            pass
+    finally:
+        set_process_level_lock_backend(None)
+        set_broker_address(None)
+        broker.close()
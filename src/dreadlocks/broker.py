@@ -0,0 +1,1005 @@
+import os
+import socket
+import struct
+from argparse import ArgumentParser
+from collections import Counter
+from asyncio import (
+    AbstractEventLoop,
+    AbstractServer,
+    BaseTransport,
+    Protocol,
+    Transport,
+    TimeoutError as AsyncTimeoutError,
+    get_running_loop,
+    new_event_loop,
+    run,
+    shield,
+    wait_for,
+    wrap_future,
+)
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from functools import partial
+from itertools import count
+from json import dumps, loads
+from operator import attrgetter
+from signal import SIGTERM, default_int_handler, signal
+from os import environ, fstat, getpid, lstat, mkdir, path as os_path, unlink
+from stat import S_ISDIR
+from tempfile import gettempdir
+from threading import Lock, Thread, get_ident
+from time import perf_counter
+from typing import Any, Hashable, Iterable, NamedTuple, Optional
+
+from . import hooks
+from .deadline import remaining
+from .errors import (
+    AcquiringProcessLevelLockTimedOutError,
+    AcquiringProcessLevelLockWouldBlockError,
+)
+from .hooks import OnWait
+from .platform import is_windows
+from .region import END, overlap
+
+Item = tuple[str, bool, int, int]
+"""A file key, whether the lock is shared, and the region to lock, from start
+to end"""
+
+
+# NOTE: Messages are well under a kilobyte, unless a batch locks many paths.
+_max_line = 1 << 20
+
+_lost_message = "Lost the connection to the lock broker, which released the locks."
+
+
+def _encode(message: dict[str, Any]) -> bytes:
+    return dumps(message, separators=(",", ":")).encode() + b"\n"
+
+
+def file_key(fd: int) -> str:
+    """Identifies the file of fd by device and inode, as the kernel does, so
+    that all paths to a file, from any working directory, lock the same key"""
+    stat = fstat(fd)
+    return f"{stat.st_dev}:{stat.st_ino}"
+
+
+def owner_key(owner: Hashable) -> str:
+    """Identifies a thread or asyncio task within its process"""
+    if isinstance(owner, int):
+        return str(owner)
+    return f"{type(owner).__name__}-{id(owner):x}"
+
+
+def default_address() -> str:
+    """The :code:`DREADLOCKS_BROKER` environment variable if set, otherwise a
+    socket in :code:`$XDG_RUNTIME_DIR`, or else in a directory of the
+    temporary directory that only the current user can access"""
+    address = environ.get("DREADLOCKS_BROKER")
+    if address:
+        return address
+    directory = environ.get("XDG_RUNTIME_DIR")
+    if not directory:
+        directory = _private_directory(
+            os_path.join(gettempdir(), f"dreadlocks-{os.getuid()}")
+        )
+    return os_path.join(directory, "dreadlocks.sock")
+
+
+def _private_directory(path: str) -> str:
+    """Creates a directory only the current user can access, or checks that
+    it is one, so that other users can neither pose as the broker nor connect
+    to it"""
+    try:
+        mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    stat = lstat(path)
+    if not S_ISDIR(stat.st_mode) or stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+        raise PermissionError(
+            f"{path} is not a directory that only the current user can access."
+        )
+    return path
+
+
+def _check_peer(sock: socket.socket, address: str):
+    """Checks that the broker runs as the current user"""
+    if hasattr(socket, "SO_PEERCRED"):
+        credentials = sock.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+        )
+        _, uid, _ = struct.unpack("3i", credentials)
+    else:
+        # NOTE: Whoever listens on the socket created its file.
+        uid = os.stat(address).st_uid
+    if uid != os.getuid():
+        raise PermissionError(f"The lock broker on {address} runs as another user.")
+
+
+class _Request:
+    __slots__ = ("connection", "id", "owner", "items", "seq")
+
+    def __init__(
+        self,
+        connection: "_Connection",
+        id: int,
+        owner: str,
+        items: list[Item],
+        seq: int,
+    ):
+        self.connection = connection
+        self.id = id
+        self.owner = owner
+        self.items = items
+        self.seq = seq
+
+
+class _Hold(NamedTuple):
+    connection: "_Connection"
+    owner: str
+    shared: bool
+    start: int
+    end: int
+
+
+class _Table:
+    """Holds and queued requests of each key.
+
+    Requests lock all their items at once, or wait until they can, so that
+    batches never hold some keys while waiting for others. Requests are
+    granted first come, first served: a request waits for the holds and the
+    queued requests it conflicts with, unless its owner already holds the
+    key, in which case it only waits for holds, since queued requests may
+    wait for it. Holds of an owner never conflict with each other, so that
+    owners can lock recursively, upgrade, and downgrade.
+    """
+
+    def __init__(self):
+        self._holds: dict[str, list[_Hold]] = {}
+        self._queues: dict[str, list[_Request]] = {}
+        self._queued: dict[tuple["_Connection", int], _Request] = {}
+        self._names: dict[str, str] = {}
+        self._seq = count()
+
+    def request(
+        self, connection: "_Connection", id: int, owner: str, items: list[Item]
+    ) -> _Request:
+        return _Request(connection, id, owner, items, next(self._seq))
+
+    def acquire(
+        self, request: _Request, blocking: bool, names: dict[str, str]
+    ) -> Optional[bool]:
+        """Whether the request was granted, or None if it was queued"""
+        if self._grantable(request):
+            self._names.update(names)
+            self._grant(request)
+            return True
+        if not blocking:
+            return False
+        self._names.update(names)
+        for key, *_ in request.items:
+            self._queues.setdefault(key, []).append(request)
+        self._queued[request.connection, request.id] = request
+        return None
+
+    def release(
+        self, connection: "_Connection", owner: str, items: Iterable[Item]
+    ) -> list[_Request]:
+        """Releases a hold of each item, and returns the requests granted as a
+        result"""
+        keys: list[str] = []
+        for key, shared, start, end in items:
+            holds = self._holds.get(key)
+            hold = _Hold(connection, owner, shared, start, end)
+            if holds is not None and hold in holds:
+                holds.remove(hold)
+                if not holds:
+                    del self._holds[key]
+                keys.append(key)
+        return self._wake(keys)
+
+    def cancel(
+        self, connection: "_Connection", id: int
+    ) -> tuple[Optional[_Request], list[_Request]]:
+        """Dequeues a request if still queued, and returns it along with the
+        requests granted as a result"""
+        request = self._queued.get((connection, id))
+        if request is None:
+            return None, []
+        self._dequeue(request)
+        return request, self._wake(key for key, *_ in request.items)
+
+    def disconnect(self, connection: "_Connection") -> list[_Request]:
+        """Forgets all holds and requests of connection, and returns the
+        requests granted as a result"""
+        keys: list[str] = []
+        for request in [r for r in self._queued.values() if r.connection is connection]:
+            self._dequeue(request)
+            keys.extend(key for key, *_ in request.items)
+        for key, holds in list(self._holds.items()):
+            kept = [hold for hold in holds if hold.connection is not connection]
+            if len(kept) == len(holds):
+                continue
+            keys.append(key)
+            if kept:
+                self._holds[key] = kept
+            else:
+                del self._holds[key]
+        return self._wake(keys)
+
+    def status(self) -> list[dict[str, Any]]:
+        """Holds and queued requests of each key, for monitoring"""
+
+        def describe(
+            connection: "_Connection", owner: str, shared: bool, start: int, end: int
+        ) -> dict[str, Any]:
+            return {
+                "pid": connection.pid,
+                "owner": owner,
+                "shared": shared,
+                "start": start,
+                "length": 0 if end == END else end - start,
+            }
+
+        keys = sorted({*self._holds, *self._queues})
+        return [
+            {
+                "key": key,
+                "path": self._names.get(key),
+                "holds": [describe(*hold) for hold in self._holds.get(key, ())],
+                "queued": [
+                    describe(request.connection, request.owner, *item[1:])
+                    for request in self._queues.get(key, ())
+                    for item in request.items
+                    if item[0] == key
+                ],
+            }
+            for key in keys
+        ]
+
+    def _grantable(self, request: _Request) -> bool:
+        for key, shared, start, end in request.items:
+            holds = self._holds.get(key, ())
+            holder = False
+            for hold in holds:
+                if (
+                    hold.connection is request.connection
+                    and hold.owner == request.owner
+                ):
+                    holder = True
+                elif not (shared and hold.shared) and overlap(
+                    (start, end), (hold.start, hold.end)
+                ):
+                    return False
+            if holder:
+                continue
+            for other in self._queues.get(key, ()):
+                if other.seq >= request.seq:
+                    break
+                if (
+                    other.connection is request.connection
+                    and other.owner == request.owner
+                ):
+                    continue
+                for other_key, other_shared, other_start, other_end in other.items:
+                    if (
+                        other_key == key
+                        and not (shared and other_shared)
+                        and overlap((start, end), (other_start, other_end))
+                    ):
+                        return False
+        return True
+
+    def _grant(self, request: _Request):
+        for key, shared, start, end in request.items:
+            self._holds.setdefault(key, []).append(
+                _Hold(request.connection, request.owner, shared, start, end)
+            )
+
+    def _dequeue(self, request: _Request):
+        del self._queued[request.connection, request.id]
+        for key, *_ in request.items:
+            queue = self._queues[key]
+            if request in queue:
+                queue.remove(request)
+            if not queue:
+                del self._queues[key]
+
+    def _wake(self, keys: Iterable[str]) -> list[_Request]:
+        keys = set(keys)
+        queued = {request for key in keys for request in self._queues.get(key, ())}
+        granted: list[_Request] = []
+        for request in sorted(queued, key=attrgetter("seq")):
+            if self._grantable(request):
+                self._dequeue(request)
+                self._grant(request)
+                granted.append(request)
+        for key in keys:
+            if key not in self._holds and key not in self._queues:
+                self._names.pop(key, None)
+        return granted
+
+
+class _Connection(Protocol):
+    """A client of the broker, which sends and receives one JSON message per
+    line"""
+
+    def __init__(self, broker: "Broker"):
+        self._broker = broker
+        self._buffer = b""
+        self._transport: Optional[Transport] = None
+        self.pid: Optional[int] = None
+
+    def connection_made(self, transport: BaseTransport) -> None:
+        assert isinstance(transport, Transport)
+        self._transport = transport
+        self._broker._connections.add(self)  # type: ignore [reportPrivateUsage]
+
+    def data_received(self, data: bytes) -> None:
+        *lines, self._buffer = (self._buffer + data).split(b"\n")
+        try:
+            for line in lines:
+                self._broker._handle(self, loads(line))  # type: ignore [reportPrivateUsage]
+            if len(self._buffer) > _max_line:
+                # NOTE: Rather than buffering a line that never ends.
+                self._buffer = b""
+                self.close()
+        except (ValueError, KeyError, TypeError):
+            # NOTE: The client does not speak our protocol.
+            self.close()
+        finally:
+            # NOTE: Replies to all requests of the chunk go out together.
+            self._broker._flush()  # type: ignore [reportPrivateUsage]
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self._broker._disconnect(self)  # type: ignore [reportPrivateUsage]
+
+    def write(self, data: bytes):
+        if self._transport is not None and not self._transport.is_closing():
+            self._transport.write(data)
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+
+
+def _remove_stale(address: str):
+    """Removes the socket of a broker that is gone"""
+    if not os_path.exists(address):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(address)
+        except (ConnectionRefusedError, FileNotFoundError):
+            unlink(address)
+            return
+    raise OSError(f"A broker already listens on {address}.")
+
+
+class Broker:
+    """A lock broker, which grants shared and exclusive locks on keys to the
+    threads and tasks of client processes over a UNIX domain socket.
+
+    Clients pipeline requests over a single connection per process, and a
+    request can lock or release several keys at once. Requests are granted
+    first come, first served, and all locks of a client are released when it
+    disconnects, for instance because it exited or crashed. See
+    :func:`dreadlocks.set_process_level_lock_backend` to lock paths through a
+    broker, and :meth:`BrokerClient.status` to see who holds and waits for
+    which paths.
+
+    Run one per host with :code:`python -m dreadlocks`, or embed one
+    with :meth:`start`.
+
+    Parameters
+    ----------
+    address
+        The path of the socket to listen on. Defaults to
+        :func:`dreadlocks.broker.broker_address`.
+    """
+
+    def __init__(self, address: Optional[str] = None):
+        self.address = broker_address() if address is None else address
+        self._table = _Table()
+        self._connections: set[_Connection] = set()
+        self._outbox: dict[_Connection, list[bytes]] = {}
+        self._loop: Optional[AbstractEventLoop] = None
+        self._server: Optional[AbstractServer] = None
+        self._thread: Optional[Thread] = None
+
+    async def serve_forever(self) -> None:
+        """Serves clients until cancelled"""
+        server = await self._listen(get_running_loop())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self._unlink()
+
+    def start(self) -> None:
+        """Serves clients in a background thread, once listening, until
+        :meth:`close` is called"""
+        loop = new_event_loop()
+        self._server = loop.run_until_complete(self._listen(loop))
+        self._loop = loop
+        self._thread = Thread(
+            target=loop.run_forever, name="dreadlocks-broker", daemon=True
+        )
+        self._thread.start()
+
+    def close(self) -> None:
+        """Stops serving clients started with :meth:`start`, which lose their
+        locks"""
+        loop, server, thread = self._loop, self._server, self._thread
+        if loop is None or server is None or thread is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        server.close()
+        for connection in list(self._connections):
+            connection.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
+        self._unlink()
+        self._loop = self._server = self._thread = None
+
+    async def _listen(self, loop: AbstractEventLoop) -> AbstractServer:
+        _remove_stale(self.address)
+        return await loop.create_unix_server(partial(_Connection, self), self.address)
+
+    def _unlink(self):
+        try:
+            unlink(self.address)
+        except FileNotFoundError:
+            pass
+
+    def _handle(self, connection: _Connection, message: dict[str, Any]):
+        op = message["op"]
+        if op == "acquire":
+            request = self._table.request(
+                connection,
+                int(message["id"]),
+                str(message["owner"]),
+                [_item(item) for item in message["items"]],
+            )
+            granted = self._table.acquire(
+                request, bool(message["blocking"]), dict(message.get("names", {}))
+            )
+            if granted is not None:
+                self._reply(request, granted, False)
+        elif op == "release":
+            owner = str(message["owner"])
+            items = [_item(item) for item in message["items"]]
+            self._granted(self._table.release(connection, owner, items))
+        elif op == "cancel":
+            request, granted = self._table.cancel(connection, int(message["id"]))
+            if request is not None:
+                self._reply(request, False, True)
+            self._granted(granted)
+        elif op == "status":
+            self._send(connection, {"id": message["id"], "keys": self._table.status()})
+        elif op == "hello":
+            connection.pid = int(message["pid"])
+        else:
+            raise ValueError(f"Unknown operation {op!r}.")
+
+    def _disconnect(self, connection: _Connection):
+        self._connections.discard(connection)
+        self._outbox.pop(connection, None)
+        self._granted(self._table.disconnect(connection))
+        self._flush()
+
+    def _granted(self, requests: list[_Request]):
+        for request in requests:
+            self._reply(request, True, True)
+
+    def _reply(self, request: _Request, granted: bool, queued: bool):
+        self._send(
+            request.connection, {"id": request.id, "granted": granted, "queued": queued}
+        )
+
+    def _send(self, connection: _Connection, message: dict[str, Any]):
+        self._outbox.setdefault(connection, []).append(_encode(message))
+
+    def _flush(self):
+        outbox, self._outbox = self._outbox, {}
+        for connection, messages in outbox.items():
+            connection.write(b"".join(messages))
+
+
+def _item(item: list[Any]) -> Item:
+    key, shared, start, end = item
+    return (str(key), bool(shared), int(start), int(end))
+
+
+class BrokerClient:
+    """A connection to a lock broker, shared by all threads and asyncio tasks
+    of a process.
+
+    Requests of all threads are pipelined over the connection, and a
+    background thread hands replies over to them. Owners are the threads and
+    tasks of the process, see :func:`owner_key`. The client counts the holds
+    of each owner, so that once the connection is lost, and the broker
+    released them, releasing them raises instead.
+
+    Parameters
+    ----------
+    address
+        The path of the socket the broker listens on, which must run as the
+        current user.
+    """
+
+    def __init__(self, address: str):
+        self.address = address
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._socket.connect(address)
+            _check_peer(self._socket, address)
+        except BaseException:
+            self._socket.close()
+            raise
+        self._lock = Lock()
+        self._ids = count(1)
+        # NOTE: The future of each request, with the owner and number of items
+        # of acquisitions.
+        self._pending: dict[int, tuple[Future[dict[str, Any]], str, int]] = {}
+        self._holds: Counter[str] = Counter()
+        self._error: Optional[BaseException] = None
+        self._socket.sendall(_encode({"op": "hello", "pid": getpid()}))
+        Thread(target=self._read, name="dreadlocks-broker-client", daemon=True).start()
+
+    @property
+    def closed(self) -> bool:
+        return self._error is not None
+
+    @property
+    def held(self) -> bool:
+        """Whether any owner holds locks through this connection"""
+        return bool(self._holds)
+
+    def holds(self, owner: str) -> bool:
+        """Whether owner holds locks through this connection"""
+        return self._holds[owner] > 0
+
+    def acquire(
+        self,
+        items: list[Item],
+        owner: str,
+        blocking: bool = True,
+        deadline: Optional[float] = None,
+        on_wait: OnWait = None,
+        names: Optional[dict[str, str]] = None,
+    ) -> None:
+        """Locks all items at once on behalf of owner, in a single round trip"""
+        id, future = self._acquire(items, owner, blocking, names)
+        try:
+            reply = future.result(remaining(deadline))
+        except BaseException as error:
+            self._abandon(id, future, items, owner)
+            if isinstance(error, FutureTimeoutError):
+                raise AcquiringProcessLevelLockTimedOutError() from None
+            raise
+        self._check(reply, on_wait)
+
+    async def aacquire(
+        self,
+        items: list[Item],
+        owner: str,
+        blocking: bool = True,
+        deadline: Optional[float] = None,
+        on_wait: OnWait = None,
+        names: Optional[dict[str, str]] = None,
+    ) -> None:
+        """Asynchronous counterpart of :meth:`acquire`, which never blocks the
+        event loop"""
+        id, future = self._acquire(items, owner, blocking, names)
+        try:
+            reply = await wait_for(shield(wrap_future(future)), remaining(deadline))
+        except BaseException as error:
+            self._abandon(id, future, items, owner)
+            if isinstance(error, AsyncTimeoutError):
+                raise AcquiringProcessLevelLockTimedOutError() from None
+            raise
+        self._check(reply, on_wait)
+
+    def release(self, items: list[Item], owner: str) -> None:
+        """Releases a hold of each item on behalf of owner, without waiting
+        for the broker. Raises :class:`ConnectionError` if the connection was
+        lost, since the broker released them already."""
+        with self._lock:
+            held = self._holds[owner] - len(items)
+            if held > 0:
+                self._holds[owner] = held
+            else:
+                self._holds.pop(owner, None)
+            if self._error is not None:
+                raise ConnectionError(_lost_message)
+            self._socket.sendall(
+                _encode({"op": "release", "owner": owner, "items": items})
+            )
+
+    def status(self) -> list[dict[str, Any]]:
+        """Which owners of which processes hold and wait for which keys.
+
+        Returns
+        -------
+        list[dict[str, Any]]
+            For each key, the path it was last locked through, and its holds
+            and queued requests, in order.
+        """
+        _, future = self._request({"op": "status"})
+        return future.result()["keys"]
+
+    def close(self) -> None:
+        """Disconnects from the broker, which releases all locks of the
+        process"""
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+
+    def _acquire(
+        self,
+        items: list[Item],
+        owner: str,
+        blocking: bool,
+        names: Optional[dict[str, str]],
+    ) -> tuple[int, "Future[dict[str, Any]]"]:
+        message: dict[str, Any] = {
+            "op": "acquire",
+            "owner": owner,
+            "items": items,
+            "blocking": blocking,
+        }
+        if names:
+            message["names"] = names
+        return self._request(message, owner, len(items))
+
+    def _request(
+        self, message: dict[str, Any], owner: str = "", items: int = 0
+    ) -> tuple[int, "Future[dict[str, Any]]"]:
+        future: Future[dict[str, Any]] = Future()
+        with self._lock:
+            if self._error is not None:
+                raise ConnectionError("Lost the connection to the lock broker.")
+            id = next(self._ids)
+            self._pending[id] = (future, owner, items)
+            self._socket.sendall(_encode({**message, "id": id}))
+        return id, future
+
+    def _check(self, reply: dict[str, Any], on_wait: OnWait):
+        if reply["queued"] and on_wait is not None:
+            on_wait()
+        if not reply["granted"]:
+            raise AcquiringProcessLevelLockWouldBlockError()
+
+    def _abandon(
+        self,
+        id: int,
+        future: "Future[dict[str, Any]]",
+        items: list[Item],
+        owner: str,
+    ):
+        """Gives up on a request, which the broker may have granted already"""
+        with self._lock:
+            if self._error is None and not future.done():
+                self._socket.sendall(_encode({"op": "cancel", "id": id}))
+
+        def undo(_: "Future[dict[str, Any]]"):
+            if future.exception() is None and future.result()["granted"]:
+                try:
+                    self.release(items, owner)
+                except ConnectionError:
+                    pass
+
+        future.add_done_callback(undo)
+
+    def _read(self):
+        error: BaseException = ConnectionError(
+            "Lost the connection to the lock broker."
+        )
+        try:
+            with self._socket.makefile("rb") as lines:
+                for line in lines:
+                    reply = loads(line)
+                    with self._lock:
+                        request = self._pending.pop(reply["id"], None)
+                        if request is None:
+                            continue
+                        future, owner, items = request
+                        # NOTE: Before the connection can be seen as lost.
+                        if reply.get("granted"):
+                            self._holds[owner] += items
+                    future.set_result(reply)
+        except (OSError, ValueError) as reason:
+            error.__cause__ = reason
+        with self._lock:
+            self._error = error
+            pending, self._pending = self._pending, {}
+        for future, *_ in pending.values():
+            future.set_exception(error)
+
+
+class BrokerLock:
+    """A process-level lock granted by a lock broker to a single thread or
+    asyncio task.
+
+    The broker arbitrates between owners, whether they belong to the same
+    process or not, like the kernel does between open file descriptions, see
+    :class:`dreadlocks.ofd.OwnedProcessLock`. It counts holds itself, so that
+    no process-level bookkeeping is needed. Callers check for recursive
+    acquisitions at the thread-level. Only the owner calls methods of its lock.
+    """
+
+    __slots__ = ("fd", "key", "owner", "_items", "_owner", "_names")
+
+    def __init__(
+        self,
+        fd: int,
+        key: Hashable = None,
+        owner: Hashable = None,
+        file: Optional[str] = None,
+    ):
+        self.fd = fd
+        # NOTE: What hooks are told the lock is about, and who owns it.
+        self.key = fd if key is None else key
+        self.owner = get_ident() if owner is None else owner
+        file = file_key(fd) if file is None else file
+        self._items = partial(_items, file)
+        self._owner = owner_key(self.owner)
+        self._names = {file: str(self.key)}
+
+    def acquire(
+        self,
+        shared: bool = False,
+        blocking: bool = True,
+        reentrant: bool = False,
+        deadline: Optional[float] = None,
+        start: int = 0,
+        end: int = END,
+    ) -> None:
+        acquire_many([self], shared, blocking, deadline, start, end)
+
+    async def aacquire(
+        self,
+        shared: bool = False,
+        blocking: bool = True,
+        reentrant: bool = False,
+        deadline: Optional[float] = None,
+        start: int = 0,
+        end: int = END,
+    ) -> None:
+        items = self._items(shared, start, end)
+        client = broker_client()
+        _check_lost(self._owner)
+        observer = hooks.current
+        if observer is None:
+            await client.aacquire(
+                items, self._owner, blocking, deadline, None, self._names
+            )
+            return
+        await hooks.aobserve(
+            observer,
+            "process",
+            self.key,
+            self.owner,
+            shared,
+            partial(
+                client.aacquire,
+                items,
+                self._owner,
+                blocking,
+                deadline,
+                names=self._names,
+            ),
+        )
+
+    def release(self, shared: bool = False, start: int = 0, end: int = END) -> None:
+        release_many([self], shared, start, end)
+
+    def upgrade(
+        self,
+        blocking: bool = True,
+        deadline: Optional[float] = None,
+        start: int = 0,
+        end: int = END,
+    ) -> None:
+        """Turns a shared hold into an exclusive one. If that fails, the shared
+        hold is kept. See :meth:`dreadlocks.process.ShareableProcessLock.upgrade`.
+        """
+        self.acquire(False, blocking, True, deadline, start, end)
+        self.release(True, start, end)
+        observer = hooks.current
+        if observer is not None:
+            observer.on_upgrade(self.key)
+
+    def downgrade(self, start: int = 0, end: int = END) -> None:
+        """Turns an exclusive hold into a shared one, which never waits"""
+        self.acquire(True, False, True, None, start, end)
+        self.release(False, start, end)
+        observer = hooks.current
+        if observer is not None:
+            observer.on_downgrade(self.key)
+
+
+def _items(file: str, shared: bool, start: int, end: int) -> list[Item]:
+    return [(file, shared, start, end)]
+
+
+def acquire_many(
+    locks: list[BrokerLock],
+    shared: bool = False,
+    blocking: bool = True,
+    deadline: Optional[float] = None,
+    start: int = 0,
+    end: int = END,
+) -> None:
+    """Acquires locks of the same owner at once, in a single round trip"""
+    if not locks:
+        return
+    items = [item for lock in locks for item in lock._items(shared, start, end)]  # type: ignore [reportPrivateUsage]
+    owner = locks[0]._owner  # type: ignore [reportPrivateUsage]
+    names = {
+        file: name
+        for lock in locks
+        for file, name in lock._names.items()  # type: ignore [reportPrivateUsage]
+    }
+    client = broker_client()
+    _check_lost(owner)
+    observer = hooks.current
+    if observer is None:
+        client.acquire(items, owner, blocking, deadline, None, names)
+        return
+
+    started = perf_counter()
+    waited = [False]
+
+    def on_wait():
+        waited[0] = True
+        for lock in locks:
+            observer.on_wait("process", lock.key, lock.owner, shared)
+
+    try:
+        client.acquire(items, owner, blocking, deadline, on_wait, names)
+    except BaseException as error:
+        for lock in locks:
+            observer.on_fail("process", lock.key, lock.owner, shared, error)
+        raise
+    elapsed = perf_counter() - started
+    for lock in locks:
+        observer.on_acquire("process", lock.key, lock.owner, shared, waited[0], elapsed)
+
+
+def release_many(
+    locks: list[BrokerLock], shared: bool = False, start: int = 0, end: int = END
+) -> None:
+    """Releases locks of the same owner at once, without waiting for the
+    broker. Raises :class:`ConnectionError` if they were acquired through a
+    connection that was lost since."""
+    if not locks:
+        return
+    items = [item for lock in locks for item in lock._items(shared, start, end)]  # type: ignore [reportPrivateUsage]
+    owner = locks[0]._owner  # type: ignore [reportPrivateUsage]
+    try:
+        _client_of(owner).release(items, owner)
+    except ConnectionError:
+        _forget_lost()
+        raise
+    observer = hooks.current
+    if observer is not None:
+        for lock in locks:
+            observer.on_release("process", lock.key, lock.owner, shared)
+
+
+_address: Optional[str] = None
+_client: Optional[BrokerClient] = None
+_client_lock = Lock()
+# NOTE: Connections that were lost while owners held locks through them.
+_lost: list[BrokerClient] = []
+
+
+def _check_lost(owner: str):
+    """Raises if owner still holds locks through a lost connection, so that
+    owners learn that they lost them on their next operation"""
+    if _lost and any(client.holds(owner) for client in tuple(_lost)):
+        raise ConnectionError(_lost_message)
+
+
+def _client_of(owner: str) -> BrokerClient:
+    """The lost connection owner holds locks through, if any, otherwise the
+    current connection, without reconnecting"""
+    if _lost:
+        for client in tuple(_lost):
+            if client.holds(owner):
+                return client
+    client = _client
+    return broker_client() if client is None else client
+
+
+def _forget_lost():
+    with _client_lock:
+        _lost[:] = [client for client in _lost if client.held]
+
+
+def broker_address() -> str:
+    """The address set by :func:`set_broker_address`, or
+    :func:`default_address`"""
+    return default_address() if _address is None else _address
+
+
+def set_broker_address(address: Optional[str]) -> None:
+    """Sets the address of the lock broker of the :code:`"broker"` backend.
+
+    See :func:`dreadlocks.set_process_level_lock_backend`. Meant to be set
+    once at startup, before any path is locked: the connection to the previous
+    broker, if any, is closed, which releases its locks.
+
+    Parameters
+    ----------
+    address
+        The path of the socket the broker listens on. If None, see
+        :func:`dreadlocks.broker.default_address`.
+    """
+    global _address, _client
+    with _client_lock:
+        _address = address
+        if _client is not None:
+            _client.close()
+            if _client.held:
+                _lost.append(_client)
+            _client = None
+
+
+def broker_client() -> BrokerClient:
+    """The connection of this process to the lock broker, which is opened on
+    first use, and again if it was lost. Owners that held locks through the
+    lost connection get :class:`ConnectionError` until they released them."""
+    global _client
+    client = _client
+    if client is None or client.closed:
+        with _client_lock:
+            client = _client
+            if client is None or client.closed:
+                if client is not None and client.held:
+                    _lost.append(client)
+                _client = None
+                client = _client = BrokerClient(broker_address())
+    return client
+
+
+def _forget_client():
+    """Lets a child process open its own connection, leaving the parent's
+    alone"""
+    global _client, _client_lock
+    _client_lock = Lock()
+    _lost.clear()
+    if _client is not None:
+        # NOTE: Only closes the child's copy of the socket, unlike shutdown.
+        _client._socket.close()  # type: ignore [reportPrivateUsage]
+        _client = None
+
+
+if not is_windows:
+    os.register_at_fork(after_in_child=_forget_client)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """Runs a lock broker until interrupted or terminated"""
+    parser = ArgumentParser(
+        prog="python -m dreadlocks",
+        description="Grants locks on paths to dreadlocks clients of this host.",
+    )
+    parser.add_argument(
+        "--address",
+        default=None,
+        help="The path of the socket to listen on (default: $DREADLOCKS_BROKER, or "
+        "dreadlocks.sock in $XDG_RUNTIME_DIR, or else in a private directory of "
+        "the temporary directory).",
+    )
+    args = parser.parse_args(argv)
+    broker = Broker(args.address)
+    # NOTE: So that the socket is removed on termination too.
+    signal(SIGTERM, default_int_handler)
+    try:
+        run(broker.serve_forever())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,55 @@
+from asyncio import current_task
+from contextlib import asynccontextmanager, contextmanager
+from threading import get_ident
+from typing import Optional
+
+from .broker import BrokerLock
+from .globals import fd_ref
+from .region import END
+
+
+@contextmanager
+def broker_process_level_lock(
+    normalized_path: str,
+    shared: bool = False,
+    blocking: bool = True,
+    reentrant: bool = False,
+    deadline: Optional[float] = None,
+    start: int = 0,
+    end: int = END,
+):
+    """Locks a path at the process-level through the lock broker, on behalf of
+    the current thread.
+
+    Like :func:`dreadlocks.owned_process_level_lock.owned_process_level_lock`,
+    threads of the same process exclude each other, hence this is only used
+    under a thread-level lock. The FD is only used to identify the file.
+    """
+    with fd_ref(normalized_path) as fd:
+        lock = BrokerLock(fd, normalized_path, get_ident())
+        lock.acquire(shared, blocking, reentrant, deadline, start, end)
+        try:
+            yield fd
+        finally:
+            lock.release(shared, start, end)
+
+
+@asynccontextmanager
+async def abroker_process_level_lock(
+    normalized_path: str,
+    shared: bool = False,
+    blocking: bool = True,
+    reentrant: bool = False,
+    deadline: Optional[float] = None,
+    start: int = 0,
+    end: int = END,
+):
+    """Asynchronous counterpart of :func:`broker_process_level_lock` on behalf
+    of the current asyncio task"""
+    with fd_ref(normalized_path) as fd:
+        lock = BrokerLock(fd, normalized_path, current_task())
+        await lock.aacquire(shared, blocking, reentrant, deadline, start, end)
+        try:
+            yield fd
+        finally:
+            lock.release(shared, start, end)
@@ -0,0 +1,127 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from threading import Barrier
+from time import sleep
+
+import pytest
+
+from dreadlocks import (
+    AcquiringLockTimedOutError,
+    AcquiringLockWouldBlockError,
+    claim_any,
+    path_lock,
+    path_lock_many,
+    set_process_level_lock_backend,
+)
+from dreadlocks.backend import Backend
+from dreadlocks.platform import has_ofd_locks
+
+mp = get_context(method="spawn")
+
+
+def hold(paths: list[str], locked: str, seconds: float):
+    with path_lock_many(paths):
+        Path(locked).touch()
+        sleep(seconds)
+
+
+def can_lock(path: str) -> bool:
+    try:
+        with path_lock(path, blocking=False):
+            return True
+    except AcquiringLockWouldBlockError:
+        return False
+
+
+@pytest.fixture
+def paths(tmp_path: Path) -> list[str]:
+    paths = [tmp_path / f"job{i}" for i in range(10)]
+    for path in paths:
+        path.touch()
+    return list(map(str, paths))
+
+
+def test_claims_free_paths(tmp_path: Path, paths: list[str]):
+    locked = tmp_path / "locked"
+    is_locked = Barrier(2)
+    is_done = Barrier(2)
+
+    def hold_in_thread():
+        with path_lock_many(paths[3:5]):
+            is_locked.wait()
+            is_done.wait()
+
+    with (
+        ProcessPoolExecutor(1, mp_context=mp) as processes,
+        ThreadPoolExecutor(1) as threads,
+    ):
+        holder = processes.submit(hold, paths[:3], str(locked), 1)
+        while not locked.exists():
+            assert not holder.done()
+            sleep(0.001)
+        thread_holder = threads.submit(hold_in_thread)
+        is_locked.wait()
+        with path_lock(paths[5]):
+            # NOTE: Jobs removed meanwhile are skipped.
+            candidates = [*paths, f"{paths[0]}.missing"]
+            with claim_any(candidates, n=len(candidates)) as claimed:
+                assert sorted(claimed) == paths[6:]
+                assert not any(processes.submit(can_lock, p).result() for p in claimed)
+            with claim_any(paths) as claimed:
+                assert len(claimed) == 1
+        is_done.wait()
+        thread_holder.result()
+        holder.result()
+
+
+def test_blocking(paths: list[str]):
+    is_locked = Barrier(2)
+
+    def hold_in_thread(seconds: float):
+        with path_lock_many(paths):
+            is_locked.wait()
+            sleep(seconds)
+
+    with ThreadPoolExecutor(1) as threads:
+        holder = threads.submit(hold_in_thread, 0.2)
+        is_locked.wait()
+        with claim_any(paths, blocking=False) as claimed:
+            assert not claimed
+        with pytest.raises(AcquiringLockTimedOutError):
+            with claim_any(paths, blocking=True, timeout=0.05):
+                pass
+        with claim_any(paths, n=2, shared=True, blocking=True) as claimed:
+            assert len(claimed) == 2
+        holder.result()
+
+
+@pytest.mark.parametrize("backend", ["ofd", "lockf"])
+def test_blocking_waits_for_other_processes(
+    tmp_path: Path, paths: list[str], backend: Backend
+):
+    if backend == "ofd" and not has_ofd_locks():
+        pytest.skip("Open file description locks are not supported.")
+    locked = tmp_path / "locked"
+    set_process_level_lock_backend(backend)
+    try:
+        with ProcessPoolExecutor(1, mp_context=mp) as processes:
+            holder = processes.submit(hold, paths, str(locked), 0.2)
+            while not locked.exists():
+                assert not holder.done()
+                sleep(0.001)
+            with claim_any(paths, blocking=False) as claimed:
+                assert not claimed
+            with claim_any(paths, n=3, blocking=True, timeout=10) as claimed:
+                assert len(claimed) == 3
+                assert not any(processes.submit(can_lock, p).result() for p in claimed)
+            holder.result()
+    finally:
+        set_process_level_lock_backend(None)
+
+
+def test_blocking_skips_own_paths(paths: list[str]):
+    with path_lock_many(paths):
+        with pytest.raises(AcquiringLockTimedOutError):
+            with claim_any(paths, blocking=True, timeout=0.05):
+                pass
@@ -0,0 +1,174 @@
+from contextlib import ExitStack, contextmanager
+from os.path import normpath
+from random import sample
+from threading import get_ident
+from time import sleep
+from typing import Iterable, Optional
+
+from .backend import process_level_lock_backend
+from .broker_process_level_lock import broker_process_level_lock
+from .deadline import absolute_deadline, remaining
+from .errors import (
+    AcquiringLockTimedOutError,
+    AcquiringProcessLevelLockWouldBlockError,
+    RecursiveDeadlockError,
+)
+from .globals import fd_ref, process_level_lock_ref, thread_level_lock_ref
+from .owned_process_level_lock import (
+    release_owned_process_level_lock,
+    try_owned_process_level_lock,
+)
+from .path_lock import path_lock
+
+_min_delay = 0.001
+_max_delay = 0.05
+"""How long blocking claims sleep between scans when no candidate can be
+waited for, at first and at most"""
+
+
+@contextmanager
+def claim_any(
+    paths: Iterable[str],
+    n: int = 1,
+    shared: bool = False,
+    blocking: bool = False,
+    timeout: Optional[float] = None,
+):
+    """Locks up to n of the given paths, among those nobody else holds, both
+    at the thread-level and process-level.
+
+    Meant for work queues where workers claim job files: each worker scans the
+    candidates in its own random order, so that concurrent workers seldom
+    contend for the same ones. Candidates held by other threads of the process
+    are skipped without touching their files, and no error is raised for
+    candidates that are held. Candidates the current thread holds already, or
+    that do not exist anymore, are skipped too.
+
+    Parameters
+    ----------
+    paths
+        The candidate paths. See :func:`dreadlocks.path_lock`.
+    n
+        How many paths to lock at most.
+    shared
+        Whether the locks are shared. See :func:`dreadlocks.path_lock`.
+    blocking
+        Whether to wait until at least one candidate can be locked, rather
+        than yielding none. Claims wait for one held candidate, and then lock
+        the others released meanwhile.
+    timeout
+        How long to wait, in seconds, if blocking. If no candidate can be
+        locked in time, an error is raised. See :func:`dreadlocks.path_lock`.
+
+    Yields
+    ------
+    dict[str, int]
+        The file descriptor of each locked path, in the order they were
+        locked, which must not be closed. Empty if none could be locked
+        without blocking.
+    """
+    if n < 1:
+        raise ValueError("At least one path must be claimed.")
+    normalized_paths = {normpath(path): path for path in paths}
+    deadline = absolute_deadline(timeout)
+    owner = get_ident()
+    backend = process_level_lock_backend()
+
+    def try_lock(stack: ExitStack, normalized_path: str) -> Optional[int]:
+        # NOTE: Held candidates are the common case: kernel locks are tried
+        # with primitives that return whether they succeeded, rather than
+        # through errors.
+        if backend == "ofd":
+            lock = try_owned_process_level_lock(normalized_path, shared, owner)
+            if lock is None:
+                return None
+            stack.callback(
+                release_owned_process_level_lock, normalized_path, lock, shared
+            )
+            return lock.fd
+        if backend == "broker":
+            try:
+                return stack.enter_context(
+                    broker_process_level_lock(normalized_path, shared, False)
+                )
+            except AcquiringProcessLevelLockWouldBlockError:
+                return None
+        fd = stack.enter_context(fd_ref(normalized_path))
+        process_lock = stack.enter_context(process_level_lock_ref(fd))
+        if not process_lock.try_acquire(shared, owner):
+            return None
+        stack.callback(process_lock.release, shared, owner)
+        return fd
+
+    def claim(normalized_path: str) -> Optional[int]:
+        with ExitStack() as stack:
+            thread_lock = stack.enter_context(thread_level_lock_ref(normalized_path))
+            if not thread_lock.try_acquire(shared, owner):
+                contended.append(normalized_path)
+                return None
+            stack.callback(thread_lock.release, shared, owner)
+            try:
+                fd = try_lock(stack, normalized_path)
+            except FileNotFoundError:
+                # NOTE: The candidate was removed, e.g. its job is done.
+                return None
+            if fd is None:
+                contended.append(normalized_path)
+                return None
+            held.enter_context(stack.pop_all())
+            return fd
+
+    def wait() -> Optional[bool]:
+        """Waits for one held candidate, as path_lock does, rather than
+        scanning them all again and again. Returns whether it was claimed, or
+        None if no candidate can be waited for."""
+        for normalized_path in contended:
+            if normalized_path in own:
+                continue
+            try:
+                fd = held.enter_context(
+                    path_lock(normalized_path, shared, timeout=remaining(deadline))
+                )
+            except RecursiveDeadlockError:
+                own.add(normalized_path)
+                continue
+            except FileNotFoundError:
+                return False
+            claimed[normalized_paths[normalized_path]] = fd
+            return True
+        return None
+
+    with ExitStack() as held:
+        claimed: dict[str, int] = {}
+        contended: list[str] = []
+        # NOTE: Candidates the current thread holds already, which it cannot
+        # wait for.
+        own: set[str] = set()
+        delay = _min_delay
+        while True:
+            contended.clear()
+            for normalized_path in sample(
+                list(normalized_paths), len(normalized_paths)
+            ):
+                if normalized_paths[normalized_path] in claimed:
+                    continue
+                fd = claim(normalized_path)
+                if fd is not None:
+                    claimed[normalized_paths[normalized_path]] = fd
+                    if len(claimed) == n:
+                        break
+            if claimed or not blocking:
+                break
+            waited = wait()
+            if waited and len(claimed) == n:
+                break
+            if waited is None:
+                # NOTE: Only candidates this thread holds are left, or none at
+                # all, until other threads release or create some.
+                left = remaining(deadline)
+                if left == 0:
+                    raise AcquiringLockTimedOutError()
+                sleep(delay if left is None else min(delay, left))
+                delay = min(2 * delay, _max_delay)
+            # NOTE: Otherwise, candidates released meanwhile are claimed along.
+        yield claimed
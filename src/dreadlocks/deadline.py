@@ -0,0 +1,84 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import monotonic
+from typing import Optional, Protocol
+
+_scope: ContextVar[Optional[float]] = ContextVar("dreadlocks.deadline", default=None)
+
+
+class _Acquirable(Protocol):
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool: ...
+
+
+@contextmanager
+def deadline(timeout: float):
+    """Bounds the time spent acquiring locks within the scope.
+
+    Every blocking lock acquisition made within the scope, including nested
+    calls, uses at most whatever is left of the budget. Nested scopes can only
+    shorten the enclosing deadline, never extend it.
+
+    Parameters
+    ----------
+    timeout
+        The budget in seconds, starting now.
+
+    Examples
+    --------
+    >>> with deadline(60):
+    ...     remaining(absolute_deadline(None)) <= 60
+    True
+    >>> with deadline(60):
+    ...     with deadline(3600):
+    ...         remaining(absolute_deadline(None)) <= 60
+    True
+
+    """
+    this_deadline = monotonic() + timeout
+    enclosing_deadline = _scope.get()
+    if enclosing_deadline is not None and enclosing_deadline < this_deadline:
+        this_deadline = enclosing_deadline
+    token = _scope.set(this_deadline)
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def absolute_deadline(timeout: Optional[float]) -> Optional[float]:
+    """Computes the monotonic deadline of an acquisition attempt starting now.
+
+    This is the earliest of now plus timeout, if any, and the deadline of the
+    enclosing scope, if any. Returns None if there is no deadline at all.
+    """
+    scoped_deadline = _scope.get()
+    if timeout is None:
+        return scoped_deadline
+    this_deadline = monotonic() + timeout
+    if scoped_deadline is not None and scoped_deadline < this_deadline:
+        return scoped_deadline
+    return this_deadline
+
+
+def remaining(deadline: Optional[float]) -> Optional[float]:
+    """Number of seconds left before deadline, None if there is no deadline.
+
+    >>> remaining(None) is None
+    True
+    >>> remaining(monotonic() - 1)
+    0.0
+
+    """
+    if deadline is None:
+        return None
+    return max(0.0, deadline - monotonic())
+
+
+def acquire(lock: _Acquirable, blocking: bool, deadline: Optional[float]) -> bool:
+    """Acquires a threading lock, waiting at most until deadline if blocking."""
+    if not blocking:
+        return lock.acquire(blocking=False)
+    timeout = remaining(deadline)
+    if timeout is None:
+        return lock.acquire()
+    return lock.acquire(timeout=timeout)
@@ -0,0 +1,96 @@
+from collections.abc import Iterator
+from pathlib import Path
+from threading import Barrier, Thread
+
+import pytest
+
+from dreadlocks import (
+    AcquiringLockWouldBlockError,
+    LockOrderInversionError,
+    WaitForCycleError,
+    path_lock,
+    set_deadlock_detection,
+    thread_level_path_lock,
+)
+
+
+@pytest.fixture(autouse=True)
+def detection() -> Iterator[None]:
+    set_deadlock_detection()
+    try:
+        yield
+    finally:
+        set_deadlock_detection(False)
+
+
+def touch(tmp_path: Path, name: str) -> str:
+    path = str(tmp_path / name)
+    Path(path).touch()
+    return path
+
+
+def test_lock_order_inversion(tmp_path: Path):
+    a, b, c = (touch(tmp_path, name) for name in "abc")
+    with path_lock(a), path_lock(b):
+        pass
+    with path_lock(b), path_lock(c):
+        pass
+    with path_lock(c):
+        with pytest.raises(LockOrderInversionError):
+            with path_lock(a):
+                pass
+    with path_lock(a), path_lock(c):
+        pass
+
+
+def test_non_blocking_is_not_checked(tmp_path: Path):
+    a, b = (touch(tmp_path, name) for name in "ab")
+    with path_lock(a), path_lock(b):
+        pass
+    with path_lock(b), path_lock(a, blocking=False):
+        pass
+
+
+def test_wait_for_cycle(tmp_path: Path):
+    path = touch(tmp_path, "lock")
+    are_locked = Barrier(2)
+    errors: list[BaseException] = []
+
+    def upgrade():
+        with thread_level_path_lock(path, shared=True):
+            are_locked.wait()
+            try:
+                with thread_level_path_lock(path, reentrant=True):
+                    pass
+            except WaitForCycleError as error:
+                errors.append(error)
+
+    threads = [Thread(target=upgrade) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    # NOTE: One thread waits for the other, which fails instead of waiting.
+    assert len(errors) == 1
+
+
+def test_timeout_stops_waiting(tmp_path: Path):
+    path = touch(tmp_path, "lock")
+    is_locked = Barrier(2)
+    is_done = Barrier(2)
+
+    def hold():
+        with thread_level_path_lock(path):
+            is_locked.wait()
+            is_done.wait()
+
+    thread = Thread(target=hold)
+    thread.start()
+    is_locked.wait()
+    with pytest.raises(AcquiringLockWouldBlockError):
+        with thread_level_path_lock(path, timeout=0.01):
+            pass
+    is_done.wait()
+    thread.join()
+    with thread_level_path_lock(path):
+        pass
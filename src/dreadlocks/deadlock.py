@@ -0,0 +1,211 @@
+from collections import deque
+from threading import Lock
+from typing import Hashable, NamedTuple, Optional
+
+from .errors import LockOrderInversionError, WaitForCycleError
+from .region import overlap
+
+
+class _Hold(NamedTuple):
+    owner: Hashable
+    shared: bool
+    region: tuple[int, int]
+
+
+class _Wait(NamedTuple):
+    key: Hashable
+    shared: bool
+    region: tuple[int, int]
+    policy: str
+    seq: int
+
+
+class DeadlockDetector:
+    """Keeps track of thread-level locks held and waited for by each owner, to
+    detect dead-locks before they happen.
+
+    Like Linux's lockdep, we record that a key is locked after another one
+    whenever an owner locks it while holding the other one. Locking keys in an
+    order that inverts a recorded order raises
+    :class:`dreadlocks.LockOrderInversionError`, even if the owners involved
+    never actually dead-lock.
+
+    We also keep track of which owners wait for which keys. An owner waits for
+    the owners holding the key in a conflicting mode, and, depending on the
+    policy of the lock, for some other waiters. Waiting for a key raises
+    :class:`dreadlocks.WaitForCycleError` instead if an owner it would wait for
+    waits for it, directly or not.
+
+    Locks call the detector with their own mutex held. The detector never locks
+    them in turn, so that its own mutex is always the innermost one.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        # NOTE: Keys held by each owner, in acquisition order, and holds of
+        # each key.
+        self._held: dict[Hashable, list[Hashable]] = {}
+        self._holds: dict[Hashable, list[_Hold]] = {}
+        # NOTE: Keys locked while holding each key.
+        self._after: dict[Hashable, set[Hashable]] = {}
+        self._waiting: dict[Hashable, _Wait] = {}
+        self._seq = 0
+
+    def check_order(self, owner: Hashable, key: Hashable) -> None:
+        """Records that owner locks key after the keys it holds, unless that
+        inverts a recorded order"""
+        with self._lock:
+            for held in self._held.get(owner, ()):
+                if held == key or key in self._after.get(held, ()):
+                    continue
+                path = self._path(key, held)
+                if path is not None:
+                    raise LockOrderInversionError(
+                        f"Locking {key!r} while holding {held!r} inverts the order "
+                        + " -> ".join(map(repr, path))
+                        + "."
+                    )
+                self._after.setdefault(held, set()).add(key)
+
+    def wait(
+        self,
+        owner: Hashable,
+        key: Hashable,
+        shared: bool,
+        region: tuple[int, int],
+        policy: str,
+    ) -> None:
+        """Records that owner waits for key, unless that would dead-lock"""
+        with self._lock:
+            self._seq += 1
+            self._waiting[owner] = _Wait(key, shared, region, policy, self._seq)
+            cycle = self._cycle(owner)
+            if cycle is not None:
+                del self._waiting[owner]
+                raise WaitForCycleError(
+                    f"Waiting for {key!r} would dead-lock: "
+                    + " waits for ".join(map(repr, cycle))
+                    + "."
+                )
+
+    def stop_waiting(self, owner: Hashable) -> None:
+        with self._lock:
+            self._waiting.pop(owner, None)
+
+    def acquired(
+        self, owner: Hashable, key: Hashable, shared: bool, region: tuple[int, int]
+    ) -> None:
+        with self._lock:
+            self._waiting.pop(owner, None)
+            self._held.setdefault(owner, []).append(key)
+            self._holds.setdefault(key, []).append(_Hold(owner, shared, region))
+
+    def released(
+        self, owner: Hashable, key: Hashable, shared: bool, region: tuple[int, int]
+    ) -> None:
+        with self._lock:
+            held = self._held.get(owner)
+            holds = self._holds.get(key)
+            if held is None or holds is None or key not in held:
+                # NOTE: Acquired before dead-lock detection was enabled.
+                return
+            # NOTE: The most recent acquisition of key.
+            del held[len(held) - 1 - held[::-1].index(key)]
+            if not held:
+                del self._held[owner]
+            hold = _Hold(owner, shared, region)
+            if hold in holds:
+                holds.remove(hold)
+            if not holds:
+                del self._holds[key]
+
+    def _path(self, start: Hashable, end: Hashable) -> Optional[list[Hashable]]:
+        """A path from start to end in the order graph, if any"""
+        previous: dict[Hashable, Hashable] = {start: start}
+        queue = deque([start])
+        while queue:
+            key = queue.popleft()
+            if key == end:
+                path = [key]
+                while key != start:
+                    key = previous[key]
+                    path.append(key)
+                return path[::-1]
+            for after in self._after.get(key, ()):
+                if after not in previous:
+                    previous[after] = key
+                    queue.append(after)
+        return None
+
+    def _blockers(self, owner: Hashable) -> list[Hashable]:
+        """Owners that a waiting owner waits for"""
+        wait = self._waiting[owner]
+        blockers = [
+            hold.owner
+            for hold in self._holds.get(wait.key, ())
+            if hold.owner != owner
+            and not (wait.shared and hold.shared)
+            and overlap(wait.region, hold.region)
+        ]
+        if wait.policy == "reader":
+            return blockers
+        for other, other_wait in self._waiting.items():
+            if (
+                other == owner
+                or other_wait.key != wait.key
+                or not overlap(wait.region, other_wait.region)
+            ):
+                continue
+            if wait.policy == "fair" and other_wait.seq < wait.seq:
+                blockers.append(other)
+            elif wait.policy == "writer" and wait.shared and not other_wait.shared:
+                blockers.append(other)
+        return blockers
+
+    def _cycle(self, owner: Hashable) -> Optional[list[Hashable]]:
+        """A cycle of waiting owners through owner, if any"""
+        previous: dict[Hashable, Hashable] = {owner: owner}
+        queue = deque([owner])
+        while queue:
+            waiter = queue.popleft()
+            for blocker in self._blockers(waiter):
+                if blocker == owner:
+                    cycle = [waiter]
+                    while cycle[-1] != owner:
+                        cycle.append(previous[cycle[-1]])
+                    return [*reversed(cycle), owner]
+                if blocker not in previous and blocker in self._waiting:
+                    previous[blocker] = waiter
+                    queue.append(blocker)
+        return None
+
+
+current: Optional[DeadlockDetector] = None
+
+
+def set_deadlock_detection(enabled: bool = True) -> None:
+    """Detects dead-locks between threads and tasks of this process, for
+    debugging.
+
+    Thread-level locks taken through :func:`dreadlocks.path_lock` and
+    :func:`dreadlocks.thread_level_path_lock` then keep track of the paths each
+    thread or task holds, and of the order in which paths are locked while
+    holding others. Locking paths in an order that inverts an order seen
+    before raises :class:`dreadlocks.LockOrderInversionError`, even if it would
+    not dead-lock this time. Waiting for a path raises
+    :class:`dreadlocks.WaitForCycleError` instead of dead-locking if the
+    threads or tasks holding it wait, directly or not, for the waiter.
+    Non-blocking acquisitions cannot dead-lock and are not checked.
+
+    Dead-locks between processes are not detected. Bookkeeping goes through a
+    single mutex, which makes locking much slower. Must be enabled while no
+    path is locked.
+
+    Parameters
+    ----------
+    enabled
+        Whether to detect dead-locks. Enabling forgets previously recorded
+        orders.
+    """
+    global current
+    current = DeadlockDetector() if enabled else None
@@ -1,3 +1,7 @@
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+
 class AcquiringLockWouldBlockError(Exception):
     """Raised when acquiring lock would block and blocking is False"""
 
@@ -10,5 +14,59 @@ class AcquiringThreadLevelLockWouldBlockError(AcquiringLockWouldBlockError):
     """Raised when acquiring a thread-level lock would block and blocking is False"""
 
 
-class RecursiveDeadlockError(Exception):
+class AcquiringLockTimedOutError(AcquiringLockWouldBlockError):
+    """Raised when a lock cannot be acquired before its deadline"""
+
+
+class AcquiringProcessLevelLockTimedOutError(
+    AcquiringProcessLevelLockWouldBlockError, AcquiringLockTimedOutError
+):
+    """Raised when a process-level lock cannot be acquired before its deadline
+
+    The kernel request cannot be cancelled. If it is still pending when the
+    deadline expires, :attr:`pending` resolves once it is done.
+    """
+
+    def __init__(self, pending: Optional["Future[None]"] = None):
+        super().__init__()
+        self.pending = pending
+
+    def __reduce__(self):
+        # NOTE: The pending kernel request only makes sense in the process
+        # that issued it.
+        return (type(self), ())
+
+    def defer(self, callback: Callable[[], None]) -> None:
+        """Calls callback once the kernel lock request abandoned on timeout, if
+        any, has resolved. Resources the request depends on, such as the file
+        descriptor, must be kept alive until then.
+        """
+        if self.pending is None:
+            callback()
+        else:
+            self.pending.add_done_callback(lambda _: callback())
+
+
+class AcquiringThreadLevelLockTimedOutError(
+    AcquiringThreadLevelLockWouldBlockError, AcquiringLockTimedOutError
+):
+    """Raised when a thread-level lock cannot be acquired before its deadline"""
+
+
+class DeadlockError(Exception):
+    """Raised when a dead-lock is detected"""
+
+
+class RecursiveDeadlockError(DeadlockError):
     """Raised when recursive dead-lock is detected."""
+
+
+class LockOrderInversionError(DeadlockError):
+    """Raised with dead-lock detection enabled when a path is locked while
+    holding another path that was locked, directly or not, while holding it,
+    which could dead-lock"""
+
+
+class WaitForCycleError(DeadlockError):
+    """Raised with dead-lock detection enabled when waiting for a lock would
+    dead-lock, because its holders wait, directly or not, for the waiter"""
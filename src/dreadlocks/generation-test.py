@@ -0,0 +1,88 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import pytest
+
+from dreadlocks import ReadCache, ageneration_lock, generation_lock
+
+mp = get_context(method="spawn")
+
+
+def write(path: str, data: str, dirty: bool = True):
+    with generation_lock(path) as lock:
+        Path(path).write_text(data)
+        if dirty:
+            lock.mark_dirty()
+
+
+def generation(path: str, counter: str) -> int:
+    with generation_lock(path, shared=True, counter=counter) as lock:
+        return lock.generation
+
+
+def test_generations(tmp_path: Path):
+    path = str(tmp_path / "data")
+    Path(path).touch()
+    cache = ReadCache[str]()
+    loads: list[str] = []
+
+    def read() -> str:
+        with generation_lock(path, shared=True) as lock:
+            with pytest.raises(ValueError):
+                lock.mark_dirty()
+
+            def load() -> str:
+                loads.append(Path(path).read_text())
+                return loads[-1]
+
+            return cache.get(path, lock.generation, load)
+
+    with ProcessPoolExecutor(1, mp_context=mp) as processes:
+        assert read() == ""
+        assert read() == ""
+        processes.submit(write, path, "a").result()
+        assert read() == "a"
+        # NOTE: Modifications nobody marked dirty go unnoticed.
+        processes.submit(write, path, "b", False).result()
+        assert read() == "a"
+        with pytest.raises(RuntimeError):
+            with generation_lock(path) as lock:
+                lock.mark_dirty()
+                raise RuntimeError()
+        assert read() == "b"
+    assert loads == ["", "a", "b"]
+
+
+def test_counter_in_the_lock_file(tmp_path: Path):
+    path = str(tmp_path / "lock")
+    Path(path).touch()
+    with ProcessPoolExecutor(1, mp_context=mp) as processes:
+        before = processes.submit(generation, path, path).result()
+
+        async def bump():
+            async with ageneration_lock(path, counter=path) as lock:
+                assert lock.generation == before
+                lock.mark_dirty()
+
+        asyncio.run(bump())
+        assert processes.submit(generation, path, path).result() == before + 1
+    assert len(Path(path).read_bytes()) == 8
+    assert not Path(f"{path}.generation").exists()
+
+
+def test_read_cache_eviction():
+    cache = ReadCache[str](capacity=5, size=len)
+    for path in ("a", "b", "c"):
+        cache.get(path, 0, lambda: "xx")
+    # NOTE: "a" was least recently used.
+    assert len(cache) == 2
+    assert cache.get("a", 0, lambda: "yy") == "yy"
+    assert cache.get("c", 0, lambda: "zz") == "xx"
+    cache.get("d", 0, lambda: "too long")
+    assert len(cache) == 2
+    cache.invalidate("c")
+    assert cache.get("c", 0, lambda: "zz") == "zz"
+    cache.invalidate()
+    assert len(cache) == 0
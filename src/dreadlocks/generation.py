@@ -0,0 +1,249 @@
+import os
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from os.path import normpath
+from random import getrandbits
+from struct import Struct
+from threading import Lock
+from typing import Callable, Generic, Optional, TypeVar
+
+from .locked_file import LockedFile
+from .locked_file import _pread, _write_all  # type: ignore [reportPrivateUsage]
+from .path_lock import apath_lock, path_lock
+
+V = TypeVar("V")
+
+_counter = Struct("<Q")
+
+
+class GenerationLock(LockedFile):
+    """A path held by the current thread or task along with the generation of
+    its data, see :func:`dreadlocks.generation_lock`. See
+    :class:`dreadlocks.LockedFile` for positional I/O on the path.
+
+    Attributes
+    ----------
+    fd
+        A file descriptor of the path, which must not be closed. See
+        :func:`dreadlocks.path_lock`.
+    shared
+        Whether the path is held shared.
+    generation
+        The generation of the data the lock protects, which changes whenever
+        an exclusive holder marked it dirty.
+    dirty
+        Whether the generation changes on release.
+    """
+
+    def __init__(self, fd: int, shared: bool, counter_fd: int):
+        self.fd = fd
+        self.shared = shared
+        self.dirty = False
+        self._counter_fd = counter_fd
+        data = _pread(counter_fd, _counter.size, 0)
+        if len(data) == _counter.size:
+            self.generation: int = _counter.unpack(data)[0]
+        else:
+            # NOTE: Counters start from a random value rather than zero, so
+            # that a counter lost along with its file does not repeat
+            # generations that readers may have cached. Holders that find it
+            # missing all write it, which only costs readers a cache miss.
+            self.generation = getrandbits(64)
+            _write_all(counter_fd, _counter.pack(self.generation), 0)
+
+    def mark_dirty(self) -> None:
+        """Changes the generation on release, once the data was modified"""
+        if self.shared:
+            raise ValueError("Cannot mark a lock held shared dirty.")
+        self.dirty = True
+
+    def _release(self):
+        if self.dirty:
+            self.generation = (self.generation + 1) % 2**64
+            _write_all(self._counter_fd, _counter.pack(self.generation), 0)
+            self.dirty = False
+
+
+def _counter_path(path: str, counter: Optional[str]) -> str:
+    return f"{path}.generation" if counter is None else counter
+
+
+@contextmanager
+def _generation(path: str, counter: Optional[str], fd: int, shared: bool):
+    """Reads the generation of a held path, and bumps it on release if dirty"""
+    counter = _counter_path(path, counter)
+    is_sidecar = normpath(counter) != normpath(path)
+    counter_fd = os.open(counter, os.O_RDWR | os.O_CREAT, 0o666) if is_sidecar else fd
+    try:
+        lock = GenerationLock(fd, shared, counter_fd)
+        try:
+            yield lock
+        finally:
+            lock._release()  # type: ignore [reportPrivateUsage]
+    finally:
+        if is_sidecar:
+            os.close(counter_fd)
+
+
+@contextmanager
+def generation_lock(
+    path: str,
+    shared: bool = False,
+    blocking: bool = True,
+    reentrant: bool = False,
+    timeout: Optional[float] = None,
+    counter: Optional[str] = None,
+):
+    """Locks a path both at the thread-level and process-level, along with a
+    generation counter of the data it protects.
+
+    Exclusive holders that modify the data mark the lock dirty, which bumps the
+    generation on release, even if an error is raised. Holders can then tell
+    whether the data changed since they last read it, and skip reading and
+    parsing it again if not, see :class:`dreadlocks.ReadCache`. Data modified
+    under :func:`dreadlocks.path_lock`, or under a lock that was not marked
+    dirty, goes unnoticed.
+
+    Examples
+    --------
+    >>> from tempfile import TemporaryDirectory
+    >>> with TemporaryDirectory() as directory:
+    ...     path = f"{directory}/data"
+    ...     open(path, "w").close()
+    ...     with generation_lock(path, shared=True) as lock:
+    ...         before = lock.generation
+    ...     with generation_lock(path) as lock:
+    ...         lock.mark_dirty()
+    ...     with generation_lock(path, shared=True) as lock:
+    ...         lock.generation - before
+    1
+
+    Parameters
+    ----------
+    path
+        The path to lock. See :func:`dreadlocks.path_lock`.
+    shared
+        Whether the lock is shared. See :func:`dreadlocks.path_lock`.
+    blocking
+        Whether lock acquisition is blocking. See :func:`dreadlocks.path_lock`.
+    reentrant
+        Whether lock acquisition is reentrant. See :func:`dreadlocks.path_lock`.
+    timeout
+        How long to wait, in seconds, if blocking. See
+        :func:`dreadlocks.path_lock`.
+    counter
+        The file holding the generation, created if needed, whose first 8
+        bytes are overwritten. Defaults to a sidecar file next to the path,
+        with a :code:`.generation` suffix. Dedicated lock files, such as those
+        of :class:`dreadlocks.KeyLockNamespace`, can hold their own generation
+        to save opening another file.
+
+    Yields
+    ------
+    GenerationLock
+        The held lock, and the generation of the data.
+    """
+    with path_lock(path, shared, blocking, reentrant, timeout) as fd:
+        with _generation(path, counter, fd, shared) as lock:
+            yield lock
+
+
+@asynccontextmanager
+async def ageneration_lock(
+    path: str,
+    shared: bool = False,
+    blocking: bool = True,
+    reentrant: bool = False,
+    timeout: Optional[float] = None,
+    counter: Optional[str] = None,
+):
+    """Locks a path both at the thread-level and process-level, along with a
+    generation counter of the data it protects, on behalf of the current
+    asyncio task.
+
+    Asynchronous context manager counterpart of
+    :func:`dreadlocks.generation_lock`, with the same parameters. Reading and
+    writing the counter does not wait for other holders.
+    """
+    async with apath_lock(path, shared, blocking, reentrant, timeout) as fd:
+        with _generation(path, counter, fd, shared) as lock:
+            yield lock
+
+
+class ReadCache(Generic[V]):
+    """Values read from locked paths, such as their parsed contents, along with
+    the generation they were read at.
+
+    Only the latest value of each path is kept, the least recently used paths
+    being evicted first once the total size exceeds the capacity. Caches are
+    shared by the threads and tasks of a process.
+
+    Examples
+    --------
+    >>> cache = ReadCache[str](capacity=2)
+    >>> cache.get("data", 7, lambda: "parsed")
+    'parsed'
+    >>> cache.get("data", 7, lambda: "parsed again")
+    'parsed'
+    >>> cache.get("data", 8, lambda: "parsed again")
+    'parsed again'
+
+    Parameters
+    ----------
+    capacity
+        The total size of the values kept at most.
+    size
+        The size of a value. Defaults to one, so that the capacity is a number
+        of paths. Values larger than the capacity are not kept.
+    """
+
+    def __init__(self, capacity: int = 128, size: Optional[Callable[[V], int]] = None):
+        if capacity < 0:
+            raise ValueError("The capacity cannot be negative.")
+        self.capacity = capacity
+        self._size = size
+        self._lock = Lock()
+        self._entries: OrderedDict[str, tuple[int, V, int]] = OrderedDict()
+        self._total = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, path: str, generation: int, load: Callable[[], V]) -> V:
+        """The value of path at generation, loaded if the cache has none.
+
+        Must be called with the path held, for instance with the generation of
+        a :class:`dreadlocks.GenerationLock`. The value is loaded without
+        holding the cache mutex.
+        """
+        key = normpath(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generation:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        value = load()
+        size = 1 if self._size is None else self._size(value)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._total -= entry[2]
+            if size <= self.capacity:
+                self._entries[key] = (generation, value, size)
+                self._total += size
+            while self._total > self.capacity:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._total -= evicted
+        return value
+
+    def invalidate(self, path: Optional[str] = None) -> None:
+        """Forgets the value of path, or of all paths if None"""
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                self._total = 0
+                return
+            entry = self._entries.pop(normpath(path), None)
+            if entry is not None:
+                self._total -= entry[2]
@@ -1,20 +1,110 @@
 from os import O_RDWR, open as _open, close as _close
-from threading import Lock
+from typing import Hashable, Optional
 from .pool import ThreadSafeKeyedRefPool
 from .thread import ShareableThreadLock
 from .process import ShareableProcessLock
+from .ofd import OwnedProcessLock
+from .backend import process_level_lock_backend
+from .policy import thread_level_lock_policy
+from .platform import open_files_limit
+
+_shards = 64
+
+# NOTE: The normalized path of each FD of fd_ref, which hooks are told about.
+_paths: dict[int, str] = {}
+
+
+def _open_fd(normalized_path: str) -> int:
+    fd = _open(normalized_path, O_RDWR)
+    _paths[fd] = normalized_path
+    return fd
+
+
+def _close_fd(fd: int):
+    # NOTE: Before the FD number can be reused.
+    del _paths[fd]
+    _close(fd)
+
 
 thread_level_lock_ref: ThreadSafeKeyedRefPool[str, ShareableThreadLock] = (
-    ThreadSafeKeyedRefPool(Lock(), {}, lambda _: ShareableThreadLock())
+    ThreadSafeKeyedRefPool(
+        lambda key: ShareableThreadLock(thread_level_lock_policy(), key),
+        shards=_shards,
+        name="thread_level_lock",
+    )
 )
 
 process_level_lock_ref: ThreadSafeKeyedRefPool[int, ShareableProcessLock] = (
-    ThreadSafeKeyedRefPool(Lock(), {}, ShareableProcessLock)
+    ThreadSafeKeyedRefPool(
+        lambda fd: ShareableProcessLock(
+            fd, process_level_lock_backend() == "ofd", _paths.get(fd)
+        ),
+        shards=_shards,
+        name="process_level_lock",
+    )
 )
 
-fd_ref: ThreadSafeKeyedRefPool[str, int] = ThreadSafeKeyedRefPool(
-    Lock(),
-    {},
+# NOTE: Each entry is only ever accessed by its owner.
+owned_process_level_locks: dict[tuple[str, Hashable], OwnedProcessLock] = {}
+
+# NOTE: Open file descriptions not held by any owner, checked out by owners.
+ofd_ref: ThreadSafeKeyedRefPool[str, int] = ThreadSafeKeyedRefPool(
     lambda normalized_path: _open(normalized_path, O_RDWR),
     destructor=_close,
+    shards=_shards,
+    name="ofd",
 )
+
+fd_ref: ThreadSafeKeyedRefPool[str, int] = ThreadSafeKeyedRefPool(
+    _open_fd, destructor=_close_fd, shards=_shards, name="fd"
+)
+
+
+def set_pool_shards(shards: int) -> None:
+    """Sets the number of shards of the process-wide pools.
+
+    Keys are hashed to shards, each guarded by its own mutex. More shards
+    means less contention between threads locking unrelated paths. Must be
+    called before any path is locked.
+
+    Parameters
+    ----------
+    shards
+        The number of shards of each pool (64 by default).
+    """
+    for pool in (thread_level_lock_ref, process_level_lock_ref, fd_ref, ofd_ref):
+        pool.reshard(shards)
+
+
+def set_idle_fd_cache(budget: Optional[int] = None) -> None:
+    """Keeps the file descriptors of unlocked paths open for reuse.
+
+    By default, the file descriptor of a path is closed as soon as nobody locks
+    that path anymore, so that locking and unlocking the same path in a loop
+    opens and closes it every time. Once enabled, up to :code:`budget` such
+    file descriptors are kept open, the least recently used ones being closed
+    first. A file descriptor is only ever closed while nobody locks its path,
+    and its path cannot be opened again until it is closed, so closing it
+    never drops a process-level lock held through the same normalized path.
+
+    A cached file descriptor keeps referring to the file it was opened on: lock
+    files must not be deleted or replaced while the cache is enabled, except
+    by :meth:`dreadlocks.KeyLockNamespace.collect`, and their file offset is
+    preserved from one lock to the next.
+
+    Parameters
+    ----------
+    budget
+        How many idle file descriptors to keep open at most. If None, a
+        quarter of the maximum number of files this process can open
+        (:code:`RLIMIT_NOFILE` on UNIX). Zero disables the cache and closes
+        all idle file descriptors. The budget is split evenly between pool
+        shards, see :func:`set_pool_shards`. With the :code:`"ofd"` backend,
+        :func:`dreadlocks.path_lock` and
+        :func:`dreadlocks.process_level_path_lock` each get that budget, see
+        :func:`dreadlocks.set_process_level_lock_backend`.
+    """
+    if budget is None:
+        budget = open_files_limit() // 4
+    fd_ref.set_idle(budget)
+    ofd_ref.set_idle(budget)
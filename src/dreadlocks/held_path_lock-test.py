@@ -0,0 +1,117 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from threading import Barrier
+
+import pytest
+
+from dreadlocks import (
+    AcquiringLockWouldBlockError,
+    held_path_lock,
+    path_lock,
+)
+from dreadlocks.held_path_lock import Mode
+
+mp = get_context(method="spawn")
+
+
+def can_lock(path: str, mode: Mode) -> bool:
+    try:
+        with held_path_lock(path, mode, blocking=False):
+            return True
+    except AcquiringLockWouldBlockError:
+        return False
+
+
+def test_upgrade_and_downgrade(tmp_path: Path):
+    path = str(tmp_path / "lock")
+    Path(path).touch()
+    is_locked = Barrier(2)
+    is_done = Barrier(2)
+
+    def read():
+        with path_lock(path, shared=True):
+            is_locked.wait()
+            is_done.wait()
+
+    with (
+        ThreadPoolExecutor(1) as threads,
+        ProcessPoolExecutor(1, mp_context=mp) as processes,
+    ):
+
+        def modes() -> list[bool]:
+            return [
+                processes.submit(can_lock, path, mode).result()
+                for mode in ("shared", "upgradable", "exclusive")
+            ]
+
+        with held_path_lock(path) as lock:
+            assert modes() == [True, False, False]
+            reader = threads.submit(read)
+            is_locked.wait()
+            with pytest.raises(AcquiringLockWouldBlockError):
+                lock.upgrade(blocking=False)
+            assert lock.mode == "upgradable"
+            is_done.wait()
+            reader.result()
+
+            lock.upgrade()
+            assert lock.mode == "exclusive"
+            assert modes() == [False, False, False]
+            assert not threads.submit(can_lock, path, "shared").result()
+
+            lock.downgrade()
+            assert lock.mode == "upgradable"
+            assert modes() == [True, False, False]
+            assert threads.submit(can_lock, path, "shared").result()
+
+            lock.downgrade()
+            assert lock.mode == "shared"
+            assert modes() == [True, True, False]
+            with pytest.raises(ValueError):
+                lock.upgrade()
+        assert modes() == [True, True, True]
+
+
+def increment(path: str, n: int):
+    for _ in range(n):
+        with held_path_lock(path) as lock:
+            with open(lock.fd, closefd=False) as fp:
+                value = int(fp.read() or 0)
+            lock.upgrade()
+            with open(lock.fd, "w", closefd=False) as fp:
+                fp.seek(0)
+                fp.write(str(value + 1))
+
+
+def test_upgrades_do_not_dead_lock(tmp_path: Path):
+    path = str(tmp_path / "counter")
+    Path(path).touch()
+    with (
+        ThreadPoolExecutor(2) as threads,
+        ProcessPoolExecutor(2, mp_context=mp) as processes,
+    ):
+        futures = [
+            executor.submit(increment, path, 20)
+            for executor in (threads, threads, processes, processes)
+        ]
+        for future in futures:
+            future.result(timeout=60)
+    assert Path(path).read_text() == "80"
+
+
+def test_modes(tmp_path: Path):
+    path = str(tmp_path / "lock")
+    Path(path).touch()
+    with pytest.raises(ValueError):
+        with held_path_lock(path, "intent"):  # type: ignore [reportArgumentType]
+            pass
+    with held_path_lock(path, "shared") as lock:
+        with pytest.raises(ValueError):
+            lock.downgrade()
+    with ThreadPoolExecutor(1) as threads:
+        with held_path_lock(path, "exclusive") as lock:
+            assert not threads.submit(can_lock, path, "upgradable").result()
+            lock.downgrade()
+            assert lock.mode == "shared"
+            assert threads.submit(can_lock, path, "upgradable").result()
@@ -0,0 +1,287 @@
+from contextlib import ExitStack, contextmanager
+from os.path import normpath
+from threading import get_ident
+from typing import Literal, Optional, Union
+
+from .backend import process_level_lock_backend
+from .broker import BrokerLock
+from .deadline import absolute_deadline
+from .globals import fd_ref, process_level_lock_ref, thread_level_lock_ref
+from .locked_file import LockedFile
+from .ofd import OwnedProcessLock
+from .owned_process_level_lock import _get, _put  # type: ignore [reportPrivateUsage]
+from .platform import is_windows
+from .process import ShareableProcessLock
+from .region import INTENT, region
+from .thread import ShareableThreadLock
+
+Mode = Literal["shared", "upgradable", "exclusive"]
+"""How a path is held by :func:`dreadlocks.held_path_lock`:
+
+- :code:`"shared"`: along with any number of shared and upgradable holders,
+- :code:`"upgradable"`: like shared, but excluding other upgradable holders,
+  so that it can be upgraded to exclusive without dead-locking,
+- :code:`"exclusive"`: alone.
+"""
+
+modes: tuple[Mode, ...] = ("shared", "upgradable", "exclusive")
+
+
+class HeldPathLock(LockedFile):
+    """A path held both at the thread-level and process-level by the current
+    thread, whose mode can change while it is held. See
+    :class:`dreadlocks.LockedFile` for positional I/O on the path.
+
+    Attributes
+    ----------
+    fd
+        A file descriptor of the path, which must not be closed. See
+        :func:`dreadlocks.path_lock`.
+    mode
+        How the path is currently held, see :data:`Mode`.
+    """
+
+    def __init__(
+        self,
+        fd: int,
+        mode: Mode,
+        thread_lock: ShareableThreadLock,
+        process_lock: Union[ShareableProcessLock, OwnedProcessLock, BrokerLock],
+        start: int,
+        end: int,
+    ):
+        self.fd = fd
+        self.mode = mode
+        self._thread_lock = thread_lock
+        self._process_lock = process_lock
+        self._owner = get_ident()
+        self._start = start
+        self._end = end
+        # NOTE: Whether the intent locks are held, which stays true once
+        # upgraded, so that downgrading goes back to upgradable.
+        self._intent = mode == "upgradable"
+
+    def upgrade(self, blocking: bool = True, timeout: Optional[float] = None) -> None:
+        """Goes from upgradable to exclusive, waiting for shared holders to
+        release the path. If that fails, the path is still held upgradable.
+
+        Parameters
+        ----------
+        blocking
+            Whether to wait. See :func:`dreadlocks.path_lock`.
+        timeout
+            How long to wait, in seconds, if blocking. See
+            :func:`dreadlocks.path_lock`.
+        """
+        if self.mode != "upgradable":
+            raise ValueError(f"Cannot upgrade a lock held {self.mode}.")
+        deadline = absolute_deadline(timeout)
+        self._thread_lock.upgrade(
+            blocking, deadline, self._owner, self._start, self._end
+        )
+        try:
+            if isinstance(self._process_lock, ShareableProcessLock):
+                self._process_lock.upgrade(
+                    blocking, deadline, self._owner, self._start, self._end
+                )
+            else:
+                self._process_lock.upgrade(blocking, deadline, self._start, self._end)
+        except BaseException:
+            self._thread_lock.downgrade(self._owner, self._start, self._end)
+            raise
+        self.mode = "exclusive"
+
+    def downgrade(self) -> None:
+        """Goes from exclusive to upgradable if upgraded, to shared otherwise,
+        or from upgradable to shared, which never waits"""
+        if self.mode == "exclusive":
+            if isinstance(self._process_lock, ShareableProcessLock):
+                self._process_lock.downgrade(self._owner, self._start, self._end)
+            else:
+                self._process_lock.downgrade(self._start, self._end)
+            self._thread_lock.downgrade(self._owner, self._start, self._end)
+            self.mode = "upgradable" if self._intent else "shared"
+        elif self.mode == "upgradable":
+            self._release_intent()
+            self.mode = "shared"
+        else:
+            raise ValueError("Cannot downgrade a lock held shared.")
+
+    def _acquire(self, blocking: bool, reentrant: bool, deadline: Optional[float]):
+        shared = self.mode != "exclusive"
+        with ExitStack() as undo:
+            if self._intent:
+                # NOTE: Intents are locked first, so that upgradable holders
+                # never wait for each other while holding the path.
+                intent = self._thread_lock.intent
+                intent.acquire(False, blocking, reentrant, deadline, self._owner)
+                undo.callback(intent.release, False, self._owner)
+                if not is_windows:
+                    # NOTE: Shared locks are exclusive on Windows anyway.
+                    self._lock(False, blocking, reentrant, deadline, *INTENT)
+                    undo.callback(self._unlock, False, *INTENT)
+            self._thread_lock.acquire(
+                shared,
+                blocking,
+                reentrant,
+                deadline,
+                self._owner,
+                self._start,
+                self._end,
+            )
+            undo.callback(
+                self._thread_lock.release, shared, self._owner, self._start, self._end
+            )
+            self._lock(shared, blocking, reentrant, deadline, self._start, self._end)
+            undo.pop_all()
+
+    def _release(self):
+        shared = self.mode != "exclusive"
+        try:
+            self._unlock(shared, self._start, self._end)
+        finally:
+            try:
+                self._thread_lock.release(shared, self._owner, self._start, self._end)
+            finally:
+                if self._intent:
+                    self._release_intent()
+
+    def _release_intent(self):
+        try:
+            if not is_windows:
+                self._unlock(False, *INTENT)
+        finally:
+            self._thread_lock.intent.release(False, self._owner)
+            self._intent = False
+
+    def _lock(
+        self,
+        shared: bool,
+        blocking: bool,
+        reentrant: bool,
+        deadline: Optional[float],
+        start: int,
+        end: int,
+    ):
+        if isinstance(self._process_lock, ShareableProcessLock):
+            self._process_lock.acquire(
+                shared, blocking, reentrant, deadline, self._owner, start, end
+            )
+        else:
+            self._process_lock.acquire(
+                shared, blocking, reentrant, deadline, start, end
+            )
+
+    def _unlock(self, shared: bool, start: int, end: int):
+        if isinstance(self._process_lock, ShareableProcessLock):
+            self._process_lock.release(shared, self._owner, start, end)
+        else:
+            self._process_lock.release(shared, start, end)
+
+
+@contextmanager
+def held_path_lock(
+    path: str,
+    mode: Mode = "upgradable",
+    blocking: bool = True,
+    reentrant: bool = False,
+    timeout: Optional[float] = None,
+    start: int = 0,
+    length: int = 0,
+):
+    """Locks a path both at the thread-level and process-level, in a mode that
+    can change while it is held.
+
+    Unlike :func:`dreadlocks.path_lock`, which upgrades process-level locks
+    implicitly when a thread locks exclusively a path it holds shared, the
+    yielded :class:`dreadlocks.held_path_lock.HeldPathLock` is upgraded and
+    downgraded explicitly, without releasing the path in between. Only
+    upgradable locks can be upgraded: upgradable holders exclude each other,
+    so that two of them never wait for each other to release the path.
+
+    Examples
+    --------
+    >>> from tempfile import NamedTemporaryFile
+    >>> with NamedTemporaryFile() as file, held_path_lock(file.name) as lock:
+    ...     lock.upgrade()
+    ...     lock.mode
+    'exclusive'
+
+    Parameters
+    ----------
+    path
+        The path to lock. See :func:`dreadlocks.path_lock`.
+    mode
+        How to hold the path at first, see
+        :data:`dreadlocks.held_path_lock.Mode`.
+    blocking
+        Whether lock acquisition is blocking. See :func:`dreadlocks.path_lock`.
+    reentrant
+        Whether lock acquisition is reentrant. See :func:`dreadlocks.path_lock`.
+    timeout
+        How long to wait, in seconds, if blocking. See
+        :func:`dreadlocks.path_lock`.
+    start
+        The offset of the first byte of the region to lock. Upgradable holders
+        exclude each other whatever their regions. See
+        :func:`dreadlocks.path_lock`.
+    length
+        The number of bytes of the region to lock. See
+        :func:`dreadlocks.path_lock`.
+
+    Yields
+    ------
+    HeldPathLock
+        The held lock.
+    """
+    if mode not in modes:
+        raise ValueError(f"Unknown mode {mode!r}.")
+    normalized_path = normpath(path)
+    deadline = absolute_deadline(timeout)
+    start, end = region(start, length)
+    owner = get_ident()
+    backend = process_level_lock_backend()
+    with thread_level_lock_ref(normalized_path) as thread_lock:
+        if backend == "broker":
+            with fd_ref(normalized_path) as fd:
+                lock = BrokerLock(fd, normalized_path, owner)
+                held = HeldPathLock(fd, mode, thread_lock, lock, start, end)
+                held._acquire(blocking, reentrant, deadline)  # type: ignore [reportPrivateUsage]
+                try:
+                    yield held
+                finally:
+                    held._release()  # type: ignore [reportPrivateUsage]
+            return
+
+        if backend == "ofd":
+            lock = _get(normalized_path, owner)
+            held = HeldPathLock(lock.fd, mode, thread_lock, lock, start, end)
+            try:
+                held._acquire(blocking, reentrant, deadline)  # type: ignore [reportPrivateUsage]
+            except BaseException as error:
+                _put(normalized_path, owner, lock, error)
+                raise
+            try:
+                yield held
+            finally:
+                try:
+                    held._release()  # type: ignore [reportPrivateUsage]
+                finally:
+                    _put(normalized_path, owner, lock)
+            return
+
+        with ExitStack() as stack:
+            fd = stack.enter_context(fd_ref(normalized_path))
+            process_lock = stack.enter_context(process_level_lock_ref(fd))
+            # NOTE: Abandoned kernel requests may still refer to the lock and
+            # FD once released.
+            refs = stack.pop_all()
+            try:
+                held = HeldPathLock(fd, mode, thread_lock, process_lock, start, end)
+                held._acquire(blocking, reentrant, deadline)  # type: ignore [reportPrivateUsage]
+                try:
+                    yield held
+                finally:
+                    held._release()  # type: ignore [reportPrivateUsage]
+            finally:
+                process_lock.defer(refs.close)
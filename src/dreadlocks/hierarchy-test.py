@@ -0,0 +1,106 @@
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from threading import Lock
+from time import sleep
+
+import pytest
+
+from dreadlocks import AcquiringLockWouldBlockError, KeyLockNamespace, LockHierarchy
+
+mp = get_context(method="spawn")
+
+
+def can_lock(root: str, keys: str, path: str, shared: bool) -> bool:
+    tree = LockHierarchy(root, KeyLockNamespace(keys))
+    try:
+        with tree.lock(f"{root}/{path}", shared=shared, blocking=False):
+            return True
+    except AcquiringLockWouldBlockError:
+        return False
+
+
+@pytest.fixture
+def tree(tmp_path: Path) -> LockHierarchy:
+    return LockHierarchy(str(tmp_path / "tree"), KeyLockNamespace(str(tmp_path)))
+
+
+def test_files_and_subtrees(tree: LockHierarchy):
+    keys = tree.namespace.root
+    attempts = [
+        (".", True),
+        ("a", True),
+        ("a", False),
+        ("a/f", True),
+        ("a/g", False),
+        ("b", False),
+    ]
+    with (
+        ProcessPoolExecutor(1, mp_context=mp) as processes,
+        ThreadPoolExecutor(1) as threads,
+    ):
+
+        def lockable(executor: Executor):
+            return [
+                executor.submit(can_lock, tree.root, keys, path, shared).result()
+                for path, shared in attempts
+            ]
+
+        with tree.lock(f"{tree.root}/a/f"):
+            assert lockable(processes) == [False, False, False, False, True, True]
+            assert lockable(threads) == [False, False, False, False, True, True]
+        with tree.lock(f"{tree.root}/a", shared=True):
+            assert lockable(processes) == [True, True, False, True, False, True]
+            assert lockable(threads) == [True, True, False, True, False, True]
+        with tree.lock(f"{tree.root}/a/f", shared=True):
+            with tree.lock(f"{tree.root}/a/g"):
+                assert lockable(processes) == [False, False, False, True, False, True]
+
+
+def test_tasks(tree: LockHierarchy):
+    held: list[int] = []
+
+    async def hold(n: int):
+        async with tree.alock(f"{tree.root}/a" if n else f"{tree.root}/a/f"):
+            held.append(n)
+            await asyncio.sleep(0.01)
+            held.append(n)
+
+    async def main():
+        await asyncio.gather(*map(hold, range(3)))
+
+    asyncio.run(main())
+    assert held[::2] == held[1::2]
+    with pytest.raises(ValueError):
+        tree.nodes("/elsewhere")
+
+
+def test_snapshots_exclude_writers(tree: LockHierarchy):
+    inside = {"writers": 0, "snapshots": 0}
+    overlaps: list[dict[str, int]] = []
+    mutex = Lock()
+
+    def enter(kind: str):
+        with mutex:
+            inside[kind] += 1
+            if inside["writers"] and inside["snapshots"]:
+                overlaps.append(dict(inside))
+
+    def leave(kind: str):
+        with mutex:
+            inside[kind] -= 1
+
+    def work(n: int):
+        for i in range(50):
+            kind = "snapshots" if (n + i) % 3 == 0 else "writers"
+            path = f"{tree.root}/a" if kind == "snapshots" else f"{tree.root}/a/{n}"
+            with tree.lock(path, shared=kind == "snapshots", timeout=30):
+                enter(kind)
+                sleep(0.0005)
+                leave(kind)
+
+    with ThreadPoolExecutor(4) as threads:
+        for future in [threads.submit(work, n) for n in range(4)]:
+            future.result()
+    assert not overlaps
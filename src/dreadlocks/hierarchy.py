@@ -0,0 +1,203 @@
+from contextlib import AsyncExitStack, ExitStack, asynccontextmanager, contextmanager
+from os import path as os_path
+from typing import Literal, Optional
+
+from .deadline import absolute_deadline, remaining
+from .key_lock_namespace import KeyLockNamespace
+
+Mode = Literal["IS", "IX", "S", "X"]
+"""How a node of a :class:`dreadlocks.LockHierarchy` is held:
+
+- :code:`"IS"`: intention to lock descendants shared,
+- :code:`"IX"`: intention to lock descendants exclusively,
+- :code:`"S"`: the node and its whole subtree, shared,
+- :code:`"X"`: the node and its whole subtree, exclusively.
+
+Intentions are compatible with each other. :code:`"S"` is compatible with
+:code:`"IS"` and :code:`"S"`, and :code:`"X"` with nothing.
+"""
+
+# NOTE: Each node is a lock file of the namespace, whose bytes are locked as
+# follows. Every mode but X holds the node byte shared, and X holds it
+# exclusively. IX holds the writers byte shared, and S the readers byte, so
+# that IX holders do not exclude each other, nor do S holders. IX excludes S
+# by locking the readers byte exclusively, which waits for S holders to leave,
+# once it holds the writers byte, and S excludes IX the other way around.
+# Both go through the writers byte first, so that they never dead-lock.
+_NODE = 0
+_WRITERS = 1
+_READERS = 2
+
+
+class LockHierarchy:
+    """Locks files and directory subtrees under a root directory, with
+    intention locks on their ancestors.
+
+    Locking a path, file or directory, locks every directory from the root
+    down to its parent with an intention, :code:`"IS"` or :code:`"IX"`, then
+    the path itself :code:`"S"` or :code:`"X"`, see
+    :data:`dreadlocks.hierarchy.Mode`. Locking a directory locks its whole
+    subtree without enumerating it: it excludes the conflicting locks of its
+    descendants, which need an intention on it. All threads and processes must
+    lock paths of the tree through hierarchies with the same root and
+    namespace.
+
+    Nodes are lock files of a :class:`dreadlocks.KeyLockNamespace`, keyed by
+    absolute path, rather than sidecar files in the tree itself. Region locks
+    are not supported on Windows, and neither are hierarchies.
+
+    Examples
+    --------
+    >>> from tempfile import TemporaryDirectory
+    >>> with TemporaryDirectory() as root, TemporaryDirectory() as keys:
+    ...     tree = LockHierarchy(root, KeyLockNamespace(keys))
+    ...     with tree.lock(f"{root}/a/b", shared=True):
+    ...         tree.nodes(f"{root}/a/b") == [root, f"{root}/a", f"{root}/a/b"]
+    True
+
+    Parameters
+    ----------
+    root
+        The directory at the top of the hierarchy.
+    namespace
+        The namespace of node lock files. Defaults to the default namespace,
+        see :class:`dreadlocks.KeyLockNamespace`.
+    """
+
+    def __init__(self, root: str, namespace: Optional[KeyLockNamespace] = None):
+        self.root = os_path.abspath(root)
+        self.namespace = KeyLockNamespace() if namespace is None else namespace
+
+    def nodes(self, path: str) -> list[str]:
+        """The directories from the root down to path, and path itself"""
+        path = os_path.abspath(path)
+        if os_path.commonpath([self.root, path]) != self.root:
+            raise ValueError(f"{path!r} is not under {self.root!r}.")
+        nodes = [self.root]
+        relative = os_path.relpath(path, self.root)
+        if relative != os_path.curdir:
+            for part in relative.split(os_path.sep):
+                nodes.append(os_path.join(nodes[-1], part))
+        return nodes
+
+    @contextmanager
+    def lock(
+        self,
+        path: str,
+        shared: bool = False,
+        blocking: bool = True,
+        reentrant: bool = False,
+        timeout: Optional[float] = None,
+    ):
+        """Locks a file, or a directory and its whole subtree, both at the
+        thread-level and process-level.
+
+        Parameters
+        ----------
+        path
+            The path to lock, under the root, which need not exist.
+        shared
+            Whether the lock is shared. See :func:`dreadlocks.path_lock`.
+        blocking
+            Whether lock acquisition is blocking. See
+            :func:`dreadlocks.path_lock`.
+        reentrant
+            Whether locking path is reentrant. Intentions always are, so that
+            a thread can lock several paths of the same directory. See
+            :func:`dreadlocks.path_lock`.
+        timeout
+            How long to wait, in seconds, if blocking, for all locks in total.
+            See :func:`dreadlocks.path_lock`.
+        """
+        *ancestors, node = self.nodes(path)
+        deadline = absolute_deadline(timeout)
+        with ExitStack() as stack:
+            for ancestor in ancestors:
+                stack.enter_context(
+                    self._lock(
+                        ancestor, "IS" if shared else "IX", blocking, True, deadline
+                    )
+                )
+            stack.enter_context(
+                self._lock(node, "S" if shared else "X", blocking, reentrant, deadline)
+            )
+            yield
+
+    @asynccontextmanager
+    async def alock(
+        self,
+        path: str,
+        shared: bool = False,
+        blocking: bool = True,
+        reentrant: bool = False,
+        timeout: Optional[float] = None,
+    ):
+        """Locks a file, or a directory and its whole subtree, both at the
+        thread-level and process-level on behalf of the current asyncio task.
+
+        Asynchronous context manager counterpart of :meth:`lock`, with the
+        same parameters.
+        """
+        *ancestors, node = self.nodes(path)
+        deadline = absolute_deadline(timeout)
+        async with AsyncExitStack() as stack:
+            for ancestor in ancestors:
+                await stack.enter_async_context(
+                    self._alock(
+                        ancestor, "IS" if shared else "IX", blocking, True, deadline
+                    )
+                )
+            await stack.enter_async_context(
+                self._alock(node, "S" if shared else "X", blocking, reentrant, deadline)
+            )
+            yield
+
+    @contextmanager
+    def _lock(
+        self,
+        node: str,
+        mode: Mode,
+        blocking: bool,
+        reentrant: bool,
+        deadline: Optional[float],
+    ):
+        def lock(byte: int, shared: bool, reentrant: bool = False):
+            return self.namespace.lock(
+                node, shared, blocking, reentrant, remaining(deadline), byte, 1
+            )
+
+        with ExitStack() as stack:
+            stack.enter_context(lock(_NODE, mode != "X", reentrant))
+            if mode == "IX":
+                stack.enter_context(lock(_WRITERS, True, reentrant))
+                with lock(_READERS, False):
+                    pass
+            elif mode == "S":
+                with lock(_WRITERS, False):
+                    stack.enter_context(lock(_READERS, True, reentrant))
+            yield
+
+    @asynccontextmanager
+    async def _alock(
+        self,
+        node: str,
+        mode: Mode,
+        blocking: bool,
+        reentrant: bool,
+        deadline: Optional[float],
+    ):
+        def lock(byte: int, shared: bool, reentrant: bool = False):
+            return self.namespace.alock(
+                node, shared, blocking, reentrant, remaining(deadline), byte, 1
+            )
+
+        async with AsyncExitStack() as stack:
+            await stack.enter_async_context(lock(_NODE, mode != "X", reentrant))
+            if mode == "IX":
+                await stack.enter_async_context(lock(_WRITERS, True, reentrant))
+                async with lock(_READERS, False):
+                    pass
+            elif mode == "S":
+                async with lock(_WRITERS, False):
+                    await stack.enter_async_context(lock(_READERS, True, reentrant))
+            yield
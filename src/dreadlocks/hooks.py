@@ -0,0 +1,150 @@
+from time import perf_counter
+from typing import Awaitable, Callable, Hashable, Literal, Optional
+
+Level = Literal["thread", "process"]
+"""Which level of a path lock an event is about"""
+
+OnWait = Optional[Callable[[], None]]
+
+
+class LockHooks:
+    """Callbacks notified of lock and pool events, which do nothing unless
+    overridden.
+
+    Hooks are called synchronously by the thread or task concerned, possibly
+    with internal mutexes held: they must be quick, and must not lock paths.
+    Keys are normalized paths, or pairs of a normalized path and
+    :code:`"intent"` for the thread-level locks of upgradable holders, see
+    :func:`dreadlocks.held_path_lock`. Owners are threads identifiers, or
+    asyncio tasks.
+    """
+
+    def on_wait(self, level: Level, key: Hashable, owner: Hashable, shared: bool):
+        """An acquisition cannot be granted right away and waits"""
+
+    def on_acquire(
+        self,
+        level: Level,
+        key: Hashable,
+        owner: Hashable,
+        shared: bool,
+        contended: bool,
+        waited: float,
+    ):
+        """An acquisition is granted, after waiting if contended, for waited
+        seconds in total"""
+
+    def on_fail(
+        self,
+        level: Level,
+        key: Hashable,
+        owner: Hashable,
+        shared: bool,
+        error: BaseException,
+    ):
+        """An acquisition fails, because it would block, timed out, would
+        dead-lock, or was cancelled"""
+
+    def on_release(self, level: Level, key: Hashable, owner: Hashable, shared: bool):
+        """An acquisition is released"""
+
+    def on_upgrade(self, key: Hashable):
+        """Some range of a process-level lock goes from shared to exclusive"""
+
+    def on_downgrade(self, key: Hashable):
+        """Some range of a process-level lock goes from exclusive to shared"""
+
+    def on_create(self, pool: str, key: Hashable):
+        """A pool creates an object, such as a lock or a file descriptor"""
+
+    def on_reuse(self, pool: str, key: Hashable):
+        """A pool revives an idle object instead of creating one"""
+
+    def on_destroy(self, pool: str, key: Hashable):
+        """A pool destroys an object"""
+
+
+current: Optional[LockHooks] = None
+"""The hooks in use, if any. Checking this is all instrumentation costs when
+disabled."""
+
+
+def set_lock_hooks(hooks: Optional[LockHooks]) -> None:
+    """Notifies hooks of lock and pool events from now on.
+
+    See :class:`dreadlocks.hooks.LockHooks`, and :class:`dreadlocks.Metrics`
+    for hooks collecting contention metrics.
+
+    Parameters
+    ----------
+    hooks
+        The hooks to notify, replacing previous ones. If None, instrumentation
+        is disabled, which is the default.
+    """
+    global current
+    current = hooks
+
+
+def observe(
+    hooks: LockHooks,
+    level: Level,
+    key: Hashable,
+    owner: Hashable,
+    shared: bool,
+    acquire: Callable[[OnWait], None],
+) -> None:
+    """Runs acquire, which calls on_wait before it waits, notifying hooks"""
+    started = perf_counter()
+    on_wait = _Waited(hooks, level, key, owner, shared)
+    try:
+        acquire(on_wait)
+    except BaseException as error:
+        hooks.on_fail(level, key, owner, shared, error)
+        raise
+    hooks.on_acquire(
+        level, key, owner, shared, on_wait.waited, perf_counter() - started
+    )
+
+
+async def aobserve(
+    hooks: LockHooks,
+    level: Level,
+    key: Hashable,
+    owner: Hashable,
+    shared: bool,
+    acquire: Callable[[OnWait], Awaitable[None]],
+) -> None:
+    """Asynchronous counterpart of :func:`observe`"""
+    started = perf_counter()
+    on_wait = _Waited(hooks, level, key, owner, shared)
+    try:
+        await acquire(on_wait)
+    except BaseException as error:
+        hooks.on_fail(level, key, owner, shared, error)
+        raise
+    hooks.on_acquire(
+        level, key, owner, shared, on_wait.waited, perf_counter() - started
+    )
+
+
+class _Waited:
+    """Notifies hooks the first time an acquisition waits"""
+
+    __slots__ = ("_hooks", "_event", "waited")
+
+    def __init__(
+        self,
+        hooks: LockHooks,
+        level: Level,
+        key: Hashable,
+        owner: Hashable,
+        shared: bool,
+    ):
+        self._hooks = hooks
+        self._event = (level, key, owner, shared)
+        self.waited = False
+
+    def __call__(self):
+        if not self.waited:
+            self.waited = True
+            self._hooks.on_wait(*self._event)
@@ -0,0 +1,206 @@
+import asyncio
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from threading import Barrier, Thread
+from time import monotonic, sleep
+from typing import Callable, TypeVar
+
+import pytest
+
+from dreadlocks import (
+    AcquiringLockWouldBlockError,
+    KeyLockNamespace,
+    set_idle_fd_cache,
+    set_process_level_lock_backend,
+)
+
+mp = get_context(method="spawn")
+
+T = TypeVar("T")
+
+
+def can_lock(root: str, key: str, shared: bool) -> bool:
+    try:
+        with KeyLockNamespace(root).lock(key, shared=shared, blocking=False):
+            return True
+    except AcquiringLockWouldBlockError:
+        return False
+
+
+def increment(root: str, counter: str, n: int):
+    keys = KeyLockNamespace(root)
+    for _ in range(n):
+        with keys.lock("counter"):
+            path = Path(counter)
+            path.write_text(str(int(path.read_text() or 0) + 1))
+
+
+def test_excludes_threads_and_processes(tmp_path: Path):
+    root = str(tmp_path / "keys")
+    counter = tmp_path / "counter"
+    counter.touch()
+    with (
+        ThreadPoolExecutor(2) as threads,
+        ProcessPoolExecutor(2, mp_context=mp) as processes,
+    ):
+        keys = KeyLockNamespace(root)
+        with keys.lock("key", shared=True):
+            assert threads.submit(can_lock, root, "key", True).result()
+            assert not processes.submit(can_lock, root, "key", False).result()
+            assert processes.submit(can_lock, root, "other", False).result()
+
+        futures = [
+            executor.submit(increment, root, str(counter), 50)
+            for executor in (threads, threads, processes, processes)
+        ]
+        for future in futures:
+            future.result(timeout=60)
+    assert counter.read_text() == "200"
+
+
+def test_layout(tmp_path: Path):
+    keys = KeyLockNamespace(str(tmp_path), levels=3)
+    assert keys.path("key") == keys.path(b"key")
+    with keys.lock(b"key", reentrant=True):
+        with keys.lock("key", reentrant=True) as fd:
+            assert fd >= 0
+    path = Path(keys.path("key"))
+    assert path.is_file()
+    assert len(path.relative_to(tmp_path).parts) == 4
+    with pytest.raises(ValueError):
+        KeyLockNamespace(str(tmp_path), levels=9)
+
+
+def test_tasks(tmp_path: Path):
+    keys = KeyLockNamespace(str(tmp_path))
+    held: list[int] = []
+
+    async def hold(n: int):
+        async with keys.alock("key"):
+            held.append(n)
+            await asyncio.sleep(0.01)
+            held.append(n)
+
+    async def main():
+        await asyncio.gather(*map(hold, range(3)))
+
+    asyncio.run(main())
+    assert held[::2] == held[1::2]
+
+
+def hold(root: str, key: str, locked: str, seconds: float):
+    keys = KeyLockNamespace(root)
+    with keys.lock(key):
+        Path(locked).touch()
+        sleep(seconds)
+
+
+def collect_and_hold(root: str, key: str, locked: str, seconds: float) -> int:
+    removed = KeyLockNamespace(root).collect()
+    hold(root, key, locked, seconds)
+    return removed
+
+
+def held_elsewhere(
+    processes: ProcessPoolExecutor,
+    fn: Callable[[str, str, str, float], T],
+    root: str,
+    key: str,
+    locked: Path,
+    seconds: float,
+) -> "Future[T]":
+    future = processes.submit(fn, root, key, str(locked), seconds)
+    while not locked.exists():
+        assert not future.done()
+        sleep(0.001)
+    return future
+
+
+def test_collect(tmp_path: Path):
+    root = str(tmp_path / "keys")
+    keys = KeyLockNamespace(root)
+    for key in "abcd":
+        with keys.lock(key):
+            pass
+    with ProcessPoolExecutor(1, mp_context=mp) as processes:
+        holder = held_elsewhere(processes, hold, root, "a", tmp_path / "a", 0.2)
+        with keys.lock("b", shared=True):
+            assert keys.collect() == 2
+        holder.result()
+    assert [Path(keys.path(key)).exists() for key in "abcd"] == [
+        True,
+        True,
+        False,
+        False,
+    ]
+    assert keys.collect() == 2
+
+
+def test_collected_files_are_not_locked(tmp_path: Path):
+    root = str(tmp_path / "keys")
+    keys = KeyLockNamespace(root)
+    set_idle_fd_cache(1024)
+    try:
+        with keys.lock("key"):
+            pass
+        with ProcessPoolExecutor(1, mp_context=mp) as processes:
+            # NOTE: The other process removes the file we keep open, and
+            # locks a new one.
+            holder = held_elsewhere(
+                processes, collect_and_hold, root, "key", tmp_path / "held", 0.5
+            )
+            with pytest.raises(AcquiringLockWouldBlockError):
+                with keys.lock("key", blocking=False):
+                    pass
+            assert holder.result() == 1
+    finally:
+        set_idle_fd_cache(0)
+
+
+def test_collector(tmp_path: Path):
+    keys = KeyLockNamespace(str(tmp_path))
+    with keys.lock("key"):
+        pass
+    collector = keys.start_collector(0.01)
+    try:
+        started = monotonic()
+        while Path(keys.path("key")).exists():
+            assert monotonic() - started < 10
+            sleep(0.01)
+    finally:
+        collector.stop()
+    assert not collector.is_alive()
+
+
+def test_first_locks_survive_concurrent_creation(tmp_path: Path):
+    # NOTE: With lockf, closing any file descriptor of the lock file releases
+    # the locks of the whole process, so creating it must not open it.
+    root = str(tmp_path / "keys")
+    keys = KeyLockNamespace(root)
+    threads = 8
+    set_process_level_lock_backend("lockf")
+    try:
+        with ProcessPoolExecutor(1, mp_context=mp) as processes:
+            for trial in range(20):
+                key = f"key-{trial}"
+                are_locked = Barrier(threads + 1)
+                checked = Barrier(threads + 1)
+
+                def hold():
+                    with keys.lock(key, shared=True):
+                        are_locked.wait()
+                        checked.wait()
+
+                holders = [Thread(target=hold) for _ in range(threads)]
+                for holder in holders:
+                    holder.start()
+                are_locked.wait()
+                try:
+                    assert not processes.submit(can_lock, root, key, False).result()
+                finally:
+                    checked.wait()
+                    for holder in holders:
+                        holder.join()
+    finally:
+        set_process_level_lock_backend(None)
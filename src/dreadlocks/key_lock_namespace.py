@@ -0,0 +1,291 @@
+import os
+from contextlib import AsyncExitStack, ExitStack, asynccontextmanager, contextmanager
+from hashlib import blake2b
+from os import path as os_path
+from tempfile import gettempdir
+from threading import Event, Thread, current_thread, get_ident
+from typing import Optional, Union
+
+from .deadline import absolute_deadline, remaining
+from .errors import AcquiringLockWouldBlockError, DeadlockError
+from .globals import fd_ref, ofd_ref
+from .path_lock import apath_lock, path_lock
+from .platform import is_windows
+from .thread_level_lock import athread_level_lock, thread_level_lock
+
+Key = Union[str, bytes]
+
+_tmpfs = "/dev/shm"
+_temporary_prefix = "."
+
+
+def default_root() -> str:
+    """A directory per user on :code:`/dev/shm` if available, a memory file
+    system on Linux, otherwise in the temporary directory"""
+    if is_windows:
+        # NOTE: The temporary directory is already per user.
+        return os_path.join(gettempdir(), "dreadlocks-keys")
+    base = (
+        _tmpfs if os_path.isdir(_tmpfs) and os.access(_tmpfs, os.W_OK) else gettempdir()
+    )
+    return os_path.join(base, f"dreadlocks-keys-{os.getuid()}")
+
+
+class KeyLockNamespace:
+    """Locks arbitrary keys, such as cache keys or object identifiers, through
+    lock files created on demand.
+
+    Keys are hashed to file names, in directories named after the first bytes
+    of the hash, so that no directory grows large enough to slow down lookups,
+    even with millions of keys. Lock files are created atomically the first
+    time a key is locked, and are locked with :func:`dreadlocks.path_lock`.
+    Namespaces with the same root lock the same keys, across threads and
+    processes. Lock files of keys nobody holds can be removed with
+    :meth:`collect`, periodically with :meth:`start_collector`.
+
+    Examples
+    --------
+    >>> from pathlib import Path
+    >>> from tempfile import TemporaryDirectory
+    >>> with TemporaryDirectory() as root:
+    ...     keys = KeyLockNamespace(root)
+    ...     with keys.lock("user:42"):
+    ...         Path(keys.path("user:42")).relative_to(root).parts
+    ('fd', 'd4', 'fdd48118d77004ffecb66c1b1e69dc3c')
+
+    Parameters
+    ----------
+    root
+        The directory of lock files, created if needed. Defaults to a directory
+        per user on :code:`/dev/shm` if available, where lock files cost no
+        disk I/O, otherwise in the temporary directory.
+    levels
+        How many levels of directories to spread lock files over, each
+        splitting them 256 ways.
+    """
+
+    def __init__(self, root: Optional[str] = None, levels: int = 2):
+        if not 0 <= levels <= 8:
+            raise ValueError("Namespaces have between 0 and 8 levels.")
+        self.root = os_path.normpath(default_root() if root is None else root)
+        self.levels = levels
+
+    def path(self, key: Key) -> str:
+        """The lock file of key, which may not exist yet. String keys are
+        encoded in UTF-8."""
+        if isinstance(key, str):
+            key = key.encode()
+        digest = blake2b(key, digest_size=16).hexdigest()
+        directories = (digest[2 * i : 2 * i + 2] for i in range(self.levels))
+        return os_path.join(self.root, *directories, digest)
+
+    @contextmanager
+    def lock(
+        self,
+        key: Key,
+        shared: bool = False,
+        blocking: bool = True,
+        reentrant: bool = False,
+        timeout: Optional[float] = None,
+        start: int = 0,
+        length: int = 0,
+    ):
+        """Locks a key both at the thread-level and process-level.
+
+        Parameters
+        ----------
+        key
+            The key to lock.
+        shared
+            Whether the lock is shared. See :func:`dreadlocks.path_lock`.
+        blocking
+            Whether lock acquisition is blocking. See
+            :func:`dreadlocks.path_lock`.
+        reentrant
+            Whether lock acquisition is reentrant. See
+            :func:`dreadlocks.path_lock`.
+        timeout
+            How long to wait, in seconds, if blocking. See
+            :func:`dreadlocks.path_lock`.
+        start
+            The offset of the first byte of the region to lock. See
+            :func:`dreadlocks.path_lock`.
+        length
+            The number of bytes of the region to lock. See
+            :func:`dreadlocks.path_lock`.
+
+        Yields
+        ------
+        int
+            A file descriptor of the lock file, which must not be closed.
+        """
+        path = self.path(key)
+        deadline = absolute_deadline(timeout)
+        while True:
+            with ExitStack() as stack:
+                try:
+                    fd = stack.enter_context(
+                        path_lock(
+                            path,
+                            shared,
+                            blocking,
+                            reentrant,
+                            remaining(deadline),
+                            start,
+                            length,
+                        )
+                    )
+                except FileNotFoundError:
+                    # NOTE: Creating lock files only when missing saves a
+                    # system call on every other acquisition.
+                    _create(path)
+                    continue
+                if _is_current(path, fd):
+                    yield fd
+                    return
+            # NOTE: The lock file was collected after we opened it. Once
+            # threads of this process are done with the file descriptor of the
+            # old file, we make sure it is not reused.
+            with thread_level_lock(path, False, blocking, reentrant, deadline):
+                _forget(path)
+
+    @asynccontextmanager
+    async def alock(
+        self,
+        key: Key,
+        shared: bool = False,
+        blocking: bool = True,
+        reentrant: bool = False,
+        timeout: Optional[float] = None,
+        start: int = 0,
+        length: int = 0,
+    ):
+        """Locks a key both at the thread-level and process-level on behalf
+        of the current asyncio task.
+
+        Asynchronous context manager counterpart of :meth:`lock`, with the
+        same parameters. See :func:`dreadlocks.apath_lock`.
+        """
+        path = self.path(key)
+        deadline = absolute_deadline(timeout)
+        while True:
+            async with AsyncExitStack() as stack:
+                try:
+                    fd = await stack.enter_async_context(
+                        apath_lock(
+                            path,
+                            shared,
+                            blocking,
+                            reentrant,
+                            remaining(deadline),
+                            start,
+                            length,
+                        )
+                    )
+                except FileNotFoundError:
+                    _create(path)
+                    continue
+                if _is_current(path, fd):
+                    yield fd
+                    return
+            async with athread_level_lock(path, False, blocking, reentrant, deadline):
+                _forget(path)
+
+    def collect(self) -> int:
+        """Removes the lock files of keys nobody holds.
+
+        Each lock file is locked exclusively without blocking, both at the
+        thread-level and process-level, and removed while locked. Whoever
+        opened it before and locks it afterwards notices that the path now
+        leads to another file, or none, and locks the key again.
+
+        Returns
+        -------
+        int
+            How many lock files were removed.
+        """
+        removed = 0
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if name.startswith(_temporary_prefix):
+                    continue
+                removed += _collect(os_path.join(directory, name))
+        return removed
+
+    def start_collector(self, interval: float = 600.0) -> "Collector":
+        """Collects lock files every interval seconds in a daemon thread, see
+        :meth:`collect`, until the returned collector is stopped"""
+        collector = Collector(self, interval)
+        collector.start()
+        return collector
+
+
+class Collector(Thread):
+    """A daemon thread collecting the lock files of a namespace periodically,
+    see :meth:`KeyLockNamespace.start_collector`"""
+
+    def __init__(self, namespace: KeyLockNamespace, interval: float):
+        super().__init__(name="dreadlocks-collector", daemon=True)
+        self.namespace = namespace
+        self.interval = interval
+        self._stopped = Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.namespace.collect()
+
+    def stop(self) -> None:
+        """Stops collecting, and waits for an ongoing collection to end"""
+        self._stopped.set()
+        if self is not current_thread():
+            self.join()
+
+
+def _create(path: str):
+    """Creates an empty lock file and its directories, unless they exist"""
+    directory, name = os_path.split(path)
+    os.makedirs(directory, exist_ok=True)
+    # NOTE: Closing any file descriptor of a file releases all the lockf locks
+    # of the process on it, including those another thread took after opening
+    # the file we are racing to create. We thus never open the lock file
+    # itself, but link it to a temporary file of the same directory.
+    temporary = os_path.join(
+        directory, f"{_temporary_prefix}{name}-{os.getpid()}-{get_ident()}"
+    )
+    os.close(os.open(temporary, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o666))
+    try:
+        os.link(temporary, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.unlink(temporary)
+
+
+def _is_current(path: str, fd: int) -> bool:
+    """Whether path still leads to the file of fd"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return False
+    return os_path.samestat(stat, os.fstat(fd))
+
+
+def _forget(path: str):
+    """Closes idle file descriptors of path"""
+    fd_ref.discard(path)
+    ofd_ref.discard(path)
+
+
+def _collect(path: str) -> bool:
+    try:
+        with path_lock(path, blocking=False) as fd:
+            if not _is_current(path, fd):
+                return False
+            os.unlink(path)
+    except (AcquiringLockWouldBlockError, DeadlockError, OSError):
+        # NOTE: The file is held, was removed meanwhile, or cannot be removed
+        # while open, as on Windows.
+        return False
+    finally:
+        _forget(path)
+    return True
@@ -0,0 +1,57 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from dreadlocks import generation_lock, held_path_lock
+from dreadlocks.platform import is_windows
+
+
+@pytest.fixture
+def path(tmp_path: Path) -> str:
+    path = tmp_path / "data"
+    path.write_bytes(bytes(range(256)) * 16)
+    return str(path)
+
+
+def test_shared_holders_read_concurrently(path: str):
+    def read(offset: int) -> bytes:
+        with held_path_lock(path, mode="shared") as lock:
+            return lock.pread(4, offset)
+
+    with held_path_lock(path, mode="shared") as lock:
+        position = os.lseek(lock.fd, 3, os.SEEK_SET)
+        with ThreadPoolExecutor(4) as threads:
+            reads = list(threads.map(read, range(0, 4096, 256)))
+        assert reads == [bytes(range(4))] * 16
+        assert lock.pread(8, 4094) == b"\xfe\xff"
+        buffer = bytearray(6)
+        assert lock.preadinto(memoryview(buffer)[1:], 254) == 5
+        assert buffer == b"\x00\xfe\xff\x00\x01\x02"
+        assert os.lseek(lock.fd, 0, os.SEEK_CUR) == position
+
+
+def test_writes(path: str):
+    with generation_lock(path) as lock:
+        lock.truncate(2)
+        lock.pwrite(memoryview(b"xyz")[1:], 4)
+        assert lock.readall() == b"\x00\x01\x00\x00yz"
+        lock.mark_dirty()
+
+
+def test_atomic_replace(tmp_path: Path, path: str):
+    lock_path = tmp_path / "lock"
+    lock_path.touch()
+    if not is_windows:
+        os.chmod(path, 0o640)
+    with held_path_lock(str(lock_path), mode="exclusive") as lock:
+        lock.atomic_replace(path, b"replaced")
+        lock.atomic_replace(str(tmp_path / "new"), bytearray(b"new"))
+        with pytest.raises(ValueError):
+            lock.atomic_replace(str(lock_path), b"")
+    assert Path(path).read_bytes() == b"replaced"
+    assert (tmp_path / "new").read_bytes() == b"new"
+    if not is_windows:
+        assert Path(path).stat().st_mode & 0o777 == 0o640
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["data", "lock", "new"]
@@ -0,0 +1,171 @@
+import os
+from os import path as os_path
+from secrets import token_hex
+from stat import S_IMODE
+from typing import Union
+
+from .platform import is_windows
+
+Data = Union[bytes, bytearray, memoryview]
+
+_chunk = 2**30
+
+
+def _pread(fd: int, length: int, offset: int) -> bytes:
+    if hasattr(os, "pread"):
+        return os.pread(fd, length, offset)
+    # NOTE: Windows has no pread, we restore the offset the caller may rely on.
+    # Threads sharing the file descriptor may still see it move meanwhile.
+    position = os.lseek(fd, 0, os.SEEK_CUR)
+    try:
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, length)
+    finally:
+        os.lseek(fd, position, os.SEEK_SET)
+
+
+def _pwrite(fd: int, data: Data, offset: int) -> int:
+    if hasattr(os, "pwrite"):
+        return os.pwrite(fd, data, offset)
+    position = os.lseek(fd, 0, os.SEEK_CUR)
+    try:
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.write(fd, data)
+    finally:
+        os.lseek(fd, position, os.SEEK_SET)
+
+
+def _write_all(fd: int, data: Data, offset: int):
+    """Writes data at offset, however many system calls it takes, without
+    copying it"""
+    with memoryview(data) as view, view.cast("B") as remaining:
+        written = 0
+        while written < len(remaining):
+            with remaining[written : written + _chunk] as chunk:
+                written += _pwrite(fd, chunk, offset + written)
+
+
+def _create_temporary(directory: str, name: str) -> tuple[int, str]:
+    """Creates a file next to name, with the permissions of new files"""
+    while True:
+        path = os_path.join(directory, f".{name}.{token_hex(8)}")
+        try:
+            flags = os.O_RDWR | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+            return os.open(path, flags, 0o666), path
+        except FileExistsError:
+            continue
+
+
+class LockedFile:
+    """Positional I/O on the file descriptor of a held path, which never moves
+    its offset nor closes it.
+
+    File objects opened on the file descriptor must not close it, see
+    :func:`dreadlocks.path_lock`, and share its offset with every thread and
+    task of the process holding the path. Reads and writes instead give the
+    offset they apply to, so that shared holders of a process read
+    concurrently. Writing, truncating, and replacing files is meant for
+    exclusive holders.
+
+    Attributes
+    ----------
+    fd
+        A file descriptor of the path, which must not be closed. See
+        :func:`dreadlocks.path_lock`.
+    """
+
+    fd: int
+
+    def pread(self, length: int, offset: int = 0) -> bytes:
+        """Reads up to length bytes at offset, fewer only at the end of the
+        file"""
+        data = _pread(self.fd, length, offset)
+        if len(data) in (0, length):
+            return data
+        # NOTE: Reads may return less than asked before the end of the file,
+        # e.g. past 2GiB on Linux.
+        chunks = [data]
+        read = len(data)
+        while read < length:
+            data = _pread(self.fd, length - read, offset + read)
+            if not data:
+                break
+            chunks.append(data)
+            read += len(data)
+        return b"".join(chunks)
+
+    def preadinto(self, buffer: Union[bytearray, memoryview], offset: int = 0) -> int:
+        """Reads into buffer at offset, and returns how many bytes were read,
+        fewer than its size only at the end of the file"""
+        with memoryview(buffer) as view, view.cast("B") as remaining:
+            read = 0
+            while read < len(remaining):
+                with remaining[read : read + _chunk] as chunk:
+                    if hasattr(os, "preadv"):
+                        n = os.preadv(self.fd, [chunk], offset + read)
+                    else:
+                        data = _pread(self.fd, len(chunk), offset + read)
+                        n = len(data)
+                        chunk[:n] = data
+                if not n:
+                    break
+                read += n
+            return read
+
+    def readall(self) -> bytes:
+        """Reads the whole file, in a single system call when possible"""
+        return self.pread(os.fstat(self.fd).st_size)
+
+    def pwrite(self, data: Data, offset: int = 0) -> None:
+        """Writes all of data at offset, without copying it"""
+        _write_all(self.fd, data, offset)
+
+    def truncate(self, size: int = 0) -> None:
+        """Truncates or extends the file to size bytes"""
+        os.ftruncate(self.fd, size)
+
+    def atomic_replace(self, path: str, data: Data) -> None:
+        """Replaces the file at path by one holding data, so that readers and
+        crashes see either the whole previous file or the whole new one.
+
+        Data is written to a temporary file in the same directory, with the
+        permissions of the previous file if any, flushed to disk, and renamed
+        over path. Path must be another file than the locked one, such as a
+        data file guarded by a lock file next to it: holders that opened the
+        locked path before it is replaced would otherwise keep locking the
+        previous file.
+        """
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            mode = None
+        else:
+            if os_path.samestat(stat, os.fstat(self.fd)):
+                raise ValueError("Cannot replace the locked file.")
+            mode = S_IMODE(stat.st_mode)
+
+        directory, name = os_path.split(os_path.abspath(path))
+        fd, temporary = _create_temporary(directory, name)
+        try:
+            try:
+                if mode is not None:
+                    os.chmod(temporary, mode)
+                _write_all(fd, data, 0)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            os.replace(temporary, path)
+        except BaseException:
+            try:
+                os.unlink(temporary)
+            except OSError:
+                pass
+            raise
+
+        if not is_windows:
+            # NOTE: The rename itself is only durable once the directory is.
+            directory_fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(directory_fd)
+            finally:
+                os.close(directory_fd)
@@ -0,0 +1,86 @@
+import asyncio
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import pytest
+
+from dreadlocks import (
+    AcquiringLockWouldBlockError,
+    MappedFile,
+    amapped_path_lock,
+    mapped_path_lock,
+    path_lock,
+)
+from dreadlocks.backend import process_level_lock_backend
+
+mp = get_context(method="spawn")
+
+pytestmark = pytest.mark.skipif(
+    process_level_lock_backend() == "lockf" and sys.version_info < (3, 13),
+    reason="Maps drop lockf locks before Python 3.13.",
+)
+
+
+def can_lock(path: str, shared: bool) -> bool:
+    try:
+        with path_lock(path, shared=shared, blocking=False):
+            return True
+    except AcquiringLockWouldBlockError:
+        return False
+
+
+@pytest.fixture
+def path(tmp_path: Path) -> str:
+    path = tmp_path / "data"
+    path.write_bytes(bytes(range(256)) * 4096)
+    return str(path)
+
+
+def test_shared_maps_are_read_only(path: str):
+    with mapped_path_lock(path, shared=True) as mapped:
+        assert len(mapped) == 2**20
+        assert mapped.view[1:4] == b"\x01\x02\x03"
+        assert mapped.view.readonly
+        with pytest.raises(TypeError):
+            mapped.view[0] = 1
+        with pytest.raises(ValueError):
+            mapped.resize(0)
+
+
+def test_exclusive_maps_are_writable_and_resizable(path: str):
+    with mapped_path_lock(path) as mapped:
+        mapped.view[:5] = b"hello"
+        mapped.resize(2**21)
+        assert len(mapped) == 2**21
+        assert mapped.view[:5] == b"hello"
+        with pytest.raises(BufferError):
+            with mapped.view[:5]:
+                mapped.resize(5)
+        mapped.resize(5)
+    with mapped_path_lock(path, shared=True) as mapped:
+        assert mapped.view == b"hello"
+
+
+def test_refresh_and_empty_files(path: str):
+    Path(path).write_bytes(b"")
+    with path_lock(path) as fd:
+        with MappedFile(fd, writable=True) as mapped:
+            assert len(mapped) == 0
+            with open(fd, "ab", closefd=False) as fp:
+                fp.write(b"data")
+            mapped.refresh()
+            assert mapped.view == b"data"
+
+
+def test_unmapping_keeps_the_lock(path: str):
+    async def main():
+        async with amapped_path_lock(path, shared=True) as mapped:
+            assert mapped.view[255] == 255
+            mapped.close()
+            with ProcessPoolExecutor(1, mp_context=mp) as processes:
+                assert processes.submit(can_lock, path, True).result()
+                assert not processes.submit(can_lock, path, False).result()
+
+    asyncio.run(main())
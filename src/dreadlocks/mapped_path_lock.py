@@ -0,0 +1,190 @@
+import mmap
+import os
+import sys
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
+
+from .backend import process_level_lock_backend
+from .path_lock import apath_lock, path_lock
+from .platform import is_windows
+
+# NOTE: Before Python 3.13, maps keep a duplicate of the file descriptor, and
+# close it when unmapped, which drops the lockf locks of the process on the
+# file.
+_tracks_fd = not is_windows and sys.version_info < (3, 13)
+
+
+def _map(fd: int, length: int, writable: bool) -> mmap.mmap:
+    access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+    if is_windows or _tracks_fd:
+        return mmap.mmap(fd, length, access=access)
+    return mmap.mmap(
+        fd,
+        length,
+        access=access,
+        trackfd=False,  # type: ignore [reportCallIssue]
+    )
+
+
+class MappedFile:
+    """A memory map of the whole file of a locked file descriptor, which
+    is read without copies.
+
+    The map is read-only unless writable, for exclusive holders. Writes through
+    the map reach the file once unmapped, or when flushed. Unmapping never
+    closes the file descriptor, and must happen before the lock is released,
+    which :func:`dreadlocks.mapped_path_lock` does.
+
+    Examples
+    --------
+    >>> from tempfile import TemporaryDirectory
+    >>> with TemporaryDirectory() as directory:
+    ...     path = f"{directory}/data"
+    ...     with open(path, "wb") as fp:
+    ...         _ = fp.write(b"header:payload")
+    ...     with path_lock(path, shared=True) as fd:
+    ...         with MappedFile(fd) as mapped:
+    ...             bytes(mapped.view[7:])
+    b'payload'
+
+    Parameters
+    ----------
+    fd
+        A locked file descriptor, such as the one yielded by
+        :func:`dreadlocks.path_lock`, opened for reading and writing.
+    writable
+        Whether the map is writable, for exclusive holders only.
+
+    Attributes
+    ----------
+    view
+        A view of the whole file, read-only unless writable, and empty if the
+        file is. Views taken from it, such as slices or numpy arrays, must be
+        released before the map is remapped or unmapped.
+    """
+
+    def __init__(self, fd: int, writable: bool = False):
+        if _tracks_fd and process_level_lock_backend() == "lockf":
+            raise NotImplementedError(
+                "Mapping files locked with lockf requires Python 3.13 or later."
+            )
+        self.fd = fd
+        self.writable = writable
+        self._map: Optional[mmap.mmap] = None
+        self.view = memoryview(b"")
+        self._map_file()
+
+    def __len__(self) -> int:
+        return len(self.view)
+
+    def __enter__(self) -> "MappedFile":
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.close()
+
+    def refresh(self) -> None:
+        """Remaps the file if its size changed, for instance after an
+        exclusive holder wrote past its end through the file descriptor"""
+        if os.fstat(self.fd).st_size != len(self.view):
+            self._unmap()
+            self._map_file()
+
+    def resize(self, size: int) -> None:
+        """Truncates or extends the file to size bytes, and remaps it"""
+        if not self.writable:
+            raise ValueError("Cannot resize a read-only map.")
+        self._unmap()
+        os.ftruncate(self.fd, size)
+        self._map_file()
+
+    def flush(self) -> None:
+        """Writes changes made through the map to the file"""
+        if self._map is not None:
+            self._map.flush()
+
+    def close(self) -> None:
+        """Unmaps the file, without closing the file descriptor"""
+        self._unmap()
+
+    def _map_file(self):
+        # NOTE: Empty files cannot be mapped.
+        size = os.fstat(self.fd).st_size
+        if size:
+            self._map = _map(self.fd, size, self.writable)
+            self.view = memoryview(self._map)
+
+    def _unmap(self):
+        self.view.release()
+        self.view = memoryview(b"")
+        if self._map is None:
+            return
+        try:
+            self._map.close()
+        except BufferError:
+            # NOTE: Views taken from ours are still alive, we keep the map
+            # as it was.
+            self.view = memoryview(self._map)
+            raise
+        self._map = None
+
+
+@contextmanager
+def mapped_path_lock(
+    path: str,
+    shared: bool = False,
+    blocking: bool = True,
+    reentrant: bool = False,
+    timeout: Optional[float] = None,
+):
+    """Locks a path both at the thread-level and process-level, and maps the
+    whole file in memory while it is held.
+
+    Shared holders get a read-only map, exclusive holders a writable one, which
+    they can resize. The file is unmapped before the lock is released. Maps of
+    files locked with the :code:`"lockf"` backend require Python 3.13 or later,
+    since unmapping would otherwise drop the lock. See
+    :class:`dreadlocks.MappedFile`.
+
+    Parameters
+    ----------
+    path
+        The path to lock. See :func:`dreadlocks.path_lock`.
+    shared
+        Whether the lock is shared. See :func:`dreadlocks.path_lock`.
+    blocking
+        Whether lock acquisition is blocking. See :func:`dreadlocks.path_lock`.
+    reentrant
+        Whether lock acquisition is reentrant. See :func:`dreadlocks.path_lock`.
+    timeout
+        How long to wait, in seconds, if blocking. See
+        :func:`dreadlocks.path_lock`.
+
+    Yields
+    ------
+    MappedFile
+        The map of the file.
+    """
+    with path_lock(path, shared, blocking, reentrant, timeout) as fd:
+        with MappedFile(fd, writable=not shared) as mapped:
+            yield mapped
+
+
+@asynccontextmanager
+async def amapped_path_lock(
+    path: str,
+    shared: bool = False,
+    blocking: bool = True,
+    reentrant: bool = False,
+    timeout: Optional[float] = None,
+):
+    """Locks a path both at the thread-level and process-level, and maps the
+    whole file in memory while it is held, on behalf of the current asyncio
+    task.
+
+    Asynchronous context manager counterpart of
+    :func:`dreadlocks.mapped_path_lock`, with the same parameters.
+    """
+    async with apath_lock(path, shared, blocking, reentrant, timeout) as fd:
+        with MappedFile(fd, writable=not shared) as mapped:
+            yield mapped
@@ -0,0 +1,172 @@
+import asyncio
+import time
+from collections.abc import Iterator
+from pathlib import Path
+from threading import Barrier, Thread
+from typing import Any, Hashable
+
+import pytest
+
+from dreadlocks import (
+    AcquiringLockWouldBlockError,
+    LockHooks,
+    Metrics,
+    RecursiveDeadlockError,
+    apath_lock,
+    path_lock,
+    process_level_path_lock,
+    set_idle_fd_cache,
+    set_lock_hooks,
+)
+from dreadlocks.hooks import Level
+from dreadlocks.metrics import SpaceSaving
+
+
+@pytest.fixture
+def metrics() -> Iterator[Metrics]:
+    metrics = Metrics()
+    set_lock_hooks(metrics)
+    try:
+        yield metrics
+    finally:
+        set_lock_hooks(None)
+
+
+class Events(LockHooks):
+    def __init__(self):
+        self.events: list[tuple[Any, ...]] = []
+
+    def on_wait(self, level: Level, key: Hashable, owner: Hashable, shared: bool):
+        self.events.append(("wait", level))
+
+    def on_acquire(
+        self,
+        level: Level,
+        key: Hashable,
+        owner: Hashable,
+        shared: bool,
+        contended: bool,
+        waited: float,
+    ):
+        self.events.append(("acquire", level, key, contended))
+
+    def on_release(self, level: Level, key: Hashable, owner: Hashable, shared: bool):
+        self.events.append(("release", level))
+
+
+def test_hooks(tmp_path: Path):
+    path = str(tmp_path / "lock")
+    Path(path).touch()
+    hooks = Events()
+    set_lock_hooks(hooks)
+    try:
+        with path_lock(path):
+            pass
+    finally:
+        set_lock_hooks(None)
+    with path_lock(path):
+        pass
+    assert hooks.events == [
+        ("acquire", "thread", path, False),
+        ("acquire", "process", path, False),
+        ("release", "process"),
+        ("release", "thread"),
+    ]
+
+
+def test_contended(tmp_path: Path, metrics: Metrics):
+    path = str(tmp_path / "lock")
+    Path(path).touch()
+    is_locked = Barrier(2)
+
+    def hold():
+        with path_lock(path):
+            is_locked.wait()
+
+    with path_lock(path):
+        thread = Thread(target=hold)
+        thread.start()
+        # NOTE: The other thread waits until we release.
+        time.sleep(0.1)
+    is_locked.wait()
+    thread.join()
+
+    report = metrics.report()
+    assert report["counters"]["thread"]["contended"] == 1
+    assert report["counters"]["thread"]["uncontended"] == 1
+    assert report["counters"]["process"]["uncontended"] == 2
+    assert report["hold_times"]["thread"]["count"] == 2
+    (hottest,) = [key for key in report["hottest"] if key["level"] == "thread"]
+    assert hottest["key"] == path
+    assert hottest["acquisitions"] == 2
+    assert hottest["wait_times"]["max"] > 0
+
+
+def test_failures(tmp_path: Path, metrics: Metrics):
+    path = str(tmp_path / "lock")
+    Path(path).touch()
+    with path_lock(path):
+        with pytest.raises(RecursiveDeadlockError):
+            with path_lock(path):
+                pass
+
+        def lock():
+            with pytest.raises(AcquiringLockWouldBlockError):
+                with path_lock(path, timeout=0.01):
+                    pass
+
+        thread = Thread(target=lock)
+        thread.start()
+        thread.join()
+    counters = metrics.report()["counters"]["thread"]
+    assert counters["recursive_deadlock"] == 1
+    assert counters["timed_out"] == 1
+
+
+def test_upgrades_and_downgrades(tmp_path: Path, metrics: Metrics):
+    path = str(tmp_path / "lock")
+    Path(path).touch()
+    with process_level_path_lock(path, shared=True, reentrant=True):
+        with process_level_path_lock(path, reentrant=True):
+            pass
+    counters = metrics.report()["counters"]["process"]
+    assert counters["upgrades"] == 1
+    assert counters["downgrades"] == 1
+
+
+def test_pools(tmp_path: Path, metrics: Metrics):
+    path = str(tmp_path / "lock")
+    Path(path).touch()
+    set_idle_fd_cache()
+    try:
+        for _ in range(3):
+            with process_level_path_lock(path):
+                pass
+    finally:
+        set_idle_fd_cache(0)
+    counters = metrics.report()["counters"]["fd"]
+    assert counters == {"creates": 1, "reuses": 2, "destroys": 1}
+
+
+def test_async(tmp_path: Path, metrics: Metrics):
+    path = str(tmp_path / "lock")
+    Path(path).touch()
+
+    async def main():
+        async with apath_lock(path, shared=True):
+            pass
+
+    asyncio.run(main())
+    report = metrics.report()
+    assert report["counters"]["thread"]["uncontended"] == 1
+    assert report["hold_times"]["process"]["count"] == 1
+
+
+def test_space_saving():
+    top: SpaceSaving[int] = SpaceSaving(10)
+    for i in range(100_000):
+        # NOTE: Key 0 is counted a fifth of the time.
+        top.add(0 if i % 5 == 0 else i)
+    key, count, error = top.top(1)[0]
+    assert key == 0
+    assert count - error <= 20_000 <= count
@@ -0,0 +1,273 @@
+from collections import Counter
+from threading import Lock
+from time import perf_counter
+from typing import Any, Generic, Hashable, Optional, TypeVar
+
+from .errors import (
+    AcquiringLockTimedOutError,
+    AcquiringLockWouldBlockError,
+    RecursiveDeadlockError,
+)
+from .hooks import Level, LockHooks
+
+K = TypeVar("K", bound=Hashable)
+
+
+class Histogram:
+    """Counts durations in buckets of powers of two nanoseconds, so that it
+    stays small whatever the range of durations.
+
+    Examples
+    --------
+    >>> histogram = Histogram()
+    >>> for seconds in (0.000001, 0.000001, 0.001):
+    ...     histogram.add(seconds)
+    >>> histogram.count
+    3
+    >>> histogram.quantile(0.5)
+    1.024e-06
+
+    """
+
+    __slots__ = ("buckets", "count", "total", "max")
+
+    def __init__(self):
+        # NOTE: Bucket i counts durations from 2**(i - 1) to 2**i nanoseconds.
+        self.buckets = [0] * 64
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.buckets[min(int(seconds * 1e9).bit_length(), 63)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """An upper bound of the q-quantile, in seconds"""
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min(2**i / 1e9, self.max)
+        return self.max
+
+    def report(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "total": self.total,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+            "buckets": {2**i: count for i, count in enumerate(self.buckets) if count},
+        }
+
+
+class SpaceSaving(Generic[K]):
+    """Approximate top-k heavy hitters of a stream of keys, in constant space
+    (Metwally, Agrawal, and El Abbadi, 2005).
+
+    At most k keys are counted. A key that is not counted takes over the
+    counter of the least counted key, whose count it inherits as an upper
+    bound of its overestimation. Any key counted more than n / k times out of
+    n is guaranteed to be counted.
+
+    Examples
+    --------
+    >>> top = SpaceSaving(2)
+    >>> for key in "aababc":
+    ...     _ = top.add(key)
+    >>> top.top()
+    [('a', 3, 0), ('c', 3, 2)]
+
+    """
+
+    def __init__(self, k: int):
+        if k < 1:
+            raise ValueError("At least one key must be counted.")
+        self._k = k
+        # NOTE: Count and overestimation of each counted key.
+        self._counters: dict[K, list[int]] = {}
+
+    def add(self, key: K, weight: int = 1) -> Optional[K]:
+        """Counts key. Returns the key it evicted, if any."""
+        counter = self._counters.get(key)
+        if counter is not None:
+            counter[0] += weight
+            return None
+        if len(self._counters) < self._k:
+            self._counters[key] = [weight, 0]
+            return None
+        # NOTE: Finding the least counted key scans all counters, which only
+        # happens for keys that are not counted, and k is small.
+        evicted = min(self._counters, key=lambda key: self._counters[key][0])
+        count = self._counters.pop(evicted)[0]
+        self._counters[key] = [count + weight, count]
+        return evicted
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._counters
+
+    def top(self, n: Optional[int] = None) -> list[tuple[K, int, int]]:
+        """The n most counted keys, with their count and overestimation"""
+        top = sorted(
+            ((key, count, error) for key, (count, error) in self._counters.items()),
+            key=lambda item: -item[1],
+        )
+        return top if n is None else top[:n]
+
+
+def _failure(error: BaseException) -> str:
+    if isinstance(error, AcquiringLockTimedOutError):
+        return "timed_out"
+    if isinstance(error, AcquiringLockWouldBlockError):
+        return "would_block"
+    if isinstance(error, RecursiveDeadlockError):
+        return "recursive_deadlock"
+    return "failed"
+
+
+class Metrics(LockHooks):
+    """Hooks collecting contention metrics, see :func:`dreadlocks.set_lock_hooks`.
+
+    Counts contended and uncontended acquisitions, failures, process-level
+    upgrades and downgrades, and pool events. Wait and hold times are kept in
+    histograms for each level, and for each of the hottest keys, that is,
+    keys acquired most often, which are tracked with a
+    :class:`SpaceSaving` sketch so that memory stays bounded whatever the
+    number of keys.
+
+    Examples
+    --------
+    >>> from tempfile import NamedTemporaryFile
+    >>> from dreadlocks import path_lock, set_lock_hooks
+    >>> metrics = Metrics()
+    >>> set_lock_hooks(metrics)
+    >>> with NamedTemporaryFile() as file, path_lock(file.name):
+    ...     pass
+    >>> set_lock_hooks(None)
+    >>> metrics.report()['counters']['thread']['uncontended']
+    1
+
+    Parameters
+    ----------
+    top
+        How many of the hottest keys to keep track of.
+    """
+
+    def __init__(self, top: int = 64):
+        self._lock = Lock()
+        self._top = top
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters: Counter[tuple[str, str]] = Counter()
+            self._wait_times = {"thread": Histogram(), "process": Histogram()}
+            self._hold_times = {"thread": Histogram(), "process": Histogram()}
+            self._hottest: SpaceSaving[tuple[Level, Hashable]] = SpaceSaving(self._top)
+            # NOTE: Wait and hold times of the hottest keys only, since they
+            # were last counted.
+            self._keys: dict[tuple[Level, Hashable], tuple[Histogram, Histogram]] = {}
+            # NOTE: When each owner acquired each key, more recent last.
+            self._since: dict[tuple[Level, Hashable, Hashable, bool], list[float]] = {}
+
+    def on_acquire(
+        self,
+        level: Level,
+        key: Hashable,
+        owner: Hashable,
+        shared: bool,
+        contended: bool,
+        waited: float,
+    ):
+        now = perf_counter()
+        with self._lock:
+            self._counters[level, "contended" if contended else "uncontended"] += 1
+            self._wait_times[level].add(waited)
+            evicted = self._hottest.add((level, key))
+            if evicted is not None:
+                del self._keys[evicted]
+            stats = self._keys.get((level, key))
+            if stats is None:
+                stats = self._keys[level, key] = (Histogram(), Histogram())
+            stats[0].add(waited)
+            self._since.setdefault((level, key, owner, shared), []).append(now)
+
+    def on_fail(
+        self,
+        level: Level,
+        key: Hashable,
+        owner: Hashable,
+        shared: bool,
+        error: BaseException,
+    ):
+        with self._lock:
+            self._counters[level, _failure(error)] += 1
+
+    def on_release(self, level: Level, key: Hashable, owner: Hashable, shared: bool):
+        now = perf_counter()
+        with self._lock:
+            since = self._since.get((level, key, owner, shared))
+            if not since:
+                # NOTE: Acquired before metrics were enabled.
+                return
+            held = now - since.pop()
+            if not since:
+                del self._since[level, key, owner, shared]
+            self._hold_times[level].add(held)
+            stats = self._keys.get((level, key))
+            if stats is not None:
+                stats[1].add(held)
+
+    def on_upgrade(self, key: Hashable):
+        with self._lock:
+            self._counters["process", "upgrades"] += 1
+
+    def on_downgrade(self, key: Hashable):
+        with self._lock:
+            self._counters["process", "downgrades"] += 1
+
+    def on_create(self, pool: str, key: Hashable):
+        with self._lock:
+            self._counters[pool, "creates"] += 1
+
+    def on_reuse(self, pool: str, key: Hashable):
+        with self._lock:
+            self._counters[pool, "reuses"] += 1
+
+    def on_destroy(self, pool: str, key: Hashable):
+        with self._lock:
+            self._counters[pool, "destroys"] += 1
+
+    def report(self) -> dict[str, Any]:
+        """Metrics collected so far, which can be serialized as JSON. Times are
+        in seconds."""
+        with self._lock:
+            counters: dict[str, dict[str, int]] = {}
+            for (scope, name), count in self._counters.items():
+                counters.setdefault(scope, {})[name] = count
+            return {
+                "counters": counters,
+                "wait_times": {
+                    level: histogram.report()
+                    for level, histogram in self._wait_times.items()
+                },
+                "hold_times": {
+                    level: histogram.report()
+                    for level, histogram in self._hold_times.items()
+                },
+                "hottest": [
+                    {
+                        "level": level,
+                        "key": str(key),
+                        "acquisitions": count,
+                        "overestimation": error,
+                        "wait_times": self._keys[level, key][0].report(),
+                        "hold_times": self._keys[level, key][1].report(),
+                    }
+                    for (level, key), count, error in self._hottest.top()
+                ],
+            }
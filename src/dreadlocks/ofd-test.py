@@ -0,0 +1,170 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from threading import Barrier, Thread, active_count
+
+import pytest
+
+from dreadlocks import (
+    AcquiringLockWouldBlockError,
+    AcquiringProcessLevelLockTimedOutError,
+    apath_lock,
+    path_lock,
+    set_process_level_lock_backend,
+)
+from dreadlocks.backend import process_level_lock_backend
+from dreadlocks.platform import has_ofd_locks
+
+pytestmark = pytest.mark.skipif(
+    not has_ofd_locks(), reason="Open file description locks are not supported."
+)
+
+mp = get_context(method="spawn")
+
+
+def can_lock(path: str, shared: bool) -> bool:
+    try:
+        with path_lock(path, shared=shared, blocking=False):
+            return True
+    except AcquiringLockWouldBlockError:
+        return False
+
+
+def test_ofd_is_the_default():
+    assert process_level_lock_backend() == "ofd"
+
+
+def test_threads_release_independently(tmp_path: Path):
+    path = str(tmp_path / "lock")
+    Path(path).touch()
+    are_locked = Barrier(3)
+    first_done = Barrier(2)
+    second_done = Barrier(2)
+
+    def hold(done: Barrier):
+        with path_lock(path, shared=True):
+            are_locked.wait()
+            done.wait()
+
+    threads = [Thread(target=hold, args=(done,)) for done in (first_done, second_done)]
+    for thread in threads:
+        thread.start()
+
+    with ProcessPoolExecutor(max_workers=1, mp_context=mp) as executor:
+        are_locked.wait()
+        assert executor.submit(can_lock, path, True).result()
+        first_done.wait()
+        threads[0].join()
+        # NOTE: The second thread still holds its own shared lock.
+        assert not executor.submit(can_lock, path, False).result()
+        second_done.wait()
+        threads[1].join()
+        assert executor.submit(can_lock, path, False).result()
+
+
+def hold_shared(path: str, is_locked: "Barrier", is_done: "Barrier"):
+    with path_lock(path, shared=True):
+        is_locked.wait()
+        is_done.wait()
+
+
+def test_upgrade_timeout_keeps_shared_lock(tmp_path: Path):
+    path = str(tmp_path / "lock")
+    Path(path).touch()
+
+    with ProcessPoolExecutor(max_workers=2, mp_context=mp) as executor:
+        with mp.Manager() as m:
+            is_locked = m.Barrier(2)
+            is_done = m.Barrier(2)
+            with path_lock(path, shared=True, reentrant=True):
+                other = executor.submit(hold_shared, path, is_locked, is_done)
+                is_locked.wait()
+                with pytest.raises(AcquiringProcessLevelLockTimedOutError):
+                    with path_lock(path, reentrant=True, timeout=0.1):
+                        pass
+                assert executor.submit(can_lock, path, True).result()
+                assert not executor.submit(can_lock, path, False).result()
+                is_done.wait()
+                other.result()
+                with path_lock(path, reentrant=True, timeout=5):
+                    pass
+            assert executor.submit(can_lock, path, False).result()
+
+
+def test_waiting_tasks_share_a_thread(tmp_path: Path):
+    path = str(tmp_path / "lock")
+    Path(path).touch()
+
+    async def main(is_locked: "Barrier", is_done: "Barrier") -> int:
+        held = 0
+
+        async def hold():
+            nonlocal held
+            async with apath_lock(path, shared=True):
+                held += 1
+
+        tasks = [asyncio.create_task(hold()) for _ in range(50)]
+        await asyncio.sleep(0.2)
+        threads = active_count()
+        is_done.wait()
+        await asyncio.gather(*tasks)
+        assert held == 50
+        return threads
+
+    with ProcessPoolExecutor(max_workers=1, mp_context=mp) as executor:
+        with mp.Manager() as m:
+            is_locked = m.Barrier(2)
+            is_done = m.Barrier(2)
+            other = executor.submit(hold_exclusive, path, is_locked, is_done)
+            is_locked.wait()
+            before = active_count()
+            assert asyncio.run(main(is_locked, is_done)) <= before + 1
+            other.result()
+
+
+def test_timed_waits_cost_no_thread_or_fd(tmp_path: Path):
+    path = str(tmp_path / "lock")
+    Path(path).touch()
+
+    async def main() -> int:
+        async def try_hold():
+            with pytest.raises(AcquiringProcessLevelLockTimedOutError):
+                async with apath_lock(path, shared=True, timeout=0.2):
+                    pass
+
+        tasks = [asyncio.create_task(try_hold()) for _ in range(50)]
+        await asyncio.sleep(0.1)
+        threads = active_count()
+        await asyncio.gather(*tasks)
+        return threads
+
+    with ProcessPoolExecutor(max_workers=1, mp_context=mp) as executor:
+        with mp.Manager() as m:
+            is_locked = m.Barrier(2)
+            is_done = m.Barrier(2)
+            other = executor.submit(hold_exclusive, path, is_locked, is_done)
+            is_locked.wait()
+            before = active_count()
+            fds = len(os.listdir("/proc/self/fd"))
+            for _ in range(20):
+                with pytest.raises(AcquiringProcessLevelLockTimedOutError):
+                    with path_lock(path, timeout=0.005):
+                        pass
+            assert active_count() == before
+            assert asyncio.run(main()) <= before + 1
+            assert len(os.listdir("/proc/self/fd")) <= fds + 1
+            is_done.wait()
+            other.result()
+
+
+def hold_exclusive(path: str, is_locked: "Barrier", is_done: "Barrier"):
+    with path_lock(path):
+        is_locked.wait()
+        is_done.wait()
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        set_process_level_lock_backend("flock")  # type: ignore
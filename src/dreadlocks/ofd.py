@@ -0,0 +1,389 @@
+from asyncio import (
+    CancelledError,
+    TimeoutError as AsyncTimeoutError,
+    shield,
+    sleep as async_sleep,
+    wait_for,
+    wrap_future,
+)
+from concurrent.futures import Future
+from functools import partial
+from os import close, dup
+from threading import Lock
+from time import sleep
+from typing import Hashable, Optional
+
+from . import hooks
+from .deadline import remaining
+from .errors import (
+    RecursiveDeadlockError,
+    AcquiringProcessLevelLockTimedOutError,
+    AcquiringProcessLevelLockWouldBlockError,
+)
+from .platform import ofd_lock, ofd_unlock, try_ofd_lock
+from .hooks import OnWait
+from .pool import ThreadSafeKeyedRefPool
+from .waiter import Waiter
+from .region import END, NONE, SHARED, Regions, Segments, span
+
+_poll_min = 0.001
+_poll_max = 0.05
+
+# NOTE: Kernel requests of all tasks waiting on the same lock file, run one at
+# a time by a single thread.
+_waiter_ref: ThreadSafeKeyedRefPool[Hashable, Waiter] = ThreadSafeKeyedRefPool(
+    lambda key: Waiter(f"dreadlocks-ofd-{key}"), shards=64
+)
+
+
+class _Request:
+    """A blocking kernel request of an owner, run by the waiter of its key.
+
+    The request uses its own fd, duplicated once it runs, so that the owner
+    can close its fd when it gives up without the number being reused by
+    another file before the request is issued. The open file description, and
+    any lock the request obtains after it was abandoned, is released once both
+    are closed. Owners must abandon their request before closing their fd.
+    """
+
+    def __init__(self, fd: int, shared: bool, start: int, length: int):
+        self._fd = fd
+        self._shared = shared
+        self._start = start
+        self._length = length
+        self._lock = Lock()
+        self._abandoned = False
+
+    def __call__(self) -> None:
+        with self._lock:
+            if self._abandoned:
+                return
+            fd = dup(self._fd)
+        try:
+            ofd_lock(fd, self._shared, True, self._start, self._length)
+        finally:
+            close(fd)
+
+    def abandon(self) -> None:
+        with self._lock:
+            self._abandoned = True
+
+
+async def _await_waiter(
+    key: Hashable,
+    fd: int,
+    shared: bool,
+    deadline: Optional[float],
+    start: int,
+    length: int,
+):
+    """Waits for the kernel in a thread shared by all tasks waiting on key,
+    so that tasks need neither a thread nor an extra fd each.
+
+    Requests run one at a time, as with :class:`dreadlocks.waiter.Waiter`.
+    Tasks only get here under the thread-level lock of key, so that they wait
+    for other processes rather than for each other. A request abandoned while
+    it runs holds up the next ones until the kernel resolves it, which happens
+    once the range they all wait for is free.
+    """
+    request = _Request(fd, shared, start, length)
+    with _waiter_ref(key) as waiter:
+        pending: "Future[None]" = waiter.submit(request)
+        try:
+            await wait_for(shield(wrap_future(pending)), remaining(deadline))
+        except (AsyncTimeoutError, CancelledError) as error:
+            pending.cancel()
+            # NOTE: Nothing else to undo as long as the caller closes the
+            # lock.
+            request.abandon()
+            if isinstance(error, AsyncTimeoutError):
+                raise AcquiringProcessLevelLockTimedOutError() from None
+            raise
+
+
+class OwnedProcessLock:
+    """A process-level lock held by a single thread or asyncio task, through
+    its own open file description.
+
+    The kernel arbitrates between open file descriptions, whether they belong
+    to the same process or not, so that no process-level bookkeeping is
+    needed. Only the owner calls methods of its lock. Once the lock is not
+    held anymore, the caller releases the kernel lock by either closing the FD
+    or unlocking it. If acquisition fails while the lock is not held, the FD
+    must be closed, which also undoes abandoned kernel requests.
+
+    The owner can lock byte regions from start to end. Kernel locks of an open
+    file description merge and split, so we keep track of how many times the
+    owner holds each byte, see :class:`dreadlocks.region.Segments`.
+    """
+
+    def __init__(self, fd: int, key: Hashable = None, owner: Hashable = None):
+        self.fd = fd
+        # NOTE: What hooks are told the lock is about, and who owns it.
+        self.key = fd if key is None else key
+        self.owner = owner
+        # NOTE: Whether a handle keeps the FD open while the lock is not held,
+        # see :class:`dreadlocks.PathLock`.
+        self.kept = False
+        self._holds = Regions()
+        self._segments = Segments()
+
+    @property
+    def held(self) -> bool:
+        return bool(self._holds)
+
+    def acquire(
+        self,
+        shared: bool = False,
+        blocking: bool = True,
+        reentrant: bool = False,
+        deadline: Optional[float] = None,
+        start: int = 0,
+        end: int = END,
+    ) -> None:
+        observer = hooks.current
+        if observer is None:
+            self._acquire(shared, blocking, reentrant, deadline, start, end)
+            return
+        hooks.observe(
+            observer,
+            "process",
+            self.key,
+            self.owner,
+            shared,
+            partial(self._acquire, shared, blocking, reentrant, deadline, start, end),
+        )
+
+    async def aacquire(
+        self,
+        shared: bool = False,
+        blocking: bool = True,
+        reentrant: bool = False,
+        deadline: Optional[float] = None,
+        start: int = 0,
+        end: int = END,
+    ) -> None:
+        observer = hooks.current
+        if observer is None:
+            await self._aacquire(shared, blocking, reentrant, deadline, start, end)
+            return
+        await hooks.aobserve(
+            observer,
+            "process",
+            self.key,
+            self.owner,
+            shared,
+            partial(self._aacquire, shared, blocking, reentrant, deadline, start, end),
+        )
+
+    def try_acquire(self, shared: bool = False, start: int = 0, end: int = END) -> bool:
+        """Acquires the lock if that needs no waiting, without raising
+        otherwise. Owners that already hold part of the region do not acquire
+        it again."""
+        if any(self._holds.overlapping(start, end)):
+            return False
+        pieces = self._missing(shared, True, start, end)
+        locked: list[tuple[int, int, int]] = []
+        for piece in pieces:
+            if not try_ofd_lock(self.fd, shared, *span(piece[0], piece[1])):
+                self._restore(locked)
+                return False
+            locked.append(piece)
+        self._add(shared, start, end, locked)
+        observer = hooks.current
+        if observer is not None:
+            observer.on_acquire("process", self.key, self.owner, shared, False, 0.0)
+        return True
+
+    def release(self, shared: bool = False, start: int = 0, end: int = END) -> None:
+        self._holds.remove(self._holds.find(start, end, None, shared))
+        changed: list[tuple[int, int, int]] = []
+        if self.held:
+            # NOTE: We unlock ranges not held anymore, and downgrade ranges
+            # from exclusive to shared if no exclusive lock is left on them.
+            # This never blocks.
+            changed = self._segments.remove(start, end, shared)
+            self._restore(changed)
+        else:
+            # NOTE: Fast path, the caller releases the kernel lock.
+            self._segments.clear()
+
+        observer = hooks.current
+        if observer is not None:
+            observer.on_release("process", self.key, self.owner, shared)
+            if any(mode == SHARED for *_, mode in changed):
+                observer.on_downgrade(self.key)
+
+    def upgrade(
+        self,
+        blocking: bool = True,
+        deadline: Optional[float] = None,
+        start: int = 0,
+        end: int = END,
+    ) -> None:
+        """Turns a shared hold into an exclusive one. If that fails, the shared
+        hold is kept. See :meth:`dreadlocks.process.ShareableProcessLock.upgrade`.
+        """
+        self.acquire(False, blocking, True, deadline, start, end)
+        self.release(True, start, end)
+
+    def downgrade(self, start: int = 0, end: int = END) -> None:
+        """Turns an exclusive hold into a shared one, which never waits"""
+        self.acquire(True, False, True, None, start, end)
+        self.release(False, start, end)
+
+    def _acquire(
+        self,
+        shared: bool,
+        blocking: bool,
+        reentrant: bool,
+        deadline: Optional[float],
+        start: int,
+        end: int,
+        on_wait: OnWait = None,
+    ):
+        pieces = self._missing(shared, reentrant, start, end)
+        locked: list[tuple[int, int, int]] = []
+        try:
+            for piece in pieces:
+                self._lock(shared, blocking, deadline, piece, on_wait)
+                locked.append(piece)
+        except BaseException:
+            self._restore(locked)
+            raise
+        self._add(shared, start, end, locked)
+
+    async def _aacquire(
+        self,
+        shared: bool,
+        blocking: bool,
+        reentrant: bool,
+        deadline: Optional[float],
+        start: int,
+        end: int,
+        on_wait: OnWait = None,
+    ):
+        pieces = self._missing(shared, reentrant, start, end)
+        locked: list[tuple[int, int, int]] = []
+        try:
+            for piece in pieces:
+                await self._alock(shared, blocking, deadline, piece, on_wait)
+                locked.append(piece)
+        except BaseException:
+            self._restore(locked)
+            raise
+        self._add(shared, start, end, locked)
+
+    def _missing(
+        self, shared: bool, reentrant: bool, start: int, end: int
+    ) -> list[tuple[int, int, int]]:
+        if not self._holds:
+            # NOTE: Fast path, nothing is held.
+            return [(start, end, NONE)]
+        if not reentrant and any(self._holds.overlapping(start, end)):
+            raise RecursiveDeadlockError()
+        # NOTE: We only lock ranges not held yet, or ranges to upgrade from
+        # shared to exclusive.
+        return self._segments.missing(start, end, shared)
+
+    def _add(
+        self, shared: bool, start: int, end: int, locked: list[tuple[int, int, int]]
+    ):
+        self._holds.add(start, end, None, shared)
+        self._segments.add(start, end, shared)
+        observer = hooks.current
+        if observer is not None and any(mode == SHARED for *_, mode in locked):
+            observer.on_upgrade(self.key)
+
+    def _restore(self, pieces: list[tuple[int, int, int]]):
+        """Brings ranges back to the given modes, which never blocks"""
+        for piece_start, piece_end, mode in reversed(pieces):
+            start, length = span(piece_start, piece_end)
+            if mode:
+                ofd_lock(self.fd, True, True, start, length)
+            else:
+                ofd_unlock(self.fd, start, length)
+
+    def _lock(
+        self,
+        shared: bool,
+        blocking: bool,
+        deadline: Optional[float],
+        piece: tuple[int, int, int],
+        on_wait: OnWait = None,
+    ):
+        start, length = span(piece[0], piece[1])
+        if not blocking or (deadline is None and on_wait is None):
+            ofd_lock(self.fd, shared, blocking, start, length)
+            return
+
+        if try_ofd_lock(self.fd, shared, start, length):
+            return
+
+        if on_wait is not None:
+            on_wait()
+        if deadline is None:
+            ofd_lock(self.fd, shared, True, start, length)
+            return
+        self._poll(shared, deadline, start, length)
+
+    async def _alock(
+        self,
+        shared: bool,
+        blocking: bool,
+        deadline: Optional[float],
+        piece: tuple[int, int, int],
+        on_wait: OnWait = None,
+    ):
+        start, length = span(piece[0], piece[1])
+        try:
+            ofd_lock(self.fd, shared, False, start, length)
+            return
+        except AcquiringProcessLevelLockWouldBlockError:
+            if not blocking:
+                raise
+
+        if on_wait is not None:
+            on_wait()
+        if self.held:
+            await self._apoll(shared, deadline, start, length)
+            return
+
+        await _await_waiter(self.key, self.fd, shared, deadline, start, length)
+
+    def _poll(self, shared: bool, deadline: Optional[float], start: int, length: int):
+        """Locks a range, trying until the deadline.
+
+        This is a fallback for threads waiting with a deadline, and for tasks
+        waiting while other ranges are held: threads waiting without a
+        deadline wait in the kernel, and so do tasks holding nothing else,
+        see :func:`_await_waiter`. A pending kernel request could not be
+        abandoned on timeout without either a thread and fd per request, or
+        closing the FD, which would release the ranges held. We thus try
+        again without blocking, backing off from 1 ms to 50 ms between
+        attempts. The range may be granted up to 50 ms after it is free, and
+        to others first.
+        """
+        delay = _poll_min
+        while True:
+            timeout = remaining(deadline)
+            if timeout is not None and not timeout:
+                raise AcquiringProcessLevelLockTimedOutError()
+            sleep(delay if timeout is None else min(delay, timeout))
+            if try_ofd_lock(self.fd, shared, start, length):
+                return
+            delay = min(delay * 2, _poll_max)
+
+    async def _apoll(
+        self, shared: bool, deadline: Optional[float], start: int, length: int
+    ):
+        """See :meth:`_poll`"""
+        delay = _poll_min
+        while True:
+            timeout = remaining(deadline)
+            if timeout is not None and not timeout:
+                raise AcquiringProcessLevelLockTimedOutError()
+            await async_sleep(delay if timeout is None else min(delay, timeout))
+            if try_ofd_lock(self.fd, shared, start, length):
+                return
+            delay = min(delay * 2, _poll_max)
@@ -0,0 +1,183 @@
+from asyncio import current_task
+from contextlib import asynccontextmanager, contextmanager
+from threading import get_ident
+from typing import Hashable, Optional
+
+from os import close
+
+from .errors import (
+    AcquiringProcessLevelLockTimedOutError,
+    AcquiringProcessLevelLockWouldBlockError,
+)
+from .globals import ofd_ref, owned_process_level_locks
+from .ofd import OwnedProcessLock
+from .platform import ofd_unlock
+from .region import END
+
+
+def _get(
+    normalized_path: str,
+    owner: Hashable,
+    kept: Optional[dict[Hashable, OwnedProcessLock]] = None,
+) -> OwnedProcessLock:
+    """Returns the lock of owner on a path, taking the one kept for owner, if
+    kept is given, rather than a new one while owner holds nothing"""
+    key = (normalized_path, owner)
+    lock = owned_process_level_locks.get(key)
+    if lock is None:
+        lock = None if kept is None else kept.get(owner)
+        if lock is None:
+            fd = ofd_ref.checkout(normalized_path)
+            lock = OwnedProcessLock(fd, normalized_path, owner)
+            if kept is not None:
+                lock.kept = True
+                kept[owner] = lock
+        owned_process_level_locks[key] = lock
+    return lock
+
+
+def _give_back(normalized_path: str, lock: OwnedProcessLock, reusable: bool = True):
+    if reusable and ofd_ref.idle:
+        ofd_unlock(lock.fd)
+        ofd_ref.checkin(normalized_path, lock.fd)
+    else:
+        # NOTE: Closing the FD releases the kernel lock.
+        close(lock.fd)
+
+
+def _put(
+    normalized_path: str,
+    owner: Hashable,
+    lock: OwnedProcessLock,
+    error: Optional[BaseException] = None,
+):
+    """Gives the FD back once the lock is not held anymore, unless a handle
+    keeps it"""
+    if lock.held:
+        return
+    del owned_process_level_locks[normalized_path, owner]
+    # NOTE: Timeouts and cancellations may leave a kernel request pending,
+    # which only closing the FD undoes.
+    reusable = error is None or (
+        isinstance(error, AcquiringProcessLevelLockWouldBlockError)
+        and not isinstance(error, AcquiringProcessLevelLockTimedOutError)
+    )
+    if reusable and lock.kept:
+        ofd_unlock(lock.fd)
+        return
+    lock.kept = False
+    _give_back(normalized_path, lock, reusable)
+
+
+def give_back_kept_owned_process_level_locks(
+    normalized_path: str, kept: dict[Hashable, OwnedProcessLock]
+):
+    """Gives back the FDs of locks kept by a handle. A lock still held by its
+    owner outside of the handle is given back once released."""
+    for lock in kept.values():
+        lock.kept = False
+        if not lock.held:
+            _give_back(normalized_path, lock)
+    kept.clear()
+
+
+def try_owned_process_level_lock(
+    normalized_path: str, shared: bool = False, owner: Hashable = None
+) -> Optional[OwnedProcessLock]:
+    """Locks a path at the process-level through an open file description of
+    owner if that needs no waiting, and returns the lock, to be released with
+    :func:`release_owned_process_level_lock`, or None otherwise"""
+    if owner is None:
+        owner = get_ident()
+    lock = _get(normalized_path, owner)
+    if lock.try_acquire(shared):
+        return lock
+    _put(normalized_path, owner, lock)
+    return None
+
+
+def acquire_owned_process_level_lock(
+    normalized_path: str,
+    shared: bool = False,
+    blocking: bool = True,
+    reentrant: bool = False,
+    deadline: Optional[float] = None,
+    start: int = 0,
+    end: int = END,
+    owner: Hashable = None,
+) -> OwnedProcessLock:
+    """Locks a path at the process-level through an open file description of
+    owner, the current thread by default, and returns the lock, to be released
+    with :func:`release_owned_process_level_lock`"""
+    if owner is None:
+        owner = get_ident()
+    lock = _get(normalized_path, owner)
+    try:
+        lock.acquire(shared, blocking, reentrant, deadline, start, end)
+    except BaseException as error:
+        _put(normalized_path, owner, lock, error)
+        raise
+    return lock
+
+
+def release_owned_process_level_lock(
+    normalized_path: str,
+    lock: OwnedProcessLock,
+    shared: bool = False,
+    start: int = 0,
+    end: int = END,
+) -> None:
+    lock.release(shared, start, end)
+    _put(normalized_path, lock.owner, lock)
+
+
+@contextmanager
+def owned_process_level_lock(
+    normalized_path: str,
+    shared: bool = False,
+    blocking: bool = True,
+    reentrant: bool = False,
+    deadline: Optional[float] = None,
+    start: int = 0,
+    end: int = END,
+):
+    """Locks a path at the process-level through an open file description of
+    the current thread.
+
+    Unlike :func:`dreadlocks.process_level_path_lock`, threads of the same
+    process exclude each other, hence this is only used under a thread-level
+    lock, where it never makes them wait on each other.
+    """
+    lock = acquire_owned_process_level_lock(
+        normalized_path, shared, blocking, reentrant, deadline, start, end
+    )
+    try:
+        yield lock.fd
+    finally:
+        release_owned_process_level_lock(normalized_path, lock, shared, start, end)
+
+
+@asynccontextmanager
+async def aowned_process_level_lock(
+    normalized_path: str,
+    shared: bool = False,
+    blocking: bool = True,
+    reentrant: bool = False,
+    deadline: Optional[float] = None,
+    start: int = 0,
+    end: int = END,
+):
+    """Asynchronous counterpart of :func:`owned_process_level_lock` on behalf
+    of the current asyncio task"""
+    owner = current_task()
+    lock = _get(normalized_path, owner)
+    try:
+        await lock.aacquire(shared, blocking, reentrant, deadline, start, end)
+    except BaseException as error:
+        _put(normalized_path, owner, lock, error)
+        raise
+    try:
+        yield lock.fd
+    finally:
+        lock.release(shared, start, end)
+        _put(normalized_path, owner, lock)
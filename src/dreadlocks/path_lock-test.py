@@ -1,3 +1,4 @@
+import asyncio
 import json
 import os
 import time
@@ -31,12 +32,19 @@ from typing import (
 import pytest
 
 from dreadlocks import (
+    AcquiringLockTimedOutError,
     AcquiringLockWouldBlockError,
+    AcquiringProcessLevelLockTimedOutError,
     AcquiringProcessLevelLockWouldBlockError,
+    AcquiringThreadLevelLockTimedOutError,
     AcquiringThreadLevelLockWouldBlockError,
     RecursiveDeadlockError,
+    apath_lock,
+    deadline,
     path_lock,
+    path_lock_many,
     process_level_path_lock,
+    set_idle_fd_cache,
     thread_level_path_lock,
 )
 
@@ -207,6 +215,81 @@ def test_non_blocking(
                 task.result()
 
 
+def lock_timeout(is_locked: Barrier, path: str, shared: bool, timeout: float):
+    is_locked.wait()
+    start = time.monotonic()
+    try:
+        with path_lock(path, shared=shared, timeout=timeout):
+            pass
+    finally:
+        assert time.monotonic() - start >= timeout
+
+
+@pytest.mark.parametrize(
+    "parallelization, exception",
+    (
+        (threads, AcquiringThreadLevelLockTimedOutError),
+        (processes, AcquiringProcessLevelLockTimedOutError),
+    ),
+)
+@pytest.mark.parametrize(
+    "shared", ([False, False], [False, True], [True, False]), ids=repr
+)
+def test_timeout(
+    tmp_path: str,
+    parallelization: Parallelization,
+    exception: Type[AcquiringLockTimedOutError],
+    shared: list[bool],
+):
+    if os.name == "nt" and "processes" in repr(parallelization):
+        pytest.skip("TODO Processes-based tests randomly fail on Windows.")
+
+    with lock(tmp_path) as path:
+        with parallelization(2) as [executor, m]:
+            is_locked = m.Barrier(2)
+            is_done = m.Barrier(2)
+
+            first = executor.submit(lock_first, is_locked, is_done, path, shared[0])
+            last = executor.submit(lock_timeout, is_locked, path, shared[1], 0.1)
+
+            with pytest.raises(exception):
+                last.result()
+
+            is_done.wait()
+            first.result()
+
+            # NOTE: Abandoned requests must not leave anything locked behind.
+            is_locked = m.Barrier(1)
+            executor.submit(lock_timeout, is_locked, path, False, 0).result()
+            with path_lock(path, timeout=5):
+                pass
+
+
+def test_deadline(tmp_path: str):
+    with lock(tmp_path) as path:
+        with threads(1) as [executor, m]:
+            is_locked = m.Barrier(2)
+            is_done = m.Barrier(2)
+            first = executor.submit(lock_first, is_locked, is_done, path, False)
+            is_locked.wait()
+
+            start = time.monotonic()
+            with deadline(0.1):
+                with pytest.raises(AcquiringThreadLevelLockTimedOutError):
+                    with deadline(60):
+                        with path_lock(path, timeout=60):
+                            pass
+            assert time.monotonic() - start < 60
+
+            is_done.wait()
+            first.result()
+
+        # NOTE: An expired deadline only forbids waiting.
+        with deadline(0):
+            with path_lock(path):
+                pass
+
+
 def locked_threads(
     fn: Callable[..., T], parameters: list[tuple[Any, ...]], is_done: Barrier
 ):
@@ -619,3 +702,193 @@ def test_synchronized_reads_blocking(tmp_path: str, parallelization: Paralleliza
                 # NOTE: check nobody else wrote to file while we held the lock
                 assert message["id"] == message["contents"]["id"]
                 assert message["contents"]["copy"] == message["contents"]["counter"]
+
+
+def test_async_tasks_are_told_apart(tmp_path: str):
+    with lock(tmp_path) as path:
+
+        async def main():
+            is_locked = asyncio.Event()
+            is_done = asyncio.Event()
+
+            async def first():
+                async with apath_lock(path):
+                    is_locked.set()
+                    await is_done.wait()
+
+            async def rest():
+                await is_locked.wait()
+                try:
+                    with pytest.raises(AcquiringThreadLevelLockWouldBlockError):
+                        async with apath_lock(path, shared=True, blocking=False):
+                            pass
+                    with pytest.raises(AcquiringThreadLevelLockTimedOutError):
+                        async with apath_lock(path, timeout=0.01):
+                            pass
+                finally:
+                    is_done.set()
+
+            await asyncio.gather(first(), rest())
+
+        asyncio.run(main())
+
+
+def test_async_many_waiters(tmp_path: str):
+    with lock(tmp_path) as path:
+        n = 2000
+        held = {"shared": 0, "exclusive": 0}
+
+        async def task(shared: bool):
+            async with apath_lock(path, shared=shared):
+                assert not held["exclusive"]
+                if not shared:
+                    assert not held["shared"]
+                key = "shared" if shared else "exclusive"
+                held[key] += 1
+                await asyncio.sleep(0)
+                held[key] -= 1
+
+        async def main():
+            await asyncio.gather(*(task(i % 4 != 0) for i in range(n)))
+
+        asyncio.run(main())
+
+
+def test_async_process_level_wait(tmp_path: str):
+    if os.name == "nt":
+        pytest.skip("TODO Processes-based tests randomly fail on Windows.")
+
+    with lock(tmp_path) as path:
+        with processes(1) as [executor, m]:
+            is_locked = m.Barrier(2)
+            is_done = m.Barrier(2)
+            first = executor.submit(lock_first, is_locked, is_done, path, False)
+            is_locked.wait()
+
+            async def main():
+                ticks = 0
+
+                async def ticker():
+                    nonlocal ticks
+                    while True:
+                        ticks += 1
+                        await asyncio.sleep(0.01)
+
+                ticking = asyncio.ensure_future(ticker())
+
+                with pytest.raises(AcquiringProcessLevelLockTimedOutError):
+                    async with apath_lock(path, shared=True, timeout=0.2):
+                        pass
+
+                cancelled = asyncio.ensure_future(_apath_lock_forever(path))
+                await asyncio.sleep(0.2)
+                cancelled.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await cancelled
+
+                # NOTE: The event loop was never blocked while waiting.
+                assert ticks >= 20
+                ticking.cancel()
+
+                waiting = asyncio.ensure_future(_apath_lock_forever(path))
+                await asyncio.get_running_loop().run_in_executor(None, is_done.wait)
+                await asyncio.wait_for(waiting, 5)
+
+            asyncio.run(main())
+            first.result()
+
+        # NOTE: Abandoned requests must not leave anything locked behind.
+        with path_lock(path, timeout=5):
+            pass
+
+
+async def _apath_lock_forever(path: str):
+    async with apath_lock(path):
+        pass
+
+
+def test_path_lock_many(tmp_path: str):
+    with lock(tmp_path) as path:
+        paths = [f"{path}-{i}" for i in range(50)]
+        for other in paths:
+            Path(other).touch()
+
+        with path_lock_many([*reversed(paths), f"./{paths[0]}"]) as fds:
+            assert len(fds) == len(paths) + 1
+            assert fds[paths[0]] == fds[f"./{paths[0]}"]
+            with pytest.raises(RecursiveDeadlockError):
+                with path_lock(paths[-1]):
+                    pass
+
+        with path_lock_many(paths, shared=True):
+            with path_lock_many(paths[::2], shared=True, reentrant=True):
+                pass
+
+
+@pytest.mark.parametrize(
+    "parallelization, exception",
+    (
+        (threads, AcquiringThreadLevelLockWouldBlockError),
+        (processes, AcquiringProcessLevelLockWouldBlockError),
+    ),
+)
+def test_path_lock_many_backs_off(
+    tmp_path: str,
+    parallelization: Parallelization,
+    exception: Type[AcquiringLockWouldBlockError],
+):
+    if os.name == "nt" and "processes" in repr(parallelization):
+        pytest.skip("TODO Processes-based tests randomly fail on Windows.")
+
+    with lock(tmp_path) as path:
+        paths = [f"{path}-{i}" for i in range(10)]
+        for other in paths:
+            Path(other).touch()
+
+        with parallelization(1) as [executor, m]:
+            is_locked = m.Barrier(2)
+            is_done = m.Barrier(2)
+            first = executor.submit(lock_first, is_locked, is_done, paths[5], False)
+            is_locked.wait()
+
+            with pytest.raises(exception):
+                with path_lock_many(paths, blocking=False):
+                    pass
+
+            with pytest.raises(exception):
+                with path_lock_many(paths, timeout=0.1):
+                    pass
+
+            # NOTE: Locks acquired before the failure have been released.
+            with path_lock_many(paths[:5] + paths[6:], blocking=False):
+                pass
+
+            is_done.wait()
+            first.result()
+
+        with path_lock_many(paths, timeout=5):
+            pass
+
+
+def lock_non_blocking(path: str):
+    with path_lock(path, blocking=False):
+        pass
+
+
+def test_idle_fd_cache(tmp_path: str):
+    with lock(tmp_path) as path:
+        set_idle_fd_cache()
+        try:
+            with path_lock(path) as fd:
+                pass
+            # NOTE: The fd is kept open but the lock is released.
+            os.fstat(fd)
+            with processes(1) as [executor, _]:
+                executor.submit(lock_non_blocking, path).result()
+            with path_lock(path) as reused:
+                assert reused == fd
+        finally:
+            set_idle_fd_cache(0)
+
+        with pytest.raises(OSError):
+            os.fstat(fd)
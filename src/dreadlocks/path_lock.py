@@ -1,15 +1,34 @@
-from contextlib import contextmanager
+from contextlib import asynccontextmanager, contextmanager
 from os.path import normpath
+from typing import Optional
 
-from .thread_level_lock import thread_level_lock
+from .backend import process_level_lock_backend
+from .broker_process_level_lock import (
+    abroker_process_level_lock,
+    broker_process_level_lock,
+)
+from .deadline import absolute_deadline
+from .region import region
+from .owned_process_level_lock import (
+    aowned_process_level_lock,
+    owned_process_level_lock,
+)
+from .thread_level_lock import athread_level_lock, thread_level_lock
 from .process_level_path_lock import (
+    _aprocess_level_path_lock,  # type: ignore [reportPrivateUsage]
     _process_level_path_lock,  # type: ignore [reportPrivateUsage]
 )
 
 
 @contextmanager
 def path_lock(
-    path: str, shared: bool = False, blocking: bool = True, reentrant: bool = False
+    path: str,
+    shared: bool = False,
+    blocking: bool = True,
+    reentrant: bool = False,
+    timeout: Optional[float] = None,
+    start: int = 0,
+    length: int = 0,
 ):
     """Locks a path both at the thread-level and process-level.
 
@@ -32,10 +51,82 @@ def path_lock(
     reentrant
         Whether lock acquisition is reentrant. If True, allows to lock
         recursively. Otherwise, locking recursively results in a dead-lock.
+    timeout
+        How long to wait, in seconds, if blocking. If the lock cannot be
+        acquired in time, an error is raised. If None, will block until the
+        lock is acquired. Blocking acquisitions within a
+        :func:`dreadlocks.deadline` scope never wait past that deadline.
+    start
+        The offset of the first byte of the region to lock. Regions that do not
+        overlap do not exclude each other.
+    length
+        The number of bytes of the region to lock. If zero, the default, the
+        region extends to the end of the file, however large, so that the
+        whole file is locked.
+
+    Yields
+    ------
+    int
+        A file descriptor of the path, which must not be closed. With the
+        :code:`"ofd"` backend, each thread or task holding the lock gets its
+        own. With the :code:`"broker"` backend, locks are granted by the lock
+        broker instead of the kernel. See
+        :func:`dreadlocks.set_process_level_lock_backend`.
+    """
+    normalized_path = normpath(path)
+    deadline = absolute_deadline(timeout)
+    start, end = region(start, length)
+    backend = process_level_lock_backend()
+    process_level_path_lock = (
+        owned_process_level_lock
+        if backend == "ofd"
+        else broker_process_level_lock
+        if backend == "broker"
+        else _process_level_path_lock
+    )
+    with thread_level_lock(
+        normalized_path, shared, blocking, reentrant, deadline, start, end
+    ):
+        with process_level_path_lock(
+            normalized_path, shared, blocking, reentrant, deadline, start, end
+        ) as fd:
+            yield fd
+
+
+@asynccontextmanager
+async def apath_lock(
+    path: str,
+    shared: bool = False,
+    blocking: bool = True,
+    reentrant: bool = False,
+    timeout: Optional[float] = None,
+    start: int = 0,
+    length: int = 0,
+):
+    """Locks a path both at the thread-level and process-level on behalf of the
+    current asyncio task.
+
+    Asynchronous context manager counterpart of :func:`dreadlocks.path_lock`,
+    with the same parameters. Locks are owned by the current task, so that two
+    tasks running on the same thread are told apart. Waiting never blocks the
+    event loop and costs no thread at the thread-level. At the process-level,
+    all tasks waiting on the same path share a single background thread.
     """
     normalized_path = normpath(path)
-    with thread_level_lock(normalized_path, shared, blocking, reentrant):
-        with _process_level_path_lock(
-            normalized_path, shared, blocking, reentrant
+    deadline = absolute_deadline(timeout)
+    start, end = region(start, length)
+    backend = process_level_lock_backend()
+    aprocess_level_path_lock = (
+        aowned_process_level_lock
+        if backend == "ofd"
+        else abroker_process_level_lock
+        if backend == "broker"
+        else _aprocess_level_path_lock
+    )
+    async with athread_level_lock(
+        normalized_path, shared, blocking, reentrant, deadline, start, end
+    ):
+        async with aprocess_level_path_lock(
+            normalized_path, shared, blocking, reentrant, deadline, start, end
         ) as fd:
             yield fd
@@ -0,0 +1,111 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import closing
+from multiprocessing import get_context
+from pathlib import Path
+
+import pytest
+
+from dreadlocks import (
+    AcquiringLockWouldBlockError,
+    PathLock,
+    RecursiveDeadlockError,
+    path_lock,
+    process_level_path_lock,
+)
+
+mp = get_context(method="spawn")
+
+
+def can_lock(path: str) -> bool:
+    try:
+        with path_lock(path, blocking=False):
+            return True
+    except AcquiringLockWouldBlockError:
+        return False
+
+
+def can_lock_process_level(path: str) -> bool:
+    try:
+        with process_level_path_lock(path, blocking=False):
+            return True
+    except AcquiringLockWouldBlockError:
+        return False
+
+
+def test_excludes_threads_and_processes(tmp_path: Path):
+    path = str(tmp_path / "lock")
+    Path(path).touch()
+    with (
+        ThreadPoolExecutor(1) as threads,
+        ProcessPoolExecutor(1, mp_context=mp) as processes,
+    ):
+        with closing(PathLock(str(tmp_path / "." / "lock"))) as handle:
+            for _ in range(2):
+                with handle:
+                    assert not threads.submit(can_lock, path).result()
+                    assert not processes.submit(can_lock, path).result()
+                assert threads.submit(can_lock, path).result()
+                assert processes.submit(can_lock, path).result()
+
+
+def test_reentrant(tmp_path: Path):
+    path = str(tmp_path / "lock")
+    Path(path).touch()
+    with closing(PathLock(path, reentrant=True)) as handle:
+        with handle:
+            with handle:
+                pass
+    with closing(PathLock(path)) as handle:
+        with handle:
+            with pytest.raises(RecursiveDeadlockError):
+                with handle:
+                    pass
+        # NOTE: The failed acquisition released nothing it did not acquire.
+        with handle:
+            pass
+
+
+def test_single_thread(tmp_path: Path):
+    path = str(tmp_path / "lock")
+    Path(path).touch()
+    with (
+        ThreadPoolExecutor(1) as threads,
+        ProcessPoolExecutor(1, mp_context=mp) as processes,
+    ):
+        with closing(PathLock(path, single_thread=True)) as handle:
+            with handle:
+                # NOTE: Threads of the process do not exclude each other.
+                assert threads.submit(can_lock_process_level, path).result()
+                assert not processes.submit(can_lock, path).result()
+
+
+def test_pins_fd_until_closed(tmp_path: Path):
+    path = str(tmp_path / "lock")
+    Path(path).touch()
+    handle = PathLock(path, single_thread=True)
+    with handle as fd:
+        pass
+    with handle as same_fd:
+        assert same_fd == fd
+    os.fstat(fd)
+    handle.close()
+    with pytest.raises(OSError):
+        os.fstat(fd)
+
+
+def test_keeps_fd_of_each_thread_until_closed(tmp_path: Path):
+    path = str(tmp_path / "lock")
+    Path(path).touch()
+    handle = PathLock(path, reentrant=True)
+    with handle as fd:
+        with path_lock(path, reentrant=True) as nested_fd:
+            assert nested_fd == fd
+    with handle as same_fd:
+        assert same_fd == fd
+    os.fstat(fd)
+    with ThreadPoolExecutor(1) as threads:
+        assert threads.submit(can_lock, path).result()
+    handle.close()
+    with pytest.raises(OSError):
+        os.fstat(fd)
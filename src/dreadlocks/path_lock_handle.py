@@ -0,0 +1,253 @@
+from contextlib import ExitStack
+from os.path import normpath
+from threading import get_ident
+from types import TracebackType
+from typing import Hashable, Optional
+from weakref import finalize
+
+from .backend import process_level_lock_backend
+from .broker import BrokerLock, file_key
+from .deadline import absolute_deadline
+from .globals import (
+    fd_ref,
+    owned_process_level_locks,
+    process_level_lock_ref,
+    thread_level_lock_ref,
+)
+from .ofd import OwnedProcessLock
+from .owned_process_level_lock import _get, _put  # type: ignore [reportPrivateUsage]
+from .owned_process_level_lock import give_back_kept_owned_process_level_locks
+from .process import ShareableProcessLock
+from .region import region
+from .thread import ShareableThreadLock
+
+
+def _close(
+    refs: ExitStack,
+    process_lock: Optional[ShareableProcessLock],
+    path: str,
+    kept: dict[Hashable, OwnedProcessLock],
+):
+    give_back_kept_owned_process_level_locks(path, kept)
+    if process_lock is None:
+        refs.close()
+    else:
+        # NOTE: Abandoned kernel requests may still refer to the lock and FD.
+        process_lock.defer(refs.close)
+
+
+class PathLock:
+    """A reusable lock on a path, both at the thread-level and process-level,
+    bound to its parameters once and for all.
+
+    Calling :func:`dreadlocks.path_lock` normalizes the path, and looks up its
+    locks and file descriptor in process-wide pools, every time. A handle does
+    so once, and keeps those pool entries alive until it is closed, so that
+    entering and exiting it only acquires and releases the locks. Handles are
+    meant for tight loops locking the same few paths over and over.
+
+    A handle can be entered by several threads at once, each acquiring the lock
+    on its own behalf, and recursively if reentrant. It excludes
+    :func:`dreadlocks.path_lock` and other handles on the same path as they
+    exclude each other.
+
+    Examples
+    --------
+    >>> from contextlib import closing
+    >>> from tempfile import NamedTemporaryFile
+    >>> with NamedTemporaryFile() as file, closing(PathLock(file.name)) as lock:
+    ...     for _ in range(3):
+    ...         with lock:
+    ...             pass
+
+    Parameters
+    ----------
+    path
+        The path to lock. See :func:`dreadlocks.path_lock`.
+    shared
+        Whether the lock is shared. See :func:`dreadlocks.path_lock`.
+    blocking
+        Whether lock acquisition is blocking. See :func:`dreadlocks.path_lock`.
+    reentrant
+        Whether lock acquisition is reentrant. See :func:`dreadlocks.path_lock`.
+    timeout
+        How long each acquisition waits, in seconds, if blocking. See
+        :func:`dreadlocks.path_lock`.
+    start
+        The offset of the first byte of the region to lock. See
+        :func:`dreadlocks.path_lock`.
+    length
+        The number of bytes of the region to lock. See
+        :func:`dreadlocks.path_lock`.
+    single_thread
+        Whether to skip the thread-level lock, for processes where a single
+        thread locks paths. Threads of the process then do not exclude each
+        other, as with :func:`dreadlocks.process_level_path_lock`, which the
+        handle behaves like. Not supported by the :code:`"broker"` backend.
+    """
+
+    __slots__ = (
+        "path",
+        "_shared",
+        "_blocking",
+        "_reentrant",
+        "_timeout",
+        "_start",
+        "_end",
+        "_thread_lock",
+        "_process_lock",
+        "_fd",
+        "_file",
+        "_kept",
+        "_finalizer",
+        "__weakref__",
+    )
+
+    def __init__(
+        self,
+        path: str,
+        shared: bool = False,
+        blocking: bool = True,
+        reentrant: bool = False,
+        timeout: Optional[float] = None,
+        start: int = 0,
+        length: int = 0,
+        single_thread: bool = False,
+    ):
+        self.path = normpath(path)
+        self._shared = shared
+        self._blocking = blocking
+        self._reentrant = reentrant
+        self._timeout = timeout
+        self._start, self._end = region(start, length)
+        self._thread_lock: Optional[ShareableThreadLock] = None
+        self._process_lock: Optional[ShareableProcessLock] = None
+        self._fd = -1
+        self._file: Optional[str] = None
+        # NOTE: With the "ofd" backend, the lock of each owner, so that its
+        # open file description stays open between acquisitions.
+        self._kept: dict[Hashable, OwnedProcessLock] = {}
+        backend = process_level_lock_backend()
+        if single_thread and backend == "broker":
+            raise NotImplementedError(
+                "The lock broker grants locks to threads and tasks, not processes."
+            )
+        with ExitStack() as refs:
+            if not single_thread:
+                self._thread_lock = refs.enter_context(thread_level_lock_ref(self.path))
+            if backend == "broker":
+                # NOTE: The FD only identifies the file for the broker.
+                self._fd = refs.enter_context(fd_ref(self.path))
+                self._file = file_key(self._fd)
+            # NOTE: With the "ofd" backend, each owner locks through its own
+            # open file description, as with path_lock, kept in _kept.
+            elif single_thread or backend != "ofd":
+                self._fd = refs.enter_context(fd_ref(self.path))
+                self._process_lock = refs.enter_context(
+                    process_level_lock_ref(self._fd)
+                )
+            self._finalizer = finalize(
+                self,
+                _close,
+                refs.pop_all(),
+                self._process_lock,
+                self.path,
+                self._kept,
+            )
+
+    def __enter__(self) -> int:
+        """Acquires the lock on behalf of the current thread.
+
+        Returns
+        -------
+        int
+            A file descriptor of the path, which must not be closed. See
+            :func:`dreadlocks.path_lock`.
+        """
+        owner = get_ident()
+        deadline = absolute_deadline(self._timeout)
+        thread_lock = self._thread_lock
+        if thread_lock is not None:
+            thread_lock.acquire(
+                self._shared,
+                self._blocking,
+                self._reentrant,
+                deadline,
+                owner,
+                self._start,
+                self._end,
+            )
+        try:
+            process_lock = self._process_lock
+            if process_lock is not None:
+                process_lock.acquire(
+                    self._shared,
+                    self._blocking,
+                    self._reentrant,
+                    deadline,
+                    owner,
+                    self._start,
+                    self._end,
+                )
+                return self._fd
+            if self._file is not None:
+                BrokerLock(self._fd, self.path, owner, self._file).acquire(
+                    self._shared,
+                    self._blocking,
+                    self._reentrant,
+                    deadline,
+                    self._start,
+                    self._end,
+                )
+                return self._fd
+            lock = _get(self.path, owner, self._kept)
+            try:
+                lock.acquire(
+                    self._shared,
+                    self._blocking,
+                    self._reentrant,
+                    deadline,
+                    self._start,
+                    self._end,
+                )
+            except BaseException as error:
+                _put(self.path, owner, lock, error)
+                if not lock.kept:
+                    self._kept.pop(owner, None)
+                raise
+            return lock.fd
+        except BaseException:
+            if thread_lock is not None:
+                thread_lock.release(self._shared, owner, self._start, self._end)
+            raise
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        """Releases the lock acquired by the current thread"""
+        owner = get_ident()
+        process_lock = self._process_lock
+        try:
+            if process_lock is not None:
+                process_lock.release(self._shared, owner, self._start, self._end)
+            elif self._file is not None:
+                BrokerLock(self._fd, self.path, owner, self._file).release(
+                    self._shared, self._start, self._end
+                )
+            else:
+                lock = owned_process_level_locks[self.path, owner]
+                lock.release(self._shared, self._start, self._end)
+                _put(self.path, owner, lock)
+        finally:
+            thread_lock = self._thread_lock
+            if thread_lock is not None:
+                thread_lock.release(self._shared, owner, self._start, self._end)
+
+    def close(self) -> None:
+        """Lets go of the pool entries of the path. The handle must not be held
+        anymore, and cannot be entered again. Handles are closed when garbage
+        collected otherwise."""
+        self._finalizer()
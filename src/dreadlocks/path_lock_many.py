@@ -0,0 +1,120 @@
+from contextlib import ExitStack, contextmanager
+from os.path import normpath
+from threading import get_ident
+from typing import Iterable, Optional
+
+from .backend import process_level_lock_backend
+from .broker import BrokerLock, acquire_many, release_many
+from .deadline import absolute_deadline
+from .globals import fd_ref, process_level_lock_ref, thread_level_lock_ref
+from .owned_process_level_lock import (
+    acquire_owned_process_level_lock,
+    release_owned_process_level_lock,
+)
+
+
+@contextmanager
+def path_lock_many(
+    paths: Iterable[str],
+    shared: bool = False,
+    blocking: bool = True,
+    reentrant: bool = False,
+    timeout: Optional[float] = None,
+):
+    """Locks several paths both at the thread-level and process-level.
+
+    Paths are normalized, deduplicated, and locked in lexicographical order of
+    their normalized form, so that concurrent calls on overlapping sets of
+    paths cannot dead-lock each other. Pool references for all paths are taken
+    at once. If any lock cannot be acquired, all locks acquired so far are
+    released before the error is raised.
+
+    Parameters
+    ----------
+    paths
+        The paths to lock. See :func:`dreadlocks.path_lock`.
+    shared
+        Whether the locks are shared. See :func:`dreadlocks.path_lock`.
+    blocking
+        Whether lock acquisition is blocking. See :func:`dreadlocks.path_lock`.
+    reentrant
+        Whether lock acquisition is reentrant. See :func:`dreadlocks.path_lock`.
+    timeout
+        How long to wait, in seconds, if blocking, for all locks in total.
+        See :func:`dreadlocks.path_lock`.
+
+    Yields
+    ------
+    dict[str, int]
+        The file descriptor of each given path.
+    """
+    paths = list(paths)
+    normalized_paths = sorted(set(map(normpath, paths)))
+    deadline = absolute_deadline(timeout)
+    owner = get_ident()
+    backend = process_level_lock_backend()
+
+    with ExitStack() as refs:
+        thread_locks = refs.enter_context(thread_level_lock_ref.many(normalized_paths))
+
+        if backend == "broker":
+            fds = refs.enter_context(fd_ref.many(normalized_paths))
+            locks = [
+                BrokerLock(fd, normalized_path, owner)
+                for normalized_path, fd in zip(normalized_paths, fds)
+            ]
+            with ExitStack() as held:
+                for thread_lock in thread_locks:
+                    thread_lock.acquire(shared, blocking, reentrant, deadline, owner)
+                    held.callback(thread_lock.release, shared, owner)
+                # NOTE: The broker grants all paths at once, in a single round
+                # trip, or none of them.
+                acquire_many(locks, shared, blocking, deadline)
+                held.callback(release_many, locks, shared)
+
+                fd_by_path = dict(zip(normalized_paths, fds))
+                yield {path: fd_by_path[normpath(path)] for path in paths}
+            return
+
+        if backend == "ofd":
+            with ExitStack() as held:
+                fds: list[int] = []
+                for normalized_path, thread_lock in zip(normalized_paths, thread_locks):
+                    thread_lock.acquire(shared, blocking, reentrant, deadline, owner)
+                    held.callback(thread_lock.release, shared, owner)
+                    # NOTE: Locks are released in reverse order if any
+                    # acquisition fails, like those of the lockf backend.
+                    process_lock = acquire_owned_process_level_lock(
+                        normalized_path, shared, blocking, reentrant, deadline
+                    )
+                    held.callback(
+                        release_owned_process_level_lock,
+                        normalized_path,
+                        process_lock,
+                        shared,
+                    )
+                    fds.append(process_lock.fd)
+
+                fd_by_path = dict(zip(normalized_paths, fds))
+                yield {path: fd_by_path[normpath(path)] for path in paths}
+            return
+
+        fds = refs.enter_context(fd_ref.many(normalized_paths))
+        process_locks = refs.enter_context(process_level_lock_ref.many(fds))
+
+        with ExitStack() as held:
+            for thread_lock, process_lock in zip(thread_locks, process_locks):
+                thread_lock.acquire(shared, blocking, reentrant, deadline, owner)
+                held.callback(thread_lock.release, shared, owner)
+                try:
+                    process_lock.acquire(shared, blocking, reentrant, deadline, owner)
+                except BaseException:
+                    # NOTE: We back off right away, but abandoned kernel
+                    # requests may still refer to the pooled fds.
+                    held.close()
+                    process_lock.defer(refs.pop_all().close)
+                    raise
+                held.callback(process_lock.release, shared, owner)
+
+            fd_by_path = dict(zip(normalized_paths, fds))
+            yield {path: fd_by_path[normpath(path)] for path in paths}
@@ -1,11 +1,41 @@
+import errno
 import os
+import struct
 import sys
+from concurrent.futures import Future
+from functools import partial
+from tempfile import TemporaryFile
+from threading import Thread
+from time import sleep
+from typing import Callable, Optional
 
-from .errors import AcquiringProcessLevelLockWouldBlockError
+from .deadline import remaining
+from .errors import (
+    AcquiringProcessLevelLockTimedOutError,
+    AcquiringProcessLevelLockWouldBlockError,
+)
+from .region import WHOLE, span
+
+_whole_length = span(*WHOLE)[1]
 
 is_windows = os.name == "nt"
 is_mac_os = sys.platform == "darwin"
 
+_poll_min = 0.001
+_poll_max = 0.05
+
+
+def _poll(try_lock: Callable[[], bool], deadline: Optional[float]) -> None:
+    """Tries to lock until the deadline, backing off from 1 ms to 50 ms
+    between attempts"""
+    delay = _poll_min
+    while not try_lock():
+        timeout = remaining(deadline)
+        if timeout is not None and not timeout:
+            raise AcquiringProcessLevelLockTimedOutError()
+        sleep(delay if timeout is None else min(delay, timeout))
+        delay = min(delay * 2, _poll_max)
+
 
 if is_windows:
     # Windows file locking
@@ -32,11 +62,49 @@ if is_windows:
             and error.strerror == "Permission denied"
         )
 
-    def process_level_lock(fd: int, shared: bool = False, blocking: bool = True):
+    def _check_region(start: int, length: int):
+        if start or length not in (0, _whole_length):
+            raise NotImplementedError("Region locks are not supported on Windows.")
+
+    def try_process_level_lock(
+        fd: int, shared: bool = False, start: int = 0, length: int = 0
+    ) -> bool:
+        """Locks fd if that needs no waiting, and returns whether it did"""
+        _check_region(start, length)
+        try:
+            msvcrt.locking(  # type: ignore [reportGeneralTypeIssues, reportUnknownMemberType]
+                fd,
+                msvcrt.LK_NBLCK,  # type: ignore [reportGeneralTypeIssues, reportUnknownMemberType]
+                _lock_length,
+            )
+        except PermissionError as error:
+            if _is_process_level_lock_blocking_error(error):
+                return False
+            raise error
+        return True
+
+    def process_level_lock(
+        fd: int,
+        shared: bool = False,
+        blocking: bool = True,
+        start: int = 0,
+        length: int = 0,
+        deadline: Optional[float] = None,
+    ) -> None:
+        """Locks fd, until deadline if blocking and deadline is not None
+
+        :code:`msvcrt` cannot wait with a timeout: :code:`LK_LOCK` retries
+        every second, ten times, by itself. Until a deadline, we poll with
+        :code:`LK_NBLCK` instead, backing off up to 50 ms between attempts.
+        """
         # NOTE: Simulates shared lock using an exclusive lock. This
         # implementation does not allow to lock the same fd multiple times.
         # This does not matter a we make sure we do not do that.
-        if blocking:
+        _check_region(start, length)
+        if not blocking:
+            if not try_process_level_lock(fd):
+                raise AcquiringProcessLevelLockWouldBlockError()
+        elif deadline is None:
             while True:
                 try:
                     msvcrt.locking(  # type: ignore [reportGeneralTypeIssues, reportUnknownMemberType]
@@ -49,28 +117,39 @@ if is_windows:
                     if not _is_process_level_lock_timeout_error(error):
                         raise error
         else:
-            try:
-                msvcrt.locking(  # type: ignore [reportGeneralTypeIssues, reportUnknownMemberType]
-                    fd,
-                    msvcrt.LK_NBLCK,  # type: ignore [reportGeneralTypeIssues, reportUnknownMemberType]
-                    _lock_length,
-                )
-            except PermissionError as error:
-                if _is_process_level_lock_blocking_error(error):
-                    raise AcquiringProcessLevelLockWouldBlockError()
-                else:
-                    raise error
+            _poll(partial(try_process_level_lock, fd), deadline)
 
-    def process_level_unlock(fd: int):
+    def process_level_unlock(fd: int, start: int = 0, length: int = 0) -> None:
         # NOTE: This implementation (Windows) will raise an error if attempting
         # to unlock an already unlocked fd. This does not matter as we make
         # sure we do not do that.
+        _check_region(start, length)
         msvcrt.locking(  # type: ignore [reportGeneralTypeIssues, reportUnknownMemberType]
             fd,
             msvcrt.LK_UNLCK,  # type: ignore [reportGeneralTypeIssues, reportUnknownMemberType]
             _lock_length,
         )
 
+    def has_ofd_locks() -> bool:
+        return False
+
+    def ofd_lock(
+        fd: int,
+        shared: bool = False,
+        blocking: bool = True,
+        start: int = 0,
+        length: int = 0,
+    ) -> None:
+        raise NotImplementedError("Open file description locks require Linux.")
+
+    def try_ofd_lock(
+        fd: int, shared: bool = False, start: int = 0, length: int = 0
+    ) -> bool:
+        raise NotImplementedError("Open file description locks require Linux.")
+
+    def ofd_unlock(fd: int, start: int = 0, length: int = 0) -> None:
+        raise NotImplementedError("Open file description locks require Linux.")
+
 else:
     # UNIX based file locking
     import fcntl
@@ -88,21 +167,173 @@ else:
             and error.strerror == "Resource temporarily unavailable"
         )
 
-    def process_level_lock(fd: int, shared: bool = False, blocking: bool = True):
+    def process_level_lock(
+        fd: int,
+        shared: bool = False,
+        blocking: bool = True,
+        start: int = 0,
+        length: int = 0,
+        deadline: Optional[float] = None,
+    ) -> None:
+        """Locks length bytes of fd from start, or up to the end of the file
+        however large if length is zero, until deadline if blocking and
+        deadline is not None
+
+        :code:`lockf` cannot wait with a timeout: until a deadline, we poll
+        instead, backing off up to 50 ms between attempts. To wait in the
+        kernel with a timeout, see :func:`start_process_level_lock`.
+        """
         operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
-        if blocking:
-            fcntl.lockf(fd, operation)
+        if blocking and deadline is not None:
+            _poll(partial(try_process_level_lock, fd, shared, start, length), deadline)
+        elif blocking:
+            fcntl.lockf(fd, operation, length, start)
         else:
             try:
-                fcntl.lockf(fd, operation | fcntl.LOCK_NB)
+                fcntl.lockf(fd, operation | fcntl.LOCK_NB, length, start)
             except BlockingIOError as error:
                 if _is_process_level_lock_blocking_error(error):
                     raise AcquiringProcessLevelLockWouldBlockError()
                 else:
                     raise error
 
-    def process_level_unlock(fd: int):
+    def try_process_level_lock(
+        fd: int, shared: bool = False, start: int = 0, length: int = 0
+    ) -> bool:
+        """Locks like :func:`process_level_lock` if that needs no waiting, and
+        returns whether it did, without raising otherwise"""
+        operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        try:
+            fcntl.lockf(fd, operation | fcntl.LOCK_NB, length, start)
+        except OSError as error:
+            if error.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise error
+        return True
+
+    def process_level_unlock(fd: int, start: int = 0, length: int = 0) -> None:
         # NOTE: This implementation (UNIX) will NOT raise an error if attempting
         # to unlock an already unlocked fd. This does not matter as we make
         # sure we do not do that.
-        fcntl.lockf(fd, fcntl.LOCK_UN)
+        fcntl.lockf(fd, fcntl.LOCK_UN, length, start)
+
+    def _flock(type: int, start: int = 0, length: int = 0) -> bytes:
+        # NOTE: struct flock, l_pid must be 0 for open file description locks.
+        # Trailing bytes leave room for padding.
+        return struct.pack("hhqqi", type, os.SEEK_SET, start, length, 0).ljust(
+            64, b"\0"
+        )
+
+    _ofd_locks = {
+        True: _flock(fcntl.F_RDLCK, 0, _whole_length),
+        False: _flock(fcntl.F_WRLCK, 0, _whole_length),
+    }
+    _ofd_unlock = _flock(fcntl.F_UNLCK)
+    _has_ofd_locks: Optional[bool] = None
+
+    def has_ofd_locks() -> bool:
+        """Whether the kernel supports open file description locks (Linux 3.15+)"""
+        global _has_ofd_locks
+        if _has_ofd_locks is None:
+            _has_ofd_locks = hasattr(fcntl, "F_OFD_GETLK")
+            if _has_ofd_locks:
+                try:
+                    with TemporaryFile() as file:
+                        fcntl.fcntl(file.fileno(), fcntl.F_OFD_GETLK, _ofd_unlock)
+                except OSError:
+                    _has_ofd_locks = False
+        return _has_ofd_locks
+
+    def ofd_lock(
+        fd: int,
+        shared: bool = False,
+        blocking: bool = True,
+        start: int = 0,
+        length: int = 0,
+    ) -> None:
+        """Locks the open file description of fd. Unlike :code:`lockf` locks,
+        these locks are owned by the open file description, so that two open
+        file descriptions of the same file exclude each other even within the
+        same process, and closing another fd does not release them."""
+        try:
+            fcntl.fcntl(
+                fd,
+                fcntl.F_OFD_SETLKW if blocking else fcntl.F_OFD_SETLK,
+                _ofd_locks[shared]
+                if not start and length == _whole_length
+                else _flock(fcntl.F_RDLCK if shared else fcntl.F_WRLCK, start, length),
+            )
+        except OSError as error:
+            if not blocking and error.errno in (errno.EAGAIN, errno.EACCES):
+                raise AcquiringProcessLevelLockWouldBlockError()
+            raise error
+
+    def try_ofd_lock(
+        fd: int, shared: bool = False, start: int = 0, length: int = 0
+    ) -> bool:
+        """Locks like :func:`ofd_lock` if that needs no waiting, and returns
+        whether it did, without raising otherwise"""
+        try:
+            fcntl.fcntl(
+                fd,
+                fcntl.F_OFD_SETLK,
+                _ofd_locks[shared]
+                if not start and length == _whole_length
+                else _flock(fcntl.F_RDLCK if shared else fcntl.F_WRLCK, start, length),
+            )
+        except OSError as error:
+            if error.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise error
+        return True
+
+    def ofd_unlock(fd: int, start: int = 0, length: int = 0) -> None:
+        fcntl.fcntl(
+            fd,
+            fcntl.F_OFD_SETLK,
+            _ofd_unlock
+            if not (start or length)
+            else _flock(fcntl.F_UNLCK, start, length),
+        )
+
+
+def open_files_limit() -> int:
+    """Returns the maximum number of files this process can open"""
+    if is_windows:
+        # NOTE: The default C runtime stream limit, see _setmaxstdio.
+        return 512
+
+    import resource
+
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        # NOTE: Even unlimited, the kernel caps open files per process.
+        return 1 << 20
+    return soft
+
+
+def start_process_level_lock(
+    fd: int,
+    shared: bool = False,
+    lock: Callable[[int, bool, bool], None] = process_level_lock,
+) -> "Future[None]":
+    """Blockingly locks fd in a background thread
+
+    This allows callers to wait for the lock with a timeout, which neither
+    :code:`fcntl` nor :code:`msvcrt` support. The kernel request cannot be
+    cancelled: if the caller stops waiting, it is responsible for undoing the
+    effect of the request once the returned future resolves.
+    """
+    future: Future[None] = Future()
+
+    def wait():
+        future.set_running_or_notify_cancel()
+        try:
+            lock(fd, shared, True)
+        except BaseException as error:
+            future.set_exception(error)
+        else:
+            future.set_result(None)
+
+    Thread(target=wait, name=f"dreadlocks-fd-{fd}", daemon=True).start()
+    return future
@@ -0,0 +1,27 @@
+from .thread import Policy, policies
+
+_policy: Policy = "reader"
+
+
+def set_thread_level_lock_policy(policy: Policy) -> None:
+    """Sets how thread-level locks arbitrate between waiting threads and tasks.
+
+    See :data:`dreadlocks.thread.Policy`. The policy applies to thread-level
+    locks created afterwards, that is, for paths that are not currently locked
+    or waited on. It is meant to be set once at startup.
+
+    Parameters
+    ----------
+    policy
+        One of :code:`"reader"` (the default, reader-preferring),
+        :code:`"writer"` (writer-preferring), or :code:`"fair"` (arrival
+        order, phase-fair).
+    """
+    global _policy
+    if policy not in policies:
+        raise ValueError(f"Unknown policy {policy!r}.")
+    _policy = policy
+
+
+def thread_level_lock_policy() -> Policy:
+    return _policy
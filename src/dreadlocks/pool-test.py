@@ -0,0 +1,144 @@
+from threading import Event, Thread
+from time import sleep
+
+import pytest
+
+from dreadlocks.pool import ThreadSafeKeyedRefPool
+
+
+def test_objects_are_shared_and_destroyed_on_last_unref():
+    destroyed: list[list[str]] = []
+    pool: ThreadSafeKeyedRefPool[str, list[str]] = ThreadSafeKeyedRefPool(
+        lambda key: [key], destroyed.append, shards=4
+    )
+
+    with pool("a") as a, pool("a") as b, pool("b") as c:
+        assert a is b
+        assert a is not c
+    assert sorted(map(tuple, destroyed)) == [("a",), ("b",)]
+
+
+def test_no_creation_while_destroying():
+    destroying = Event()
+    proceed = Event()
+    events: list[str] = []
+
+    def factory(key: str):
+        events.append("create")
+        return key
+
+    def destructor(_: str):
+        events.append("destroy")
+        destroying.set()
+        proceed.wait()
+        events.append("destroyed")
+
+    pool = ThreadSafeKeyedRefPool(factory, destructor)
+
+    def ref_and_unref():
+        with pool("a"):
+            pass
+
+    first = Thread(target=ref_and_unref)
+    first.start()
+    destroying.wait()
+    second = Thread(target=ref_and_unref)
+    second.start()
+    # NOTE: Give the second thread time to wait for destruction.
+    sleep(0.05)
+    proceed.set()
+    first.join()
+    second.join()
+    assert events == [
+        "create",
+        "destroy",
+        "destroyed",
+        "create",
+        "destroy",
+        "destroyed",
+    ]
+
+
+def test_factory_errors_propagate_and_are_not_pooled():
+    calls: list[str] = []
+
+    def factory(key: str):
+        calls.append(key)
+        if len(calls) == 1:
+            raise OSError(key)
+        return key
+
+    pool = ThreadSafeKeyedRefPool(factory)
+
+    with pytest.raises(OSError):
+        with pool("a"):
+            pass
+    with pool("a") as obj:
+        assert obj == "a"
+
+
+def test_many_releases_everything_on_factory_error():
+    def factory(key: str) -> str:
+        if key == "bad":
+            raise OSError(key)
+        return key
+
+    pool = ThreadSafeKeyedRefPool(factory, shards=1)
+
+    with pytest.raises(OSError):
+        with pool.many(["a", "bad", "c"]):
+            pass
+    assert not any(shard.refs for shard in pool._shards)  # type: ignore
+
+    with pool.many(["a", "c", "a"]) as objs:
+        assert objs == ["a", "c", "a"]
+    assert not any(shard.refs for shard in pool._shards)  # type: ignore
+
+
+def test_reshard():
+    pool: ThreadSafeKeyedRefPool[str, str] = ThreadSafeKeyedRefPool(lambda key: key)
+
+    with pool("a"):
+        with pytest.raises(RuntimeError):
+            pool.reshard(8)
+    pool.reshard(8)
+    with pytest.raises(ValueError):
+        pool.reshard(0)
+
+
+def test_idle_objects_are_kept_alive_and_evicted_lru_first():
+    created: list[str] = []
+    destroyed: list[str] = []
+
+    def factory(key: str):
+        created.append(key)
+        return key
+
+    pool = ThreadSafeKeyedRefPool(factory, destroyed.append, shards=1, idle=2)
+
+    for key in ("a", "b", "a", "c"):
+        with pool(key):
+            pass
+    # NOTE: "a" was revived from the cache, then "b" was least recently used.
+    assert created == ["a", "b", "c"]
+    assert destroyed == ["b"]
+
+    pool.set_idle(1)
+    assert destroyed == ["b", "a"]
+    pool.clear()
+    assert destroyed == ["b", "a", "c"]
+    assert not any(shard.refs for shard in pool._shards)  # type: ignore
+
+
+def test_discard_only_destroys_idle_objects():
+    destroyed: list[str] = []
+    pool = ThreadSafeKeyedRefPool(lambda key: key, destroyed.append, idle=2)
+
+    with pool("a"):
+        pool.discard("a")
+        assert destroyed == []
+    pool.discard("a")
+    assert destroyed == ["a"]
+    pool.discard("b")
+    assert destroyed == ["a"]
+    assert not any(shard.refs for shard in pool._shards)  # type: ignore
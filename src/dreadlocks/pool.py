@@ -1,49 +1,355 @@
+from collections import OrderedDict
 from contextlib import contextmanager
-from typing import Generic, TypeVar, Callable, Optional
-from threading import Lock
+from typing import Generic, Iterable, TypeVar, Callable, Optional
+from threading import Condition, Lock
+
+from . import hooks
 
 K = TypeVar("K")
 V = TypeVar("V")
 
 
+class _Entry(Generic[V]):
+    """A pooled object, its refcount, and where it is in its lifecycle"""
+
+    __slots__ = ("obj", "refcount", "state", "error")
+
+    def __init__(self):
+        self.obj: V
+        self.refcount = 1
+        self.state = _CREATING
+        self.error: Optional[BaseException] = None
+
+
+_CREATING = 0
+_READY = 1
+_DESTROYING = 2
+
+
+class _Shard(Generic[K, V]):
+    __slots__ = ("lock", "condition", "waiting", "refs", "idle", "capacity")
+
+    def __init__(self, capacity: int = 0):
+        self.lock = Lock()
+        self.condition = Condition(self.lock)
+        self.waiting = 0
+        self.refs: dict[K, _Entry[V]] = {}
+        # NOTE: Unreferenced objects kept alive, least recently used first.
+        self.idle: OrderedDict[K, _Entry[V]] = OrderedDict()
+        self.capacity = capacity
+
+    def wait(self):
+        """Waits for an entry to change state, with self.lock held"""
+        self.waiting += 1
+        try:
+            self.condition.wait()
+        finally:
+            self.waiting -= 1
+
+    def notify(self):
+        """Wakes up waiters, with self.lock held"""
+        # NOTE: Notifying is comparatively costly, and seldom needed.
+        if self.waiting:
+            self.condition.notify_all()
+
+
 class ThreadSafeKeyedRefPool(Generic[K, V]):
+    """Reference-counted pool of objects created on first ref and destroyed on
+    last unref.
+
+    Keys are hashed to shards, each guarded by its own lock, so that refs on
+    unrelated keys do not serialize on a single mutex. The factory and the
+    destructor are called outside of the shard lock. An object is never created
+    for a key while the previous object for that key is being destroyed, which
+    matters for file descriptors since closing any of them drops the
+    process-level locks on the file.
+
+    Optionally, up to a given number of unreferenced objects are kept alive
+    instead of being destroyed right away, the least recently used ones being
+    destroyed first when that number is exceeded. Only objects with a
+    destructor are kept alive.
+
+    Named pools tell hooks when they create, reuse, and destroy objects, see
+    :func:`dreadlocks.set_lock_hooks`.
+    """
+
     def __init__(
         self,
-        lock: Lock,
-        refs: dict[K, tuple[V, int]],
         factory: Callable[[K], V],
         destructor: Optional[Callable[[V], None]] = None,
+        shards: int = 1,
+        idle: int = 0,
+        name: Optional[str] = None,
     ):
-        self._lock = lock
-        self._refs = refs
         self._factory = factory
         self._destructor = destructor
+        self._name = name
+        self._shards: list[_Shard[K, V]] = []
+        self._idle = 0
+        self.reshard(shards)
+        self.set_idle(idle)
+
+    def reshard(self, shards: int) -> None:
+        """Changes the number of shards. The pool must be empty, apart from
+        idle objects, which are destroyed."""
+        if shards < 1:
+            raise ValueError("There must be at least one shard.")
+        self.clear()
+        if any(shard.refs for shard in self._shards):
+            raise RuntimeError("Cannot reshard a pool that is in use.")
+        self._shards = [_Shard() for _ in range(shards)]
+        self._set_capacities()
+
+    def set_idle(self, idle: int) -> None:
+        """Changes how many unreferenced objects are kept alive in total.
+        Objects in excess are destroyed."""
+        if idle < 0:
+            raise ValueError("The number of idle objects cannot be negative.")
+        self._idle = idle
+        self._set_capacities()
+        for shard in self._shards:
+            with shard.lock:
+                evicted = self._evict(shard)
+            self._destroy(shard, evicted)
+
+    def clear(self) -> None:
+        """Destroys all idle objects"""
+        for shard in self._shards:
+            with shard.lock:
+                evicted = self._evict(shard, 0)
+            self._destroy(shard, evicted)
+
+    def discard(self, key: K) -> None:
+        """Destroys the idle object of key, if any, so that the next ref
+        creates a new one. Referenced objects are left alone."""
+        shard = self._shards[self._index(key)]
+        with shard.lock:
+            entry = shard.idle.pop(key, None)
+            if entry is None:
+                return
+            entry.state = _DESTROYING
+        self._destroy(shard, [(key, entry)])
 
     @contextmanager
     def __call__(self, key: K):
-        with self._lock:
-            entry = self._refs.get(key)
-            if entry is None:
-                # NOTE: We create a new object if none exists
-                obj = self._factory(key)
-                self._refs[key] = (obj, 1)
-            else:
-                # NOTE: Otherwise we count one ref more
-                (obj, refcount) = entry
-                self._refs[key] = (obj, refcount + 1)
+        obj = self._ref(key)
 
         try:
             yield obj
 
         finally:
-            with self._lock:
-                (_, refcount) = self._refs[key]
-                if refcount == 1:
-                    # NOTE: We remove the object from the pool since nobody
-                    # else holds a reference to it.
-                    del self._refs[key]
-                    if self._destructor is not None:
-                        self._destructor(obj)
-                else:
-                    # NOTE: Otherwise we count one ref less
-                    self._refs[key] = (obj, refcount - 1)
+            self._unref(key)
+
+    @contextmanager
+    def many(self, keys: Iterable[K]):
+        """Refs all keys at once, in a single critical section per shard"""
+        keys = list(keys)
+        by_shard: dict[int, list[K]] = {}
+        for key in keys:
+            by_shard.setdefault(self._index(key), []).append(key)
+
+        refs: list[K] = []
+        try:
+            objs: dict[K, V] = {}
+            for index, shard_keys in by_shard.items():
+                shard = self._shards[index]
+                with shard.lock:
+                    entries = [(key, *self._reserve(shard, key)) for key in shard_keys]
+                for i, (key, entry, is_new) in enumerate(entries):
+                    try:
+                        objs[key] = self._resolve(shard, key, entry, is_new)
+                    except BaseException as error:
+                        self._cancel(shard, entries[i + 1 :], error)
+                        raise
+                    refs.append(key)
+            yield [objs[key] for key in keys]
+
+        finally:
+            for key in refs:
+                self._unref(key)
+
+    @property
+    def idle(self) -> int:
+        """How many unreferenced objects are kept alive in total"""
+        return self._idle
+
+    def checkout(self, key: K) -> V:
+        """Takes an object out of the pool for exclusive use: the idle object
+        for key if any, otherwise a new one. Objects are not reference-counted
+        while checked out, so a pool is either used through refs or through
+        checkouts.
+        """
+        shard = self._shards[self._index(key)]
+        with shard.lock:
+            entry = shard.idle.pop(key, None)
+            if entry is not None:
+                del shard.refs[key]
+        if entry is not None:
+            self._notify("on_reuse", key)
+            return entry.obj
+        obj = self._factory(key)
+        self._notify("on_create", key)
+        return obj
+
+    def checkin(self, key: K, obj: V) -> None:
+        """Gives back an object taken out with :meth:`checkout`, which is kept
+        idle if there is room for it, and destroyed otherwise."""
+        shard = self._shards[self._index(key)]
+        with shard.lock:
+            kept = bool(shard.capacity) and key not in shard.refs
+            if kept:
+                entry: _Entry[V] = _Entry()
+                entry.obj = obj
+                entry.refcount = 0
+                entry.state = _READY
+                shard.refs[key] = entry
+                shard.idle[key] = entry
+                evicted = self._evict(shard)
+            else:
+                evicted = []
+
+        if not kept and self._destructor is not None:
+            self._destructor(obj)
+            self._notify("on_destroy", key)
+        self._destroy(shard, evicted)
+
+    def _set_capacities(self):
+        # NOTE: The budget is split exactly, so that it is never exceeded.
+        quotient, remainder = divmod(self._idle, len(self._shards))
+        for index, shard in enumerate(self._shards):
+            shard.capacity = quotient + (index < remainder)
+
+    def _index(self, key: K) -> int:
+        return hash(key) % len(self._shards)
+
+    def _notify(self, event: str, key: K):
+        observer = hooks.current
+        if observer is not None and self._name is not None:
+            getattr(observer, event)(self._name, key)
+
+    def _ref(self, key: K) -> V:
+        shard = self._shards[self._index(key)]
+        with shard.lock:
+            entry, is_new = self._reserve(shard, key)
+        return self._resolve(shard, key, entry, is_new)
+
+    def _reserve(self, shard: _Shard[K, V], key: K) -> tuple[_Entry[V], bool]:
+        """Counts one ref more, with the shard lock held"""
+        while True:
+            entry = shard.refs.get(key)
+            if entry is None:
+                # NOTE: We will create a new object since none exists. Plain
+                # _Entry() avoids typing's generic alias call on every ref.
+                created: _Entry[V] = _Entry()
+                shard.refs[key] = created
+                return created, True
+            if entry.state != _DESTROYING:
+                # NOTE: Otherwise we count one ref more, reviving the object if
+                # it was idle.
+                if not entry.refcount:
+                    del shard.idle[key]
+                    self._notify("on_reuse", key)
+                entry.refcount += 1
+                return entry, False
+            # NOTE: We wait for the previous object to be destroyed before
+            # creating a new one.
+            shard.wait()
+
+    def _resolve(
+        self, shard: _Shard[K, V], key: K, entry: _Entry[V], is_new: bool
+    ) -> V:
+        """Creates the object of a reserved ref, or waits for it to be created"""
+        if is_new:
+            try:
+                entry.obj = self._factory(key)
+            except BaseException as error:
+                with shard.lock:
+                    entry.error = error
+                    entry.state = _READY
+                    shard.notify()
+                self._unref(key)
+                raise
+            with shard.lock:
+                entry.state = _READY
+                shard.notify()
+            self._notify("on_create", key)
+        else:
+            with shard.lock:
+                while entry.state == _CREATING:
+                    shard.wait()
+            if entry.error is not None:
+                self._unref(key)
+                raise entry.error
+
+        return entry.obj
+
+    def _cancel(
+        self,
+        shard: _Shard[K, V],
+        entries: list[tuple[K, _Entry[V], bool]],
+        error: BaseException,
+    ):
+        """Gives up on reserved refs that have not been resolved yet"""
+        with shard.lock:
+            for _, entry, is_new in entries:
+                if is_new:
+                    entry.error = error
+                    entry.state = _READY
+            shard.notify()
+        for key, _, _ in entries:
+            self._unref(key)
+
+    def _unref(self, key: K):
+        shard = self._shards[self._index(key)]
+        with shard.lock:
+            entry = shard.refs[key]
+            entry.refcount -= 1
+            if entry.refcount:
+                # NOTE: Otherwise we count one ref less
+                return
+            if entry.error is not None or self._destructor is None:
+                del shard.refs[key]
+                return
+            # NOTE: Nobody else holds a reference to the object. We keep it
+            # in the pool until it is destroyed, or while it is idle.
+            shard.idle[key] = entry
+            evicted = self._evict(shard)
+
+        self._destroy(shard, evicted)
+
+    def _evict(
+        self, shard: _Shard[K, V], capacity: Optional[int] = None
+    ) -> list[tuple[K, _Entry[V]]]:
+        """Marks least recently used idle objects in excess for destruction,
+        with the shard lock held"""
+        if capacity is None:
+            capacity = shard.capacity
+        evicted: list[tuple[K, _Entry[V]]] = []
+        while len(shard.idle) > capacity:
+            key, entry = shard.idle.popitem(last=False)
+            entry.state = _DESTROYING
+            evicted.append((key, entry))
+        return evicted
+
+    def _destroy(self, shard: _Shard[K, V], evicted: list[tuple[K, _Entry[V]]]):
+        """Destroys evicted objects, without the shard lock held"""
+        destructor = self._destructor
+        if destructor is None or not evicted:
+            return
+
+        error: Optional[BaseException] = None
+        for key, entry in evicted:
+            try:
+                destructor(entry.obj)
+            except BaseException as e:
+                error = error or e
+            else:
+                self._notify("on_destroy", key)
+
+        with shard.lock:
+            for key, _ in evicted:
+                del shard.refs[key]
+            shard.notify()
+
+        if error is not None:
+            raise error
@@ -0,0 +1,128 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from os import O_RDWR, close, open as os_open
+from pathlib import Path
+from threading import Event
+from time import monotonic, sleep
+
+import pytest
+
+from dreadlocks import (
+    AcquiringLockWouldBlockError,
+    AcquiringProcessLevelLockTimedOutError,
+    AcquiringProcessLevelLockWouldBlockError,
+    process_level_path_lock,
+)
+from dreadlocks.process import ShareableProcessLock
+
+mp = get_context(method="spawn")
+
+
+def hold(path: str, locked: str, seconds: float):
+    with process_level_path_lock(path, shared=True):
+        Path(locked).touch()
+        sleep(seconds)
+
+
+def can_lock(path: str, shared: bool, start: int = 0, length: int = 0) -> bool:
+    try:
+        with process_level_path_lock(
+            path, shared=shared, blocking=False, start=start, length=length
+        ):
+            return True
+    except AcquiringLockWouldBlockError:
+        return False
+
+
+@pytest.fixture
+def path(tmp_path: Path) -> str:
+    path = tmp_path / "lock"
+    path.touch()
+    return str(path)
+
+
+def held_elsewhere(processes: ProcessPoolExecutor, path: str, seconds: float):
+    locked = Path(f"{path}.locked")
+    holder = processes.submit(hold, path, str(locked), seconds)
+    while not locked.exists():
+        assert not holder.done()
+        sleep(0.001)
+    return holder
+
+
+def test_upgrades_wait_outside_of_the_mutex(path: str):
+    fd = os_open(path, O_RDWR)
+    lock = ShareableProcessLock(fd)
+    try:
+        with (
+            ProcessPoolExecutor(1, mp_context=mp) as processes,
+            ThreadPoolExecutor(1) as threads,
+        ):
+            holder = held_elsewhere(processes, path, 0.5)
+            lock.acquire(shared=True, owner="reader")
+            lock.acquire(shared=True, owner="upgrader")
+            upgrading = threads.submit(lock.upgrade, owner="upgrader")
+            # NOTE: Give the thread time to start waiting.
+            sleep(0.05)
+
+            # NOTE: Shared holds and releases need no kernel call.
+            lock.acquire(shared=True, blocking=False, owner="another")
+            lock.release(shared=True, owner="another")
+            lock.release(shared=True, owner="reader")
+            # NOTE: Owners that need to raise the range wait for the upgrade.
+            with pytest.raises(AcquiringProcessLevelLockWouldBlockError):
+                lock.acquire(blocking=False, owner="writer")
+            assert not upgrading.done()
+
+            upgrading.result()
+            holder.result()
+            assert not processes.submit(can_lock, path, True).result()
+            lock.release(owner="upgrader")
+            assert processes.submit(can_lock, path, False).result()
+    finally:
+        close(fd)
+
+
+def test_abandoned_upgrades_are_undone(path: str):
+    fd = os_open(path, O_RDWR)
+    lock = ShareableProcessLock(fd)
+    undone = Event()
+    try:
+        with ProcessPoolExecutor(1, mp_context=mp) as processes:
+            holder = held_elsewhere(processes, path, 0.2)
+            lock.acquire(shared=True, owner="upgrader")
+            with pytest.raises(AcquiringProcessLevelLockTimedOutError):
+                lock.upgrade(deadline=monotonic() + 0.05, owner="upgrader")
+            # NOTE: The shared hold is kept while the kernel request is pending.
+            lock.acquire(shared=True, blocking=False, owner="reader")
+            lock.release(shared=True, owner="reader")
+
+            holder.result()
+            lock.defer(undone.set)
+            assert undone.wait(10)
+            assert processes.submit(can_lock, path, True).result()
+            assert not processes.submit(can_lock, path, False).result()
+            lock.release(shared=True, owner="upgrader")
+            assert processes.submit(can_lock, path, False).result()
+    finally:
+        close(fd)
+
+
+def test_whole_file_holds_mix_with_regions(path: str):
+    fd = os_open(path, O_RDWR)
+    lock = ShareableProcessLock(fd)
+    try:
+        with ProcessPoolExecutor(1, mp_context=mp) as processes:
+            lock.acquire(shared=True, owner="reader")
+            lock.acquire(owner="writer", start=10, end=20)
+            lock.release(shared=True, owner="reader")
+            assert processes.submit(can_lock, path, False, 0, 10).result()
+            assert not processes.submit(can_lock, path, True, 10, 10).result()
+            lock.acquire(shared=True, owner="reader")
+            lock.release(owner="writer", start=10, end=20)
+            assert processes.submit(can_lock, path, True).result()
+            assert not processes.submit(can_lock, path, False, 30, 1).result()
+            lock.release(shared=True, owner="reader")
+            assert processes.submit(can_lock, path, False).result()
+    finally:
+        close(fd)
@@ -1,23 +1,101 @@
+from asyncio import (
+    CancelledError,
+    TimeoutError as AsyncTimeoutError,
+    current_task,
+    shield,
+    wait_for,
+    wrap_future,
+)
 from collections import Counter
-from contextlib import contextmanager
-from threading import Lock, get_ident
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import asynccontextmanager, contextmanager
+from functools import partial
+from threading import Condition, Lock, get_ident
+from typing import Callable, Hashable, Optional
 
-from .errors import RecursiveDeadlockError, AcquiringProcessLevelLockWouldBlockError
-from .platform import is_windows, process_level_lock, process_level_unlock
+from . import hooks
+from .deadline import remaining
+from .hooks import OnWait
+from .waiter import Waiter
+from .region import (
+    END,
+    EXCLUSIVE as _EXCLUSIVE,
+    NONE as _NONE,
+    SHARED as _SHARED,
+    Regions,
+    Segments,
+    span,
+)
+from .errors import (
+    RecursiveDeadlockError,
+    AcquiringProcessLevelLockWouldBlockError,
+    AcquiringProcessLevelLockTimedOutError,
+)
+from .platform import (
+    is_windows,
+    ofd_lock,
+    ofd_unlock,
+    process_level_lock,
+    process_level_unlock,
+    start_process_level_lock,
+    try_ofd_lock,
+    try_process_level_lock,
+)
 
 
 class ShareableProcessLock:
-    """Creates a process lock for a FD shared by all threads of a process"""
+    """Creates a process lock for a FD shared by all threads and asyncio tasks
+    of a process
 
-    def __init__(self, fd: int):
+    With ofd, the lock is an open file description lock instead of a
+    :code:`lockf` lock, so that closing other FDs of the same file does not
+    release it.
+
+    Owners can lock byte regions from start to end. Kernel locks of a process
+    merge and split, so we keep track of how many owners hold each byte to only
+    ever lock, downgrade, or unlock ranges whose mode changes.
+
+    Waiting for other processes happens outside of the mutex guarding this
+    bookkeeping, so that owners whose holds need no kernel call, such as
+    shared ones while an upgrade waits, and releases keep going. Ranges being
+    raised are pending until their owner is done: nobody else changes their
+    kernel lock meanwhile, owners that need to raise them too wait, and owners
+    releasing them leave it to the pending owner to bring them to the right
+    mode.
+    """
+
+    def __init__(self, fd: int, ofd: bool = False, key: Hashable = None):
         self._fd = fd
+        # NOTE: What hooks are told the lock is about.
+        self.key = fd if key is None else key
+        self._lock_fd = ofd_lock if ofd else process_level_lock
+        self._unlock_fd = ofd_unlock if ofd else process_level_unlock
+        self._try_lock_fd = try_ofd_lock if ofd else try_process_level_lock
         self._lock = Lock()
-        self._shared_by: Counter[int] = Counter()
-        self._exclusively_held_by: Counter[int] = Counter()
+        self._resolved = Condition(self._lock)
+        # NOTE: Disjoint ranges whose kernel lock is being raised, with their
+        # mode before.
+        self._pending: list[tuple[int, int, int]] = []
+        # NOTE: What each owner holds, and how many owners hold each byte.
+        self._holds = Regions()
+        self._held_by: Counter[Hashable] = Counter()
+        self._segments = Segments(exclusive_only=is_windows)
+        # NOTE: The owner and mode of the only hold, if it is of the whole
+        # file, which is then recorded in none of the above.
+        self._sole: Optional[tuple[Hashable, bool]] = None
+        self._abandoned_lock = Lock()
+        self._abandoned: set[Future[None]] = set()
+        self._waiter = Waiter(f"dreadlocks-fd-{fd}")
 
     @contextmanager
     def lock(
-        self, shared: bool = False, blocking: bool = True, reentrant: bool = False
+        self,
+        shared: bool = False,
+        blocking: bool = True,
+        reentrant: bool = False,
+        deadline: Optional[float] = None,
+        start: int = 0,
+        end: int = END,
     ):
         """Locks the scoped FD
 
@@ -37,59 +115,515 @@ class ShareableProcessLock:
             Whether lock acquisition is reentrant. If True, allows each thread
             to lock the file recursively. Otherwise, the same thread
             recursively locking dead-locks.
+        deadline : Optional[float]
+            The :func:`time.monotonic` time after which blocking lock
+            acquisition gives up. If None, will block until the lock can be
+            acquired.
+        start : int
+            The first byte of the region to lock.
+        end : int
+            The byte after the last byte of the region to lock. Defaults to
+            the end of the file, however large.
+        """
+        owner = get_ident()
+        self.acquire(shared, blocking, reentrant, deadline, owner, start, end)
+        try:
+            yield
+        finally:
+            self.release(shared, owner, start, end)
+
+    @asynccontextmanager
+    async def alock(
+        self,
+        shared: bool = False,
+        blocking: bool = True,
+        reentrant: bool = False,
+        deadline: Optional[float] = None,
+        start: int = 0,
+        end: int = END,
+    ):
+        """Locks the scoped FD on behalf of the current asyncio task
+
+        See :meth:`lock`. Waiting for the kernel cannot be done without a
+        thread: all tasks waiting on this FD share a single one.
+        """
+        owner = current_task()
+        await self.aacquire(shared, blocking, reentrant, deadline, owner, start, end)
+        try:
+            yield
+        finally:
+            self.release(shared, owner, start, end)
+
+    def acquire(
+        self,
+        shared: bool = False,
+        blocking: bool = True,
+        reentrant: bool = False,
+        deadline: Optional[float] = None,
+        owner: Optional[Hashable] = None,
+        start: int = 0,
+        end: int = END,
+    ) -> None:
+        if owner is None:
+            owner = get_ident()
+        observer = hooks.current
+        if observer is None:
+            self._acquire(shared, blocking, reentrant, deadline, owner, start, end)
+            return
+        hooks.observe(
+            observer,
+            "process",
+            self.key,
+            owner,
+            shared,
+            partial(
+                self._acquire, shared, blocking, reentrant, deadline, owner, start, end
+            ),
+        )
+
+    async def aacquire(
+        self,
+        shared: bool = False,
+        blocking: bool = True,
+        reentrant: bool = False,
+        deadline: Optional[float] = None,
+        owner: Optional[Hashable] = None,
+        start: int = 0,
+        end: int = END,
+    ) -> None:
+        if owner is None:
+            owner = current_task()
+        observer = hooks.current
+        if observer is None:
+            await self._aacquire(
+                shared, blocking, reentrant, deadline, owner, start, end
+            )
+            return
+        await hooks.aobserve(
+            observer,
+            "process",
+            self.key,
+            owner,
+            shared,
+            partial(
+                self._aacquire, shared, blocking, reentrant, deadline, owner, start, end
+            ),
+        )
+
+    def try_acquire(
+        self,
+        shared: bool = False,
+        owner: Optional[Hashable] = None,
+        start: int = 0,
+        end: int = END,
+    ) -> bool:
+        """Acquires the lock if that needs no waiting, without raising
+        otherwise. Owners that already hold part of the region do not acquire
+        it again. See :meth:`dreadlocks.thread.ShareableThreadLock.try_acquire`.
+        """
+        if owner is None:
+            owner = get_ident()
+        with self._lock:
+            self._spill()
+            if not self._held_by and not self._pending:
+                # NOTE: Fast path, nothing is held in this process.
+                pieces = [(start, end, _NONE)]
+            else:
+                if self._held_by[owner] and any(
+                    hold.owner == owner for hold in self._holds.overlapping(start, end)
+                ):
+                    return False
+                pieces = self._segments.missing(start, end, shared)
+                if any(self._is_pending(piece[0], piece[1]) for piece in pieces):
+                    return False
+            locked: list[tuple[int, int, int]] = []
+            for piece in pieces:
+                if not self._try_lock(shared, *span(piece[0], piece[1])):
+                    self._restore(locked)
+                    return False
+                locked.append(piece)
+            self._hold(shared, owner, start, end)
+        self._notify_upgrade(locked)
+        observer = hooks.current
+        if observer is not None:
+            observer.on_acquire("process", self.key, owner, shared, False, 0.0)
+        return True
+
+    def release(
+        self,
+        shared: bool = False,
+        owner: Optional[Hashable] = None,
+        start: int = 0,
+        end: int = END,
+    ):
+        if owner is None:
+            owner = get_ident()
+        downgraded = self._release(shared, owner, start, end)
+        observer = hooks.current
+        if observer is not None:
+            observer.on_release("process", self.key, owner, shared)
+            if downgraded:
+                observer.on_downgrade(self.key)
+
+    def upgrade(
+        self,
+        blocking: bool = True,
+        deadline: Optional[float] = None,
+        owner: Optional[Hashable] = None,
+        start: int = 0,
+        end: int = END,
+    ) -> None:
+        """Turns a shared hold of owner into an exclusive one. If that fails,
+        the shared hold is kept.
+
+        Other processes holding the region shared must release it first. Two
+        processes upgrading at once dead-lock, unless they hold the
+        :data:`dreadlocks.region.INTENT` byte exclusively first.
+        """
+        if owner is None:
+            owner = get_ident()
+        self.acquire(False, blocking, True, deadline, owner, start, end)
+        self.release(True, owner, start, end)
+
+    def downgrade(
+        self, owner: Optional[Hashable] = None, start: int = 0, end: int = END
+    ) -> None:
+        """Turns an exclusive hold of owner into a shared one, which never
+        waits"""
+        if owner is None:
+            owner = get_ident()
+        # NOTE: Blocking only on the mutex, the kernel lock already covers
+        # the region.
+        self.acquire(True, True, True, None, owner, start, end)
+        self.release(False, owner, start, end)
+
+    def defer(self, callback: Callable[[], None]) -> None:
+        """Calls callback once all abandoned requests have been resolved and
+        undone. Resources they depend on, such as the FD, must be kept alive
+        until then.
         """
-        thread_id = get_ident()
-        if self._lock.acquire(blocking=blocking):
+        with self._abandoned_lock:
+            abandoned = list(self._abandoned)
+
+        if not abandoned:
+            callback()
+            return
+
+        countdown = [len(abandoned)]
+
+        def done(_: "Future[None]"):
+            with self._abandoned_lock:
+                countdown[0] -= 1
+                if countdown[0]:
+                    return
+            callback()
+
+        for pending in abandoned:
+            pending.add_done_callback(done)
+
+    def _acquire(
+        self,
+        shared: bool,
+        blocking: bool,
+        reentrant: bool,
+        deadline: Optional[float],
+        owner: Hashable,
+        start: int,
+        end: int,
+        on_wait: OnWait = None,
+    ):
+        with self._lock:
+            pieces = self._missing(
+                shared, blocking, reentrant, deadline, owner, start, end, on_wait
+            )
+            locked: list[tuple[int, int, int]] = []
             try:
-                if not reentrant and (
-                    self._shared_by[thread_id] or self._exclusively_held_by[thread_id]
+                for piece in pieces:
+                    if not self._try_lock(shared, *span(piece[0], piece[1])):
+                        break
+                    locked.append(piece)
+                else:
+                    self._hold(shared, owner, start, end)
+                    self._notify_upgrade(locked)
+                    return
+                if not blocking:
+                    raise AcquiringProcessLevelLockWouldBlockError()
+            except BaseException:
+                self._restore(locked)
+                raise
+            # NOTE: Other processes hold some piece: we wait for them without
+            # the mutex, see the class docstring.
+            self._pending.extend(pieces)
+
+        wanted = _SHARED if shared and not is_windows else _EXCLUSIVE
+        done = len(locked)
+        try:
+            for piece in pieces[done:]:
+                self._process_level_lock(shared, deadline, piece, on_wait)
+                done += 1
+        except BaseException as error:
+            resolved = [(piece, wanted) for piece in pieces[:done]]
+            resolved.extend((piece, piece[2]) for piece in pieces[done:])
+            if (
+                isinstance(error, AcquiringProcessLevelLockTimedOutError)
+                and error.pending is not None
+            ):
+                # NOTE: The kernel request is still running: its piece stays
+                # pending until it is resolved and undone.
+                piece = pieces[done]
+                del resolved[done]
+                self._track(
+                    error.pending,
+                    partial(self._undo, piece, wanted, error.pending),
+                )
+            self._resolve(resolved)
+            raise
+
+        with self._lock:
+            self._hold(shared, owner, start, end)
+            for piece in pieces:
+                self._pending.remove(piece)
+            self._resolved.notify_all()
+        self._notify_upgrade(pieces)
+
+    def _missing(
+        self,
+        shared: bool,
+        blocking: bool,
+        reentrant: bool,
+        deadline: Optional[float],
+        owner: Hashable,
+        start: int,
+        end: int,
+        on_wait: OnWait,
+    ) -> list[tuple[int, int, int]]:
+        """Ranges whose kernel lock must go up for a new hold, with their
+        current mode, once no other owner raises them. Called with self._lock
+        held."""
+        while True:
+            self._spill()
+            if not self._held_by and not self._pending:
+                # NOTE: Fast path, nothing is held in this process.
+                return [(start, end, _NONE)]
+            if not reentrant and self._held_by[owner]:
+                if any(
+                    hold.owner == owner for hold in self._holds.overlapping(start, end)
                 ):
                     raise RecursiveDeadlockError()
+            # NOTE: We only lock ranges nobody holds yet, or ranges we want to
+            # upgrade to exclusive, but only on UNIX since current
+            # implementation always uses exclusive locks on Windows.
+            pieces = self._segments.missing(start, end, shared)
+            if not any(self._is_pending(piece[0], piece[1]) for piece in pieces):
+                return pieces
 
-                is_held_shared = bool(self._shared_by)
-                is_held_exclusively = bool(self._exclusively_held_by)
-                is_held = is_held_shared or is_held_exclusively
+            # NOTE: Waiting for the pending owner is waiting for other owners.
+            if not blocking:
+                raise AcquiringProcessLevelLockWouldBlockError()
+            if on_wait is not None:
+                on_wait()
+            timeout = remaining(deadline)
+            if timeout is not None and not timeout:
+                raise AcquiringProcessLevelLockTimedOutError()
+            self._resolved.wait(timeout)
 
-                if not is_held or (is_held_shared and not shared and not is_windows):
-                    # NOTE: We only lock when the first locking attempt is made, or
-                    # if we want to upgrade the lock to an exclusive lock, but only on
-                    # UNIX since current implementation always uses exclusive locks on
-                    # Windows.
-                    process_level_lock(self._fd, shared, blocking)
+    def _is_pending(self, start: int, end: int) -> bool:
+        return any(
+            pending_start < end and start < pending_end
+            for pending_start, pending_end, _ in self._pending
+        )
 
-                if shared:
-                    self._shared_by[thread_id] += 1
-                else:
-                    self._exclusively_held_by[thread_id] += 1
+    def _hold(self, shared: bool, owner: Hashable, start: int, end: int):
+        """Records a hold whose kernel lock is in place. Called with
+        self._lock held."""
+        if not start and end == END and not self._held_by and not self._pending:
+            # NOTE: Fast path, the whole file needs no bookkeeping.
+            self._sole = (owner, shared)
+            return
+        self._segments.add(start, end, shared)
+        self._holds.add(start, end, owner, shared)
+        self._held_by[owner] += 1
+
+    def _notify_upgrade(self, pieces: list[tuple[int, int, int]]):
+        observer = hooks.current
+        if observer is not None and any(mode == _SHARED for *_, mode in pieces):
+            observer.on_upgrade(self.key)
+
+    async def _aacquire(
+        self,
+        shared: bool,
+        blocking: bool,
+        reentrant: bool,
+        deadline: Optional[float],
+        owner: Hashable,
+        start: int,
+        end: int,
+        on_wait: OnWait = None,
+    ):
+        try:
+            self._acquire(shared, False, reentrant, None, owner, start, end)
+            return
+        except AcquiringProcessLevelLockWouldBlockError:
+            if not blocking:
+                raise
+
+        if on_wait is not None:
+            on_wait()
+        pending = self._waiter.submit(
+            partial(self._acquire, shared, True, reentrant, None, owner, start, end)
+        )
+        try:
+            await wait_for(shield(wrap_future(pending)), remaining(deadline))
+        except (AsyncTimeoutError, CancelledError) as error:
+            if not pending.cancel():
+                # NOTE: The request is running and cannot be cancelled: we
+                # release the lock as soon as it is acquired.
+                def undo():
+                    if pending.exception() is None:
+                        self._release(shared, owner, start, end)
+
+                self._track(pending, undo)
+            if isinstance(error, AsyncTimeoutError):
+                raise AcquiringProcessLevelLockTimedOutError(pending) from None
+            raise
+
+    def _release(self, shared: bool, owner: Hashable, start: int, end: int) -> bool:
+        """Returns whether some range was downgraded from exclusive to shared"""
+        with self._lock:
+            if self._sole == (owner, shared) and not start and end == END:
+                # NOTE: Fast path, that was the only hold in this process.
+                self._sole = None
+                self._unlock_fd(self._fd, *span(start, end))
+                return False
+            self._spill()
+            self._holds.remove(self._holds.find(start, end, owner, shared))
+            self._held_by[owner] -= 1
+            if not self._held_by[owner]:
+                del self._held_by[owner]
+
+            if not self._held_by and not self._pending:
+                # NOTE: Fast path, that was the last hold in this process.
+                self._segments.clear()
+                self._unlock_fd(self._fd, *span(start, end))
+                return False
+
+            # NOTE: We only unlock ranges nobody holds anymore, and downgrade
+            # ranges from exclusive to shared if we are not on Windows and no
+            # exclusive lock is left on them.
+            changed = self._segments.remove(start, end, shared)
+            if self._pending:
+                # NOTE: Pending owners bring the ranges they raise to the
+                # right mode once done.
+                changed = self._outside_pending(changed)
+            self._restore(changed)
+            return any(mode == _SHARED for *_, mode in changed)
+
+    def _spill(self):
+        """Records the only hold of the whole file like any other hold, before
+        the bookkeeping changes otherwise. Called with self._lock held."""
+        sole = self._sole
+        if sole is None:
+            return
+        self._sole = None
+        owner, shared = sole
+        self._segments.add(0, END, shared)
+        self._holds.add(0, END, owner, shared)
+        self._held_by[owner] += 1
+
+    def _outside_pending(
+        self, ranges: list[tuple[int, int, int]]
+    ) -> list[tuple[int, int, int]]:
+        """Parts of ranges no pending range overlaps"""
+        outside: list[tuple[int, int, int]] = []
+        for start, end, mode in ranges:
+            for pending_start, pending_end, _ in sorted(self._pending):
+                if pending_end <= start or end <= pending_start:
+                    continue
+                if start < pending_start:
+                    outside.append((start, pending_start, mode))
+                start = max(start, pending_end)
+                if start >= end:
+                    break
+            if start < end:
+                outside.append((start, end, mode))
+        return outside
+
+    def _track(self, pending: "Future[None]", undo: Callable[[], None]):
+        """Undoes an abandoned request once it has resolved"""
+        with self._abandoned_lock:
+            self._abandoned.add(pending)
+
+        def done(_: "Future[None]"):
+            try:
+                undo()
             finally:
-                self._lock.release()
-        else:
-            raise AcquiringProcessLevelLockWouldBlockError()
+                with self._abandoned_lock:
+                    self._abandoned.discard(pending)
+
+        pending.add_done_callback(done)
+
+    def _process_level_lock(
+        self,
+        shared: bool,
+        deadline: Optional[float],
+        piece: tuple[int, int, int],
+        on_wait: OnWait = None,
+    ):
+        """Waits for other processes to let us lock a pending piece"""
+        start, length = span(piece[0], piece[1])
+        if on_wait is not None:
+            on_wait()
+        if deadline is None:
+            self._lock_fd(self._fd, shared, True, start, length)
+            return
+        if is_windows:
+            # NOTE: msvcrt cannot wait in the kernel with a timeout anyway, so
+            # we poll until the deadline on this thread.
+            process_level_lock(self._fd, shared, True, start, length, deadline)
+            return
 
+        timeout = remaining(deadline)
+        if not timeout:
+            raise AcquiringProcessLevelLockTimedOutError()
+
+        pending = start_process_level_lock(
+            self._fd, shared, partial(self._lock_fd, start=start, length=length)
+        )
         try:
-            yield
+            pending.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise AcquiringProcessLevelLockTimedOutError(pending) from None
 
-        finally:
-            with self._lock:
-                if shared:
-                    self._shared_by[thread_id] -= 1
-                    if not self._shared_by[thread_id]:
-                        del self._shared_by[thread_id]
-                else:
-                    self._exclusively_held_by[thread_id] -= 1
-                    if not self._exclusively_held_by[thread_id]:
-                        del self._exclusively_held_by[thread_id]
-
-                is_held_shared = bool(self._shared_by)
-                is_held_exclusively = bool(self._exclusively_held_by)
-                is_held = is_held_shared or is_held_exclusively
-
-                if not is_held:
-                    # NOTE: We only release the lock once we have exhausted all
-                    # locking attempts
-                    process_level_unlock(self._fd)
-                elif not is_held_exclusively and not shared and not is_windows:
-                    # NOTE: We downgrade the lock from exclusive to shared if we
-                    # are not on Windows and we just released an exclusive
-                    # lock, and no exclusive lock is left.
-                    process_level_lock(self._fd, shared=True, blocking=True)
+    def _try_lock(self, shared: bool, start: int, length: int) -> bool:
+        return self._try_lock_fd(self._fd, shared, start, length)
+
+    def _restore(self, pieces: list[tuple[int, int, int]]):
+        """Brings ranges back to the given modes, which never blocks"""
+        for piece_start, piece_end, mode in reversed(pieces):
+            start, length = span(piece_start, piece_end)
+            if mode:
+                self._lock_fd(self._fd, True, True, start, length)
+            else:
+                self._unlock_fd(self._fd, start, length)
+
+    def _resolve(self, resolved: list[tuple[tuple[int, int, int], int]]):
+        """Stops tracking pending pieces, given the mode their kernel lock was
+        left in, and brings them to the mode of their holds, which never
+        blocks"""
+        with self._lock:
+            for piece, mode in resolved:
+                self._pending.remove(piece)
+                self._restore(
+                    [
+                        (start, end, current)
+                        for start, end, current in self._segments.modes(
+                            piece[0], piece[1]
+                        )
+                        if current != mode
+                    ]
+                )
+            self._resolved.notify_all()
+
+    def _undo(self, piece: tuple[int, int, int], wanted: int, pending: "Future[None]"):
+        """Undoes an abandoned kernel request once it has resolved"""
+        self._resolve([(piece, wanted if pending.exception() is None else piece[2])])
@@ -1,12 +1,29 @@
-from contextlib import contextmanager
+from contextlib import ExitStack, contextmanager
+from typing import Optional
 
+from .errors import AcquiringProcessLevelLockTimedOutError
 from .globals import process_level_lock_ref
+from .region import END
 
 
 @contextmanager
 def process_level_lock(
-    fd: int, shared: bool = False, blocking: bool = True, reentrant: bool = False
+    fd: int,
+    shared: bool = False,
+    blocking: bool = True,
+    reentrant: bool = False,
+    deadline: Optional[float] = None,
+    start: int = 0,
+    end: int = END,
 ):
-    with process_level_lock_ref(fd) as ref:
-        with ref.lock(shared, blocking, reentrant):
-            yield
+    with ExitStack() as stack:
+        ref = stack.enter_context(process_level_lock_ref(fd))
+        try:
+            stack.enter_context(
+                ref.lock(shared, blocking, reentrant, deadline, start, end)
+            )
+        except AcquiringProcessLevelLockTimedOutError as error:
+            # NOTE: An abandoned kernel request may still refer to ref.
+            error.defer(stack.pop_all().close)
+            raise
+        yield
@@ -1,8 +1,22 @@
-from contextlib import contextmanager
+from asyncio import current_task
+from contextlib import ExitStack, asynccontextmanager, contextmanager
 from os.path import normpath
+from typing import Optional
 
-from .globals import fd_ref
+from .backend import process_level_lock_backend
+from .deadline import absolute_deadline
+from .errors import AcquiringProcessLevelLockTimedOutError
+from .globals import fd_ref, process_level_lock_ref
 from .process_level_lock import process_level_lock
+from .region import END, region
+
+
+def _check_backend():
+    if process_level_lock_backend() == "broker":
+        raise NotImplementedError(
+            "The lock broker grants locks to threads and tasks, not processes,"
+            " see dreadlocks.path_lock."
+        )
 
 
 @contextmanager
@@ -11,17 +25,65 @@ def _process_level_path_lock(
     shared: bool = False,
     blocking: bool = True,
     reentrant: bool = False,
+    deadline: Optional[float] = None,
+    start: int = 0,
+    end: int = END,
 ):
-    with fd_ref(normalized_path) as fd:
-        with process_level_lock(fd, shared, blocking, reentrant):
+    with ExitStack() as stack:
+        fd = stack.enter_context(fd_ref(normalized_path))
+        try:
+            stack.enter_context(
+                process_level_lock(
+                    fd, shared, blocking, reentrant, deadline, start, end
+                )
+            )
+        except AcquiringProcessLevelLockTimedOutError as error:
+            # NOTE: An abandoned kernel request may still refer to fd.
+            error.defer(stack.pop_all().close)
+            raise
+        yield fd
+
+
+@asynccontextmanager
+async def _aprocess_level_path_lock(
+    normalized_path: str,
+    shared: bool = False,
+    blocking: bool = True,
+    reentrant: bool = False,
+    deadline: Optional[float] = None,
+    start: int = 0,
+    end: int = END,
+):
+    owner = current_task()
+    with ExitStack() as stack:
+        fd = stack.enter_context(fd_ref(normalized_path))
+        ref = stack.enter_context(process_level_lock_ref(fd))
+        try:
+            await ref.aacquire(shared, blocking, reentrant, deadline, owner, start, end)
+        except BaseException:
+            # NOTE: Abandoned kernel requests may still refer to ref and fd.
+            ref.defer(stack.pop_all().close)
+            raise
+        try:
             yield fd
+        finally:
+            ref.release(shared, owner, start, end)
 
 
 def process_level_path_lock(
-    path: str, shared: bool = False, blocking: bool = True, reentrant: bool = False
+    path: str,
+    shared: bool = False,
+    blocking: bool = True,
+    reentrant: bool = False,
+    timeout: Optional[float] = None,
+    start: int = 0,
+    length: int = 0,
 ):
     """Locks a path at the process-level.
 
+    Not supported by the :code:`"broker"` backend, which grants locks to
+    threads and tasks, see :func:`dreadlocks.set_process_level_lock_backend`.
+
     Parameters
     ----------
     path
@@ -41,6 +103,48 @@ def process_level_path_lock(
     reentrant
         Whether lock acquisition is reentrant. If True, allows to lock
         recursively. Otherwise, locking recursively results in a dead-lock.
+    timeout
+        How long to wait, in seconds, if blocking. If the lock cannot be
+        acquired in time, an error is raised. If None, will block until the
+        lock is acquired. Blocking acquisitions within a
+        :func:`dreadlocks.deadline` scope never wait past that deadline.
+    start
+        The offset of the first byte of the region to lock. Regions that do not
+        overlap do not exclude each other.
+    length
+        The number of bytes of the region to lock. If zero, the default, the
+        region extends to the end of the file, however large, so that the
+        whole file is locked.
+    """
+    _check_backend()
+    normalized_path = normpath(path)
+    deadline = absolute_deadline(timeout)
+    start, end = region(start, length)
+    return _process_level_path_lock(
+        normalized_path, shared, blocking, reentrant, deadline, start, end
+    )
+
+
+def aprocess_level_path_lock(
+    path: str,
+    shared: bool = False,
+    blocking: bool = True,
+    reentrant: bool = False,
+    timeout: Optional[float] = None,
+    start: int = 0,
+    length: int = 0,
+):
+    """Locks a path at the process-level on behalf of the current asyncio task.
+
+    Asynchronous context manager counterpart of
+    :func:`dreadlocks.process_level_path_lock`. Waiting never blocks the event
+    loop. Since the kernel cannot be waited on asynchronously, all tasks
+    waiting on the same path share a single background thread.
     """
+    _check_backend()
     normalized_path = normpath(path)
-    return _process_level_path_lock(normalized_path, shared, blocking, reentrant)
+    deadline = absolute_deadline(timeout)
+    start, end = region(start, length)
+    return _aprocess_level_path_lock(
+        normalized_path, shared, blocking, reentrant, deadline, start, end
+    )
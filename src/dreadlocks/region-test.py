@@ -0,0 +1,111 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from threading import Barrier, Thread
+
+import pytest
+
+from dreadlocks import (
+    AcquiringLockWouldBlockError,
+    RecursiveDeadlockError,
+    path_lock,
+)
+from dreadlocks.platform import is_windows
+
+pytestmark = pytest.mark.skipif(
+    is_windows, reason="Region locks are not supported on Windows."
+)
+
+mp = get_context(method="spawn")
+
+
+def can_lock(path: str, shared: bool, start: int = 0, length: int = 0) -> bool:
+    try:
+        with path_lock(path, shared=shared, blocking=False, start=start, length=length):
+            return True
+    except AcquiringLockWouldBlockError:
+        return False
+
+
+def test_disjoint_regions_in_parallel(tmp_path: Path):
+    path = str(tmp_path / "lock")
+    Path(path).touch()
+    are_locked = Barrier(2, timeout=5)
+
+    def hold(start: int):
+        with path_lock(path, start=start, length=10):
+            are_locked.wait()
+
+    threads = [Thread(target=hold, args=(start,)) for start in (0, 10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not are_locked.broken
+
+
+def test_regions_across_threads_and_processes(tmp_path: Path):
+    path = str(tmp_path / "lock")
+    Path(path).touch()
+
+    with ProcessPoolExecutor(max_workers=1, mp_context=mp) as executor:
+        with path_lock(path, start=10, length=10), ThreadPoolExecutor(1) as thread:
+            assert not thread.submit(can_lock, path, False).result()
+            assert thread.submit(can_lock, path, False, 0, 10).result()
+            assert not thread.submit(can_lock, path, True, 15, 10).result()
+            assert executor.submit(can_lock, path, False, 0, 10).result()
+            assert executor.submit(can_lock, path, False, 20).result()
+            assert not executor.submit(can_lock, path, True, 19, 1).result()
+            assert not executor.submit(can_lock, path, False).result()
+        assert executor.submit(can_lock, path, False).result()
+
+
+def test_overlapping_shared_regions_release_independently(tmp_path: Path):
+    path = str(tmp_path / "lock")
+    Path(path).touch()
+    are_locked = Barrier(3)
+    first_done = Barrier(2)
+    second_done = Barrier(2)
+
+    def hold(start: int, done: Barrier):
+        with path_lock(path, shared=True, start=start, length=10):
+            are_locked.wait()
+            done.wait()
+
+    threads = [
+        Thread(target=hold, args=(start, done))
+        for start, done in ((0, first_done), (5, second_done))
+    ]
+    for thread in threads:
+        thread.start()
+
+    with ProcessPoolExecutor(max_workers=1, mp_context=mp) as executor:
+        are_locked.wait()
+        assert executor.submit(can_lock, path, True).result()
+        first_done.wait()
+        threads[0].join()
+        assert executor.submit(can_lock, path, False, 0, 5).result()
+        # NOTE: The second thread still holds the overlap.
+        assert not executor.submit(can_lock, path, False, 5, 5).result()
+        second_done.wait()
+        threads[1].join()
+        assert executor.submit(can_lock, path, False).result()
+
+
+def test_overlapping_regions_are_recursive(tmp_path: Path):
+    path = str(tmp_path / "lock")
+    Path(path).touch()
+    with path_lock(path, start=0, length=10):
+        with path_lock(path, start=10, length=10):
+            pass
+        with pytest.raises(RecursiveDeadlockError):
+            with path_lock(path, start=5, length=10):
+                pass
+        with path_lock(path, start=5, length=10, reentrant=True):
+            pass
+
+
+def test_negative_region(tmp_path: Path):
+    with pytest.raises(ValueError):
+        with path_lock(str(tmp_path / "lock"), start=-1):
+            pass
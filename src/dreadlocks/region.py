@@ -0,0 +1,267 @@
+from bisect import bisect_left, bisect_right, insort
+from itertools import count
+from typing import Callable, Hashable, Iterator, NamedTuple
+
+END = 2**63 - 1
+"""The end of regions that extend to the end of the file, however large"""
+
+WHOLE = (0, END)
+
+INTENT = (END, END + 1)
+"""The byte past the end of all regions, which holders of upgradable locks
+lock exclusively, so that they exclude each other but not shared holders"""
+
+
+def region(start: int = 0, length: int = 0) -> tuple[int, int]:
+    """Converts a :code:`lockf`-style region to a half-open interval.
+
+    A length of zero means up to the end of the file, however large.
+
+    Examples
+    --------
+    >>> region()
+    (0, 9223372036854775807)
+    >>> region(10, 5)
+    (10, 15)
+
+    """
+    if start < 0 or length < 0:
+        raise ValueError("Regions cannot have a negative start or length.")
+    return (start, start + length if length else END)
+
+
+def overlap(a: tuple[int, int], b: tuple[int, int]) -> bool:
+    return a[0] < b[1] and b[0] < a[1]
+
+
+class Hold(NamedTuple):
+    start: int
+    end: int
+    seq: int
+    owner: Hashable
+    shared: bool
+
+
+class Regions:
+    """Regions held by owners, sorted by start, so that holds overlapping a
+    given region are found without scanning all holds.
+
+    Examples
+    --------
+    >>> regions = Regions()
+    >>> hold = regions.add(0, 10, "a", True)
+    >>> _ = regions.add(20, 30, "b", False)
+    >>> [h.owner for h in regions.overlapping(5, 25)]
+    ['b', 'a']
+    >>> regions.remove(hold)
+    >>> [h.owner for h in regions.overlapping(5, 25)]
+    ['b']
+
+    """
+
+    def __init__(self):
+        self._holds: list[Hold] = []
+        self._seq = count()
+        # NOTE: No hold is longer than this, which bounds backward scans.
+        self._max_length = 0
+
+    def __bool__(self) -> bool:
+        return bool(self._holds)
+
+    def add(self, start: int, end: int, owner: Hashable, shared: bool) -> Hold:
+        hold = Hold(start, end, next(self._seq), owner, shared)
+        insort(self._holds, hold)
+        self._max_length = max(self._max_length, end - start)
+        return hold
+
+    def remove(self, hold: Hold) -> None:
+        del self._holds[bisect_left(self._holds, hold)]
+        if not self._holds:
+            self._max_length = 0
+
+    def find(self, start: int, end: int, owner: Hashable, shared: bool) -> Hold:
+        """Finds a hold of owner on exactly that region"""
+        for i in range(bisect_left(self._holds, (start, end)), len(self._holds)):
+            hold = self._holds[i]
+            if (hold.start, hold.end) != (start, end):
+                break
+            if hold.owner == owner and hold.shared == shared:
+                return hold
+        raise KeyError((start, end, owner, shared))
+
+    def overlapping(self, start: int, end: int) -> Iterator[Hold]:
+        """Yields holds overlapping the region, by decreasing start"""
+        for i in range(bisect_left(self._holds, (end,)) - 1, -1, -1):
+            hold = self._holds[i]
+            if hold.start + self._max_length <= start:
+                break
+            if hold.end > start:
+                yield hold
+
+
+_LIMIT = INTENT[1]
+
+NONE = 0
+SHARED = 1
+EXCLUSIVE = 2
+
+
+class Segments:
+    """Counts shared and exclusive holds of byte ranges, to tell which ranges
+    the kernel lock of a file must change.
+
+    Kernel byte-range locks of a process (or an open file description) merge
+    and split: unlocking a range unlocks it whatever was locked before, and
+    locking a range shared downgrades whatever part of it was exclusive. We
+    thus only ever lock ranges where the mode must go up, and unlock or
+    downgrade ranges where it must go down.
+
+    Examples
+    --------
+    >>> segments = Segments()
+    >>> segments.missing(0, 10, shared=True)
+    [(0, 10, 0)]
+    >>> segments.add(0, 10, shared=True)
+    >>> segments.missing(5, 15, shared=False)
+    [(5, 10, 1), (10, 15, 0)]
+    >>> segments.add(5, 15, shared=False)
+    >>> segments.modes(0, 20)
+    [(0, 5, 1), (5, 15, 2), (15, 20, 0)]
+    >>> segments.remove(0, 10, shared=True)
+    [(0, 5, 0)]
+    >>> segments.remove(5, 15, shared=False)
+    [(5, 15, 0)]
+
+    """
+
+    def __init__(self, exclusive_only: bool = False):
+        # NOTE: Segment i spans from _starts[i] to _starts[i + 1], or past
+        # INTENT.
+        self._starts = [0]
+        self._shared = [0]
+        self._exclusive = [0]
+        # NOTE: Shared locks are simulated by exclusive ones on Windows.
+        self._exclusive_only = exclusive_only
+
+    def __bool__(self) -> bool:
+        return len(self._starts) > 1 or bool(self._shared[0] or self._exclusive[0])
+
+    def clear(self) -> None:
+        """Forgets all holds, once the last one is removed"""
+        self._starts = [0]
+        self._shared = [0]
+        self._exclusive = [0]
+
+    def missing(self, start: int, end: int, shared: bool) -> list[tuple[int, int, int]]:
+        """Ranges within the region where the mode must go up for a new hold,
+        with their current mode"""
+        wanted = self._mode(int(shared), int(not shared))
+        if len(self._starts) == 1:
+            # NOTE: Fast path, all bytes are in the same mode.
+            mode = self._mode_of(0)
+            return [(start, end, mode)] if mode < wanted else []
+        return self._ranges(start, end, lambda i: self._mode_of(i) < wanted)
+
+    def modes(self, start: int, end: int) -> list[tuple[int, int, int]]:
+        """Ranges within the region, with their current mode"""
+        return self._ranges(start, end, lambda i: True)
+
+    def add(self, start: int, end: int, shared: bool) -> None:
+        counts = self._shared if shared else self._exclusive
+        for i in range(self._split(start), self._split(end)):
+            counts[i] += 1
+
+    def remove(self, start: int, end: int, shared: bool) -> list[tuple[int, int, int]]:
+        """Removes a hold. Returns ranges where the mode went down, with their
+        new mode."""
+        counts = self._shared if shared else self._exclusive
+        i = bisect_right(self._starts, start) - 1
+        if self._starts[i] == start and self._end_of(i) == end:
+            # NOTE: Fast path, the region is a single segment, such as a whole
+            # file held alone.
+            before = self._mode_of(i)
+            counts[i] -= 1
+            mode = self._mode_of(i)
+            self._merge(i, i + 1)
+            return [(start, end, mode)] if mode < before else []
+        first, last = self._split(start), self._split(end)
+        before = [self._mode_of(i) for i in range(first, last)]
+        for i in range(first, last):
+            counts[i] -= 1
+        changed = self._ranges(
+            start, end, lambda i: self._mode_of(i) < before[i - first]
+        )
+        self._merge(first, last)
+        return changed
+
+    def _mode(self, shared: int, exclusive: int) -> int:
+        if exclusive or (shared and self._exclusive_only):
+            return EXCLUSIVE
+        return SHARED if shared else NONE
+
+    def _mode_of(self, i: int) -> int:
+        return self._mode(self._shared[i], self._exclusive[i])
+
+    def _end_of(self, i: int) -> int:
+        return self._starts[i + 1] if i + 1 < len(self._starts) else _LIMIT
+
+    def _split(self, at: int) -> int:
+        """Makes a segment start at the given offset, returns its index"""
+        if at >= _LIMIT:
+            return len(self._starts)
+        i = bisect_right(self._starts, at) - 1
+        if self._starts[i] == at:
+            return i
+        self._starts.insert(i + 1, at)
+        self._shared.insert(i + 1, self._shared[i])
+        self._exclusive.insert(i + 1, self._exclusive[i])
+        return i + 1
+
+    def _merge(self, first: int, last: int):
+        """Merges segments with equal counts around the given ones"""
+        for i in range(min(last, len(self._starts) - 1), max(first, 1) - 1, -1):
+            if (self._shared[i], self._exclusive[i]) == (
+                self._shared[i - 1],
+                self._exclusive[i - 1],
+            ):
+                del self._starts[i]
+                del self._shared[i]
+                del self._exclusive[i]
+
+    def _ranges(
+        self, start: int, end: int, predicate: Callable[[int], bool]
+    ) -> list[tuple[int, int, int]]:
+        """Coalesced ranges of the region made of segments satisfying the
+        predicate, with the mode of their segments"""
+        ranges: list[tuple[int, int, int]] = []
+        i = bisect_right(self._starts, start) - 1
+        while i < len(self._starts) and self._starts[i] < end:
+            if predicate(i):
+                mode = self._mode_of(i)
+                lo, hi = max(self._starts[i], start), min(self._end_of(i), end)
+                if ranges and ranges[-1][1] == lo and ranges[-1][2] == mode:
+                    ranges[-1] = (ranges[-1][0], hi, mode)
+                else:
+                    ranges.append((lo, hi, mode))
+            i += 1
+        return ranges
+
+
+def span(start: int, end: int) -> tuple[int, int]:
+    """Converts a half-open interval back to a :code:`lockf`-style region
+
+    Whole-file regions stop right before :data:`INTENT`, rather than having a
+    length of zero, which would extend past it. They still exclude locks of
+    other programs on the whole file, whose length is zero.
+
+    Examples
+    --------
+    >>> span(*region(10, 5))
+    (10, 5)
+    >>> span(*WHOLE)
+    (0, 9223372036854775807)
+    >>> span(*INTENT)
+    (9223372036854775807, 1)
+
+    """
+    return (start, end - start)
@@ -0,0 +1,81 @@
+from threading import Thread
+from time import sleep
+
+import pytest
+
+from dreadlocks import AcquiringThreadLevelLockWouldBlockError
+from dreadlocks.thread import Policy, ShareableThreadLock
+
+
+def acquire_in_thread(
+    lock: ShareableThreadLock, owner: str, shared: bool, order: list[str]
+) -> Thread:
+    def target():
+        lock.acquire(shared=shared, owner=owner)
+        order.append(owner)
+        lock.release(shared=shared, owner=owner)
+
+    thread = Thread(target=target)
+    thread.start()
+    # NOTE: Give the thread time to start waiting.
+    sleep(0.05)
+    return thread
+
+
+@pytest.mark.parametrize(
+    "policy, overtakes", (("reader", True), ("writer", False), ("fair", False))
+)
+def test_readers_overtake_waiting_writer(policy: Policy, overtakes: bool):
+    lock = ShareableThreadLock(policy)
+    order: list[str] = []
+    lock.acquire(shared=True, owner="r1")
+    writer = acquire_in_thread(lock, "w", False, order)
+
+    if overtakes:
+        lock.acquire(shared=True, blocking=False, owner="r2")
+        lock.release(shared=True, owner="r2")
+    else:
+        with pytest.raises(AcquiringThreadLevelLockWouldBlockError):
+            lock.acquire(shared=True, blocking=False, owner="r2")
+
+    # NOTE: Holders never wait on waiters, otherwise this would dead-lock.
+    lock.acquire(shared=True, blocking=False, reentrant=True, owner="r1")
+    lock.release(shared=True, owner="r1")
+    lock.acquire(shared=False, blocking=False, reentrant=True, owner="r1")
+    lock.release(shared=False, owner="r1")
+
+    lock.release(shared=True, owner="r1")
+    writer.join()
+    assert order == ["w"]
+
+
+@pytest.mark.parametrize(
+    "policy, expected",
+    (
+        ("writer", [{"w1"}, {"w2"}, {"r1", "r2"}]),
+        ("fair", [{"r1"}, {"w1"}, {"r2"}, {"w2"}]),
+    ),
+)
+def test_waiters_order(policy: Policy, expected: list[set[str]]):
+    lock = ShareableThreadLock(policy)
+    order: list[str] = []
+    lock.acquire(shared=False, owner="holder")
+    waiters = [
+        acquire_in_thread(lock, owner, owner.startswith("r"), order)
+        for owner in ("r1", "w1", "r2", "w2")
+    ]
+    lock.release(shared=False, owner="holder")
+    for waiter in waiters:
+        waiter.join()
+
+    # NOTE: Shared waiters granted together may append in any order.
+    groups: list[set[str]] = []
+    for group in expected:
+        groups.append(set(order[: len(group)]))
+        order = order[len(group) :]
+    assert groups == expected
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        ShareableThreadLock("unknown")  # type: ignore [reportArgumentType]
@@ -1,13 +1,113 @@
-from collections import Counter
-from contextlib import contextmanager
-from threading import Condition, RLock, get_ident
+from asyncio import (
+    AbstractEventLoop,
+    CancelledError,
+    Future as AsyncFuture,
+    TimeoutError as AsyncTimeoutError,
+    current_task,
+    get_running_loop,
+    wait_for,
+)
+from collections import Counter, deque
+from contextlib import asynccontextmanager, contextmanager
+from threading import Lock, get_ident
+from functools import partial
+from typing import Hashable, Literal, Optional
 
-from .errors import AcquiringThreadLevelLockWouldBlockError, RecursiveDeadlockError
+from . import deadlock, hooks
+from .deadline import remaining
+from .hooks import OnWait
+from .region import END, WHOLE, Regions, overlap
+from .errors import (
+    AcquiringThreadLevelLockTimedOutError,
+    AcquiringThreadLevelLockWouldBlockError,
+    RecursiveDeadlockError,
+)
+
+
+Policy = Literal["reader", "writer", "fair"]
+"""How a :class:`ShareableThreadLock` arbitrates between waiting owners:
+
+- :code:`"reader"`: shared acquisitions never wait on exclusive waiters, which
+  maximizes throughput under read-heavy load but can starve writers,
+- :code:`"writer"`: shared acquisitions wait while an exclusive acquisition is
+  waiting, which can starve readers under write-heavy load,
+- :code:`"fair"`: acquisitions are granted in arrival order, consecutive shared
+  acquisitions being granted together (phase-fair), so that nobody starves.
+
+In all cases, owners that already hold the lock never wait on other waiters,
+otherwise reentrant acquisitions would dead-lock.
+"""
+
+policies: tuple[Policy, ...] = ("reader", "writer", "fair")
+
+
+class _Waiter:
+    """A pending acquisition, woken up individually once it has been granted"""
+
+    def __init__(self, owner: Hashable, shared: bool, region: tuple[int, int]):
+        self.owner = owner
+        self.shared = shared
+        self.region = region
+        self.granted = False
+
+    def wake(self) -> None:
+        raise NotImplementedError
+
+
+class _ThreadWaiter(_Waiter):
+    def __init__(self, owner: Hashable, shared: bool, region: tuple[int, int]):
+        super().__init__(owner, shared, region)
+        self._lock = Lock()
+        self._lock.acquire()
+
+    def wake(self):
+        self._lock.release()
+
+    def wait(self, timeout: Optional[float]) -> bool:
+        return self._lock.acquire(timeout=-1 if timeout is None else timeout)
+
+
+def _resolve(future: "AsyncFuture[None]"):
+    if not future.done():
+        future.set_result(None)
+
+
+class _TaskWaiter(_Waiter):
+    def __init__(
+        self,
+        owner: Hashable,
+        shared: bool,
+        region: tuple[int, int],
+        loop: AbstractEventLoop,
+    ):
+        super().__init__(owner, shared, region)
+        self._loop = loop
+        self.future: AsyncFuture[None] = loop.create_future()
+
+    def wake(self):
+        try:
+            self._loop.call_soon_threadsafe(_resolve, self.future)
+        except RuntimeError:
+            # NOTE: The loop is closed, nobody is waiting anymore.
+            pass
 
 
 class ShareableThreadLock:
-    def __init__(self):
-        """
+    def __init__(self, policy: Policy = "reader", key: Hashable = None):
+        """A readers-writer lock shared by the threads and asyncio tasks of a
+        process, arbitrating between waiters according to the given
+        :data:`Policy`. The key is what hooks are told the lock is about, see
+        :func:`dreadlocks.set_lock_hooks`.
+
+        Owners are threads when locking synchronously, and asyncio tasks when
+        locking asynchronously, so that two tasks running on the same thread
+        are told apart. The internal mutex is only held for bookkeeping. Each
+        waiter is woken up individually once it has been granted the lock.
+
+        Owners can also lock byte regions from start to end, which conflict
+        only if they overlap. Whole-file acquisitions, the default, are kept
+        track of separately since they overlap everything.
+
         Examples
         --------
         >>> lock = ShareableThreadLock()
@@ -18,83 +118,484 @@ class ShareableThreadLock:
         2
 
         """
-        self._condition = Condition(RLock())
-        self._acquired_by: Counter[int] = Counter()
+        self._mutex = Lock()
+        self._acquired_by: Counter[Hashable] = Counter()
+        self._exclusively_acquired_by: Counter[Hashable] = Counter()
+        self._regions = Regions()
+        self._region_holders: Counter[Hashable] = Counter()
+        self._exclusive_region_holders: Counter[Hashable] = Counter()
+        self._waiters: deque[_Waiter] = deque()
+        self._exclusive_waiters = 0
+        self._region_waiters = 0
+        if policy not in policies:
+            raise ValueError(f"Unknown policy {policy!r}.")
+        self._policy: Policy = policy
+        self.key = key
+        self._intent: Optional[ShareableThreadLock] = None
 
+    @contextmanager
     def lock(
-        self, shared: bool = False, blocking: bool = True, reentrant: bool = False
+        self,
+        shared: bool = False,
+        blocking: bool = True,
+        reentrant: bool = False,
+        deadline: Optional[float] = None,
+        start: int = 0,
+        end: int = END,
+    ):
+        owner = get_ident()
+        self.acquire(shared, blocking, reentrant, deadline, owner, start, end)
+        try:
+            yield
+        finally:
+            self.release(shared, owner, start, end)
+
+    @asynccontextmanager
+    async def alock(
+        self,
+        shared: bool = False,
+        blocking: bool = True,
+        reentrant: bool = False,
+        deadline: Optional[float] = None,
+        start: int = 0,
+        end: int = END,
+    ):
+        owner = current_task()
+        await self.aacquire(shared, blocking, reentrant, deadline, owner, start, end)
+        try:
+            yield
+        finally:
+            self.release(shared, owner, start, end)
+
+    def acquire(
+        self,
+        shared: bool = False,
+        blocking: bool = True,
+        reentrant: bool = False,
+        deadline: Optional[float] = None,
+        owner: Optional[Hashable] = None,
+        start: int = 0,
+        end: int = END,
+    ) -> None:
+        if owner is None:
+            owner = get_ident()
+        observer = hooks.current
+        if observer is None:
+            self._acquire(shared, blocking, reentrant, deadline, owner, (start, end))
+            return
+        hooks.observe(
+            observer,
+            "thread",
+            self.key,
+            owner,
+            shared,
+            partial(
+                self._acquire,
+                shared,
+                blocking,
+                reentrant,
+                deadline,
+                owner,
+                (start, end),
+            ),
+        )
+
+    async def aacquire(
+        self,
+        shared: bool = False,
+        blocking: bool = True,
+        reentrant: bool = False,
+        deadline: Optional[float] = None,
+        owner: Optional[Hashable] = None,
+        start: int = 0,
+        end: int = END,
+    ) -> None:
+        if owner is None:
+            owner = current_task()
+        observer = hooks.current
+        if observer is None:
+            await self._aacquire(
+                shared, blocking, reentrant, deadline, owner, (start, end)
+            )
+            return
+        await hooks.aobserve(
+            observer,
+            "thread",
+            self.key,
+            owner,
+            shared,
+            partial(
+                self._aacquire,
+                shared,
+                blocking,
+                reentrant,
+                deadline,
+                owner,
+                (start, end),
+            ),
+        )
+
+    def release(
+        self,
+        shared: bool = False,
+        owner: Optional[Hashable] = None,
+        start: int = 0,
+        end: int = END,
+    ):
+        if owner is None:
+            owner = get_ident()
+        self._release(shared, owner, start, end)
+        observer = hooks.current
+        if observer is not None:
+            observer.on_release("thread", self.key, owner, shared)
+
+    def try_acquire(
+        self,
+        shared: bool = False,
+        owner: Optional[Hashable] = None,
+        start: int = 0,
+        end: int = END,
+    ) -> bool:
+        """Acquires the lock if that needs no waiting, without raising
+        otherwise. Owners that already hold part of the region do not acquire
+        it again."""
+        if owner is None:
+            owner = get_ident()
+        region = (start, end)
+        with self._mutex:
+            if (
+                self._holds(owner, region)
+                or not self._can_acquire(owner, shared, region)
+                or not self._can_overtake(owner, shared, region)
+            ):
+                return False
+            self._grant(owner, shared, region)
+        observer = hooks.current
+        if observer is not None:
+            observer.on_acquire("thread", self.key, owner, shared, False, 0.0)
+        return True
+
+    @property
+    def intent(self) -> "ShareableThreadLock":
+        """A companion lock that owners hold exclusively on top of a shared
+        hold to make it upgradable.
+
+        Holders of upgradable locks exclude each other but not shared holders,
+        so that at most one owner upgrades at a time. Two owners upgrading
+        shared holds of the same region otherwise dead-lock, each waiting for
+        the other to release its shared hold.
+        """
+        intent = self._intent
+        if intent is None:
+            with self._mutex:
+                if self._intent is None:
+                    self._intent = ShareableThreadLock(
+                        self._policy, (self.key, "intent")
+                    )
+                intent = self._intent
+        return intent
+
+    def upgrade(
+        self,
+        blocking: bool = True,
+        deadline: Optional[float] = None,
+        owner: Optional[Hashable] = None,
+        start: int = 0,
+        end: int = END,
+    ) -> None:
+        """Turns a shared hold of owner into an exclusive one, waiting for
+        other owners to release the region. If that fails, the shared hold is
+        kept. See :attr:`intent`."""
+        if owner is None:
+            owner = get_ident()
+        self.acquire(False, blocking, True, deadline, owner, start, end)
+        self.release(True, owner, start, end)
+
+    def downgrade(
+        self, owner: Optional[Hashable] = None, start: int = 0, end: int = END
+    ) -> None:
+        """Turns an exclusive hold of owner into a shared one, which never
+        waits"""
+        if owner is None:
+            owner = get_ident()
+        self.acquire(True, False, True, None, owner, start, end)
+        self.release(False, owner, start, end)
+
+    def _release(self, shared: bool, owner: Hashable, start: int, end: int):
+        with self._mutex:
+            if (start, end) == WHOLE:
+                self._acquired_by[owner] -= 1
+                if not self._acquired_by[owner]:
+                    del self._acquired_by[owner]  # NOTE: GC
+                if not shared:
+                    self._exclusively_acquired_by[owner] -= 1
+                    if not self._exclusively_acquired_by[owner]:
+                        del self._exclusively_acquired_by[owner]  # NOTE: GC
+            else:
+                self._regions.remove(self._regions.find(start, end, owner, shared))
+                self._region_holders[owner] -= 1
+                if not self._region_holders[owner]:
+                    del self._region_holders[owner]  # NOTE: GC
+                if not shared:
+                    self._exclusive_region_holders[owner] -= 1
+                    if not self._exclusive_region_holders[owner]:
+                        del self._exclusive_region_holders[owner]  # NOTE: GC
+            detector = deadlock.current
+            if detector is not None:
+                detector.released(owner, self.key, shared, (start, end))
+            self._grant_waiters()
+
+    def _acquire(
+        self,
+        shared: bool,
+        blocking: bool,
+        reentrant: bool,
+        deadline: Optional[float],
+        owner: Hashable,
+        region: tuple[int, int],
+        on_wait: OnWait = None,
     ):
+        with self._mutex:
+            if self._try_acquire(owner, shared, blocking, reentrant, region):
+                return
+            waiter = _ThreadWaiter(owner, shared, region)
+            self._enqueue(waiter)
+
+        if on_wait is not None:
+            on_wait()
+
+        if waiter.wait(remaining(deadline)) or self._abandon(waiter):
+            return
+
+        raise AcquiringThreadLevelLockTimedOutError()
+
+    async def _aacquire(
+        self,
+        shared: bool,
+        blocking: bool,
+        reentrant: bool,
+        deadline: Optional[float],
+        owner: Hashable,
+        region: tuple[int, int],
+        on_wait: OnWait = None,
+    ):
+        with self._mutex:
+            if self._try_acquire(owner, shared, blocking, reentrant, region):
+                return
+            waiter = _TaskWaiter(owner, shared, region, get_running_loop())
+            self._enqueue(waiter)
+
+        if on_wait is not None:
+            on_wait()
+
+        try:
+            await wait_for(waiter.future, remaining(deadline))
+        except AsyncTimeoutError:
+            if self._abandon(waiter):
+                return
+            raise AcquiringThreadLevelLockTimedOutError() from None
+        except CancelledError:
+            if self._abandon(waiter):
+                self._release(shared, owner, *region)
+            raise
+
+    def _try_acquire(
+        self,
+        owner: Hashable,
+        shared: bool,
+        blocking: bool,
+        reentrant: bool,
+        region: tuple[int, int],
+    ) -> bool:
+        """Acquires the lock if possible, with self._mutex held.
+
+        Returns False if the caller must wait.
+        """
+        if not reentrant and self._holds(owner, region):
+            raise RecursiveDeadlockError()
+
+        detector = deadlock.current
+        if detector is not None and blocking:
+            detector.check_order(owner, self.key)
+
+        if self._can_acquire(owner, shared, region) and self._can_overtake(
+            owner, shared, region
+        ):
+            self._grant(owner, shared, region)
+            return True
+
+        if not blocking:
+            raise AcquiringThreadLevelLockWouldBlockError()
+
+        return False
+
+    def _holds(self, owner: Hashable, region: tuple[int, int]) -> bool:
+        """Whether owner holds any part of region"""
+        if self._acquired_by[owner]:
+            return True
+        if not self._region_holders[owner]:
+            return False
+        return region == WHOLE or any(
+            hold.owner == owner for hold in self._regions.overlapping(*region)
+        )
+
+    def _can_acquire(
+        self, owner: Hashable, shared: bool, region: tuple[int, int]
+    ) -> bool:
         if shared:
-            return self._lock_sh(blocking=blocking, reentrant=reentrant)
+            # NOTE: Any number of owners can share the lock, as long as nobody
+            # else holds it exclusively.
+            if _others(self._exclusively_acquired_by, owner):
+                return False
+            if region == WHOLE:
+                return not _others(self._exclusive_region_holders, owner)
+            return not any(
+                not hold.shared and hold.owner != owner
+                for hold in self._regions.overlapping(*region)
+            )
         else:
-            return self._lock_ex(blocking=blocking, reentrant=reentrant)
+            # NOTE: An owner can hold the lock exclusively as long as nobody
+            # else holds it, whatever it already holds itself.
+            if _others(self._acquired_by, owner):
+                return False
+            if region == WHOLE:
+                return not _others(self._region_holders, owner)
+            return not any(
+                hold.owner != owner for hold in self._regions.overlapping(*region)
+            )
 
-    @contextmanager
-    def _lock_sh(self, blocking: bool = True, reentrant: bool = False):
-        thread_id = get_ident()
-        if self._condition.acquire(blocking=blocking):
-            try:
-                if not reentrant and self._acquired_by[thread_id]:
-                    raise RecursiveDeadlockError()
-                self._acquired_by[thread_id] += 1
-            finally:
-                self._condition.release()
+    def _can_overtake(
+        self, owner: Hashable, shared: bool, region: tuple[int, int]
+    ) -> bool:
+        """Whether a new acquisition can be granted before current waiters"""
+        if (
+            not self._waiters
+            or self._policy == "reader"
+            or self._acquired_by[owner]
+            or self._region_holders[owner]
+        ):
+            return True
+        if region == WHOLE and not self._region_waiters:
+            # NOTE: All waiters overlap the acquisition.
+            if self._policy == "writer":
+                return not shared or not self._exclusive_waiters
+            return False
+        overlapping = [
+            waiter for waiter in self._waiters if overlap(waiter.region, region)
+        ]
+        if self._policy == "writer":
+            return not shared or all(waiter.shared for waiter in overlapping)
+        return not overlapping
+
+    def _grant(self, owner: Hashable, shared: bool, region: tuple[int, int]):
+        if region == WHOLE:
+            self._acquired_by[owner] += 1
+            if not shared:
+                self._exclusively_acquired_by[owner] += 1
         else:
-            raise AcquiringThreadLevelLockWouldBlockError()
+            self._regions.add(*region, owner, shared)
+            self._region_holders[owner] += 1
+            if not shared:
+                self._exclusive_region_holders[owner] += 1
+        detector = deadlock.current
+        if detector is not None:
+            detector.acquired(owner, self.key, shared, region)
 
-        try:
-            yield
+    def _enqueue(self, waiter: _Waiter):
+        detector = deadlock.current
+        if detector is not None:
+            detector.wait(
+                waiter.owner, self.key, waiter.shared, waiter.region, self._policy
+            )
+        self._waiters.append(waiter)
+        if not waiter.shared:
+            self._exclusive_waiters += 1
+        if waiter.region != WHOLE:
+            self._region_waiters += 1
 
-        finally:
-            self._condition.acquire(blocking=True)
-            try:
-                self._acquired_by[thread_id] -= 1
-                if not self._acquired_by[thread_id]:
-                    del self._acquired_by[thread_id]  # NOTE: GC
-                    if not self._acquired_by:
-                        self._condition.notify_all()
-            finally:
-                self._condition.release()
+    def _dequeue(self, waiter: _Waiter):
+        if not waiter.shared:
+            self._exclusive_waiters -= 1
+        if waiter.region != WHOLE:
+            self._region_waiters -= 1
 
-    @contextmanager
-    def _lock_ex(self, blocking: bool = True, reentrant: bool = False):
-        thread_id = get_ident()
-        if self._condition.acquire(blocking=blocking):
-            acquired = False
-            try:
-                this_thread_count = Counter({thread_id: self._acquired_by[thread_id]})
-                if blocking:
-                    # NOTE: We could use self._acquired_by != this_thread_count in
-                    # Python >= 3.10
-                    while self._acquired_by - this_thread_count:
-                        self._condition.wait()
+    def _grant_waiter(self, waiter: _Waiter):
+        self._dequeue(waiter)
+        self._grant(waiter.owner, waiter.shared, waiter.region)
+        waiter.granted = True
+        waiter.wake()
+
+    def _grant_waiters(self):
+        """Grants the lock to waiters that can now acquire it, according to the
+        policy, with self._mutex held.
+        """
+        if not self._waiters or self._exclusively_acquired_by:
+            return
+
+        if self._policy == "fair" and not self._region_waiters:
+            # NOTE: We grant waiters in arrival order, stopping at the first
+            # one that cannot acquire the lock.
+            while self._waiters and self._can_acquire(
+                self._waiters[0].owner, self._waiters[0].shared, WHOLE
+            ):
+                self._grant_waiter(self._waiters.popleft())
+            return
+
+        waiters = self._waiters
+        self._waiters = deque()
+
+        if self._policy == "fair":
+            # NOTE: We grant waiters in arrival order, each waiter waiting on
+            # earlier waiters it overlaps.
+            for waiter in waiters:
+                if not any(
+                    overlap(earlier.region, waiter.region) for earlier in self._waiters
+                ) and self._can_acquire(waiter.owner, waiter.shared, waiter.region):
+                    self._grant_waiter(waiter)
                 else:
-                    # NOTE: We could use self._acquired_by != this_thread_count in
-                    # Python >= 3.10
-                    if self._acquired_by - this_thread_count:
-                        raise AcquiringThreadLevelLockWouldBlockError()
-
-                # NOTE: The following check also works for Python < 3.10 because we
-                # systematically get rid of zero-count entries.
-                if self._acquired_by:
-                    # NOTE: The following two checks can be replaced by
-                    # assert self._acquired_by == this_thread_count
-                    # in Python >= 3.10
-                    assert len(self._acquired_by) == 1
-                    assert self._acquired_by[thread_id] == this_thread_count[thread_id]
-                    if not reentrant:
-                        raise RecursiveDeadlockError()
-
-                acquired = True
-                self._acquired_by[thread_id] += 1
-
-                yield
-
-            finally:
-                if acquired:
-                    self._acquired_by[thread_id] -= 1
-                    if not self._acquired_by[thread_id]:
-                        del self._acquired_by[thread_id]  # NOTE: GC
-                self._condition.release()
-        else:
-            raise AcquiringThreadLevelLockWouldBlockError()
+                    self._waiters.append(waiter)
+            return
+
+        # NOTE: With the writer policy, exclusive waiters get a first pass.
+        # Shared waiters only get a pass if no exclusive waiter they overlap is
+        # left.
+        passes = (False, True) if self._policy == "writer" else (None,)
+        for shared in passes:
+            exclusive_waiters: list[_Waiter] = []
+            if shared and self._exclusive_waiters:
+                if not self._region_waiters:
+                    break
+                exclusive_waiters = [
+                    waiter
+                    for waiter in waiters
+                    if not waiter.shared and not waiter.granted
+                ]
+            for waiter in waiters:
+                if waiter.granted or (shared is not None and waiter.shared != shared):
+                    continue
+                if any(
+                    overlap(exclusive.region, waiter.region)
+                    for exclusive in exclusive_waiters
+                ):
+                    continue
+                if self._can_acquire(waiter.owner, waiter.shared, waiter.region):
+                    self._grant_waiter(waiter)
+        self._waiters.extend(waiter for waiter in waiters if not waiter.granted)
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Stops waiting. Returns True if the lock was granted in the meantime."""
+        with self._mutex:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            self._dequeue(waiter)
+            detector = deadlock.current
+            if detector is not None:
+                detector.stop_waiting(waiter.owner)
+            self._grant_waiters()
+            return False
+
+
+def _others(counter: "Counter[Hashable]", owner: Hashable) -> bool:
+    """Whether owners other than owner are counted"""
+    return len(counter) > 1 or (bool(counter) and owner not in counter)
@@ -1,12 +1,35 @@
-from contextlib import contextmanager
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
 
 from .globals import thread_level_lock_ref
+from .region import END
 
 
 @contextmanager
 def thread_level_lock(
-    key: str, shared: bool = False, blocking: bool = True, reentrant: bool = False
+    key: str,
+    shared: bool = False,
+    blocking: bool = True,
+    reentrant: bool = False,
+    deadline: Optional[float] = None,
+    start: int = 0,
+    end: int = END,
 ):
     with thread_level_lock_ref(key) as ref:
-        with ref.lock(shared, blocking, reentrant):
+        with ref.lock(shared, blocking, reentrant, deadline, start, end):
+            yield
+
+
+@asynccontextmanager
+async def athread_level_lock(
+    key: str,
+    shared: bool = False,
+    blocking: bool = True,
+    reentrant: bool = False,
+    deadline: Optional[float] = None,
+    start: int = 0,
+    end: int = END,
+):
+    with thread_level_lock_ref(key) as ref:
+        async with ref.alock(shared, blocking, reentrant, deadline, start, end):
             yield
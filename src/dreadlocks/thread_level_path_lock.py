@@ -1,10 +1,19 @@
 from os.path import normpath
+from typing import Optional
 
-from .thread_level_lock import thread_level_lock
+from .deadline import absolute_deadline
+from .region import region
+from .thread_level_lock import athread_level_lock, thread_level_lock
 
 
 def thread_level_path_lock(
-    path: str, shared: bool = False, blocking: bool = True, reentrant: bool = False
+    path: str,
+    shared: bool = False,
+    blocking: bool = True,
+    reentrant: bool = False,
+    timeout: Optional[float] = None,
+    start: int = 0,
+    length: int = 0,
 ):
     """Locks a key at the thread-level.
 
@@ -25,6 +34,46 @@ def thread_level_path_lock(
     reentrant
         Whether lock acquisition is reentrant. If True, allows to lock
         recursively. Otherwise, locking recursively results in a dead-lock.
+    timeout
+        How long to wait, in seconds, if blocking. If the lock cannot be
+        acquired in time, an error is raised. If None, will block until the
+        lock is acquired. Blocking acquisitions within a
+        :func:`dreadlocks.deadline` scope never wait past that deadline.
+    start
+        The offset of the first byte of the region to lock. Regions that do not
+        overlap do not exclude each other.
+    length
+        The number of bytes of the region to lock. If zero, the default, the
+        region extends to the end of the file, however large, so that the
+        whole file is locked.
     """
     normalized_path = normpath(path)
-    return thread_level_lock(normalized_path, shared, blocking, reentrant)
+    deadline = absolute_deadline(timeout)
+    start, end = region(start, length)
+    return thread_level_lock(
+        normalized_path, shared, blocking, reentrant, deadline, start, end
+    )
+
+
+def athread_level_path_lock(
+    path: str,
+    shared: bool = False,
+    blocking: bool = True,
+    reentrant: bool = False,
+    timeout: Optional[float] = None,
+    start: int = 0,
+    length: int = 0,
+):
+    """Locks a key at the thread-level on behalf of the current asyncio task.
+
+    Asynchronous context manager counterpart of
+    :func:`dreadlocks.thread_level_path_lock`. The lock is owned by the current
+    task, not by the thread running the event loop, and waiting never blocks
+    the event loop.
+    """
+    normalized_path = normpath(path)
+    deadline = absolute_deadline(timeout)
+    start, end = region(start, length)
+    return athread_level_lock(
+        normalized_path, shared, blocking, reentrant, deadline, start, end
+    )
@@ -0,0 +1,45 @@
+from collections import deque
+from concurrent.futures import Future
+from threading import Lock, Thread
+from typing import Any, Callable
+
+
+class Waiter:
+    """Runs blocking calls one at a time in a daemon thread spawned on demand
+
+    Daemon threads are used so that a kernel request that never resolves does
+    not prevent the interpreter from exiting.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._lock = Lock()
+        self._queue: deque[tuple[Future[Any], Callable[[], Any]]] = deque()
+        self._running = False
+
+    def submit(self, fn: Callable[[], Any]) -> "Future[Any]":
+        future: Future[Any] = Future()
+        with self._lock:
+            self._queue.append((future, fn))
+            if not self._running:
+                self._running = True
+                Thread(target=self._run, name=self._name, daemon=True).start()
+        return future
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._queue:
+                    self._running = False
+                    return
+                future, fn = self._queue.popleft()
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                result = fn()
+            except BaseException as error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
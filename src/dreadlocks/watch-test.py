@@ -0,0 +1,75 @@
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from time import monotonic, sleep
+
+import pytest
+
+from dreadlocks import await_for_change, generation_lock, wait_for_change
+from dreadlocks import watch
+
+mp = get_context(method="spawn")
+
+
+def write(path: str, delay: float):
+    sleep(delay)
+    with generation_lock(path) as lock:
+        lock.mark_dirty()
+
+
+def read(path: str) -> int:
+    with generation_lock(path, shared=True) as lock:
+        return lock.generation
+
+
+@pytest.fixture
+def path(tmp_path: Path) -> str:
+    path = tmp_path / "data"
+    path.touch()
+    return str(path)
+
+
+def test_waiters_wake_up_on_change(path: str):
+    before = read(path)
+    with (
+        ProcessPoolExecutor(1, mp_context=mp) as processes,
+        ThreadPoolExecutor(4) as threads,
+    ):
+        processes.submit(read, path).result()
+        waiters = [threads.submit(wait_for_change, path, before, 10) for _ in range(4)]
+        writer = processes.submit(write, path, 0.1)
+        assert [waiter.result() for waiter in waiters] == [before + 1] * 4
+        writer.result()
+        watchers = [
+            thread
+            for thread in threading.enumerate()
+            if thread.name == "dreadlocks-watcher"
+        ]
+        assert len(watchers) <= 1
+
+        async def main():
+            writer = processes.submit(write, path, 0.1)
+            generation = await await_for_change(path, before + 1, 10)
+            writer.result()
+            return generation
+
+        assert asyncio.run(main()) == before + 2
+
+
+def test_timeout(path: str):
+    before = read(path)
+    started = monotonic()
+    assert wait_for_change(path, before, 0.1) == before
+    assert monotonic() - started >= 0.1
+    assert wait_for_change(path, before - 1, 0) == before
+
+
+def test_polling(monkeypatch: pytest.MonkeyPatch, path: str):
+    monkeypatch.setattr(watch, "_get_watcher", lambda: None)
+    before = read(path)
+    with ThreadPoolExecutor(1) as threads:
+        writer = threads.submit(write, path, 0.1)
+        assert wait_for_change(path, before, 10) == before + 1
+        writer.result()
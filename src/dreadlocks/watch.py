@@ -0,0 +1,253 @@
+import asyncio
+import ctypes
+import os
+import sys
+from struct import Struct
+from threading import Event, Lock, Thread
+from typing import Any, Callable, Optional
+
+from .deadline import absolute_deadline, remaining
+from .generation import _counter_path  # type: ignore [reportPrivateUsage]
+from .generation import ageneration_lock, generation_lock
+from .platform import is_windows
+
+_IN_MODIFY = 0x2
+_IN_ATTRIB = 0x4
+_IN_DELETE_SELF = 0x400
+_IN_MOVE_SELF = 0x800
+_IN_IGNORED = 0x8000
+_IN_CLOEXEC = 0o2000000
+
+# NOTE: Counters are written in place, and replaced or removed along with the
+# files holding them.
+_mask = _IN_MODIFY | _IN_ATTRIB | _IN_DELETE_SELF | _IN_MOVE_SELF
+
+_event = Struct("iIII")
+
+_poll_interval = 0.05
+"""How often waiters check counters, in seconds, without inotify"""
+
+
+def _load_libc() -> Optional[Any]:
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+
+def _os_error(path: Optional[str] = None) -> OSError:
+    code = ctypes.get_errno()
+    return OSError(code, os.strerror(code), path)
+
+
+class _Watcher(Thread):
+    """Reads inotify events on counter files, and wakes up their waiters, for
+    all threads and tasks of the process"""
+
+    def __init__(self, libc: Any):
+        super().__init__(name="dreadlocks-watcher", daemon=True)
+        self._libc = libc
+        self.fd: int = libc.inotify_init1(_IN_CLOEXEC)
+        if self.fd < 0:
+            raise _os_error()
+        self._lock = Lock()
+        self._callbacks: dict[int, list[Callable[[], None]]] = {}
+
+    def watch(self, path: str, callback: Callable[[], None]) -> int:
+        """Calls callback from the watcher thread once path changes, until
+        unwatched"""
+        with self._lock:
+            wd: int = self._libc.inotify_add_watch(self.fd, os.fsencode(path), _mask)
+            if wd < 0:
+                raise _os_error(path)
+            # NOTE: Paths of the same file share a watch descriptor.
+            self._callbacks.setdefault(wd, []).append(callback)
+        return wd
+
+    def unwatch(self, wd: int, callback: Callable[[], None]) -> None:
+        with self._lock:
+            callbacks = self._callbacks.get(wd)
+            if callbacks is None:
+                # NOTE: The file is gone, and the watch with it.
+                return
+            callbacks.remove(callback)
+            if not callbacks:
+                del self._callbacks[wd]
+                self._libc.inotify_rm_watch(self.fd, wd)
+
+    def run(self):
+        while True:
+            data = os.read(self.fd, 65536)
+            woken: list[Callable[[], None]] = []
+            with self._lock:
+                offset = 0
+                while offset < len(data):
+                    wd, mask, _, length = _event.unpack_from(data, offset)
+                    offset += _event.size + length
+                    if mask & _IN_IGNORED:
+                        woken.extend(self._callbacks.pop(wd, ()))
+                    else:
+                        woken.extend(self._callbacks.get(wd, ()))
+            for callback in woken:
+                callback()
+
+
+_watcher: Optional[_Watcher] = None
+_watcher_lock = Lock()
+
+
+def _get_watcher() -> Optional[_Watcher]:
+    """The watcher of the process, started on first use, None without
+    inotify"""
+    global _watcher
+    if _libc is None:
+        return None
+    with _watcher_lock:
+        if _watcher is None:
+            try:
+                _watcher = _Watcher(_libc)
+            except OSError:
+                # NOTE: Too many inotify instances, waiters poll instead.
+                return None
+            _watcher.start()
+        return _watcher
+
+
+def _watch(path: str, callback: Callable[[], None]) -> Optional[int]:
+    """Watches path if possible, otherwise waiters poll it"""
+    watcher = _get_watcher()
+    if watcher is None:
+        return None
+    try:
+        return watcher.watch(path, callback)
+    except OSError:
+        # NOTE: The counter does not exist yet, or there are too many watches.
+        return None
+
+
+def _unwatch(wd: Optional[int], callback: Callable[[], None]):
+    if wd is not None and _watcher is not None:
+        _watcher.unwatch(wd, callback)
+
+
+def _wait_time(wd: Optional[int], deadline: Optional[float]) -> Optional[float]:
+    left = remaining(deadline)
+    if wd is not None:
+        return left
+    return _poll_interval if left is None else min(left, _poll_interval)
+
+
+def wait_for_change(
+    path: str,
+    generation: int,
+    timeout: Optional[float] = None,
+    counter: Optional[str] = None,
+) -> int:
+    """Waits for the generation of the data a path protects to change, see
+    :func:`dreadlocks.generation_lock`.
+
+    On Linux, the current thread sleeps until the counter file is modified,
+    which exclusive holders do when they release a lock they marked dirty. A
+    single background thread reads inotify events for all waiters of the
+    process. Elsewhere, the counter is checked periodically. The generation is
+    read with the path held shared, so that it is only returned once the
+    writer released the path.
+
+    Parameters
+    ----------
+    path
+        The locked path, which must not be held by the current thread.
+    generation
+        The generation the caller last saw.
+    timeout
+        How long to wait, in seconds, if at all. Waiting is also bounded by
+        :func:`dreadlocks.deadline` scopes.
+    counter
+        The file holding the generation. See
+        :func:`dreadlocks.generation_lock`.
+
+    Returns
+    -------
+    int
+        The new generation, or the given one if it did not change in time.
+    """
+    deadline = absolute_deadline(timeout)
+    counter = _counter_path(path, counter)
+    while True:
+        changed = Event()
+        # NOTE: The watch is set up before reading the generation, so that no
+        # change goes unnoticed in between.
+        wd = _watch(counter, changed.set)
+        try:
+            with generation_lock(
+                path, shared=True, timeout=remaining(deadline), counter=counter
+            ) as lock:
+                if lock.generation != generation:
+                    return lock.generation
+            if remaining(deadline) == 0:
+                return generation
+            changed.wait(_wait_time(wd, deadline))
+        finally:
+            _unwatch(wd, changed.set)
+
+
+async def await_for_change(
+    path: str,
+    generation: int,
+    timeout: Optional[float] = None,
+    counter: Optional[str] = None,
+) -> int:
+    """Waits for the generation of the data a path protects to change, on
+    behalf of the current asyncio task.
+
+    Asynchronous counterpart of :func:`dreadlocks.wait_for_change`, with the
+    same parameters. The task sleeps without blocking the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = absolute_deadline(timeout)
+    counter = _counter_path(path, counter)
+    while True:
+        changed = asyncio.Event()
+
+        def notify():
+            try:
+                loop.call_soon_threadsafe(changed.set)
+            except RuntimeError:
+                # NOTE: The event loop was closed meanwhile.
+                pass
+
+        wd = _watch(counter, notify)
+        try:
+            async with ageneration_lock(
+                path, shared=True, timeout=remaining(deadline), counter=counter
+            ) as lock:
+                if lock.generation != generation:
+                    return lock.generation
+            if remaining(deadline) == 0:
+                return generation
+            try:
+                await asyncio.wait_for(changed.wait(), _wait_time(wd, deadline))
+            except asyncio.TimeoutError:
+                pass
+        finally:
+            _unwatch(wd, notify)
+
+
+def _forget_watcher():
+    """Lets a child process start its own watcher, leaving the parent's alone"""
+    global _watcher, _watcher_lock
+    _watcher_lock = Lock()
+    if _watcher is not None:
+        os.close(_watcher.fd)
+        _watcher = None
+
+
+if not is_windows:
+    os.register_at_fork(after_in_child=_forget_watcher)